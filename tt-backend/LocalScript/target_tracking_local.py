@@ -10,13 +10,22 @@ from datetime import datetime, date, timedelta
 import time
 import pandas as pd
 import boto3
+import requests
 import json
+import io
+import zipfile
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QApplication, QWidget, QCalendarWidget, QPushButton, QGridLayout, QLabel, QMessageBox, QLineEdit, QSpacerItem, QSizePolicy, QProgressBar
 from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal
 from PyQt5.QtGui import QPalette, QTextCharFormat, QIcon, QFont
 
+# Reports are totaled with the target-tracking function's own code, so both classify projects the same way
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import target_tracking
+
 DEBUG = True
 # Wait at most 5 seconds for any Selenium action to occur
 WAIT = 5
@@ -30,12 +39,39 @@ FILE_PATH_BACKUP = "Reports/report_old.csv"
 ERROR_FOLDER = "Errors"
 # This is the path to the error report
 ERROR_PATH = "Errors/errors.txt"
+# This is where YTD mismatches are written out
+DISCR_PATH = "Discrepancies/discrepancies.txt"
+# How often in seconds a download is checked while waiting for it to finish
+DOWNLOAD_POLL = 0.05
+# Each browser in the report pool downloads into its own folder under here
+POOL_FOLDER = "Pool"
+# Most browser sessions generating reports at the same time. Kept low so Unanet does not rate limit us
+REPORT_WORKERS = 3
+# Number of weeks covered by each report the pool generates
+POOL_WEEKS = 13
 # This is where the downloaded YTD reports get saved
 YTD_FOLDER = "YTD"
 # This is the path to the YTD report
 YTD_PATH = "YTD/report.csv"
 # The s3 bucket name
 TT_BUCKET = "target-tracking-selenium"
+# Folder that weekly reports are staged under for a batch ingest
+BATCH_PREFIX = "Batch/"
+# Position of the saved reports in Unanet. The dated report has the same columns plus the date of each entry
+SAVED_REPORT = 0
+DATED_REPORT = 1
+# CSV export URL of each saved report. Reports without one are always downloaded through the browser
+REPORT_EXPORT_URLS = {SAVED_REPORT: "", DATED_REPORT: ""}
+# Query parameters the export URL takes for the date range
+EXPORT_START_PARAM = "beginDate"
+EXPORT_END_PARAM = "endDate"
+# Name of the entry date column in the dated report
+DATE_COLUMN = "Date"
+# Columns the target-tracking lambda reads from a report
+REPORT_COLUMNS = ['Person', 'Project', 'Hours']
+
+# Unanet home page. It shows the login form when there is no session
+UNANET_HOME = "https://attainit-byteratio.unanet.biz/attainit-byteratio/action/home"
 
 LAMBDA_FUNCTION = "target-tracking"
 # This is a filler value. We just need a key to know what function to run in lambda
@@ -176,6 +212,10 @@ class BackgroundFunctions(QObject):
             return
         
         reportTotals = getReportYTD()
+        if isinstance(reportTotals, str):
+            writeError(reportTotals)
+            self.finished.emit(reportTotals)
+            return
 
         err = compareYTDTotals(dynamoTotals, reportTotals)
         self.progress.emit(100)
@@ -545,135 +585,337 @@ class QtGUI(QWidget):
                     self.clearQTLayout()
 
 # This function uses Selenium to automate the report generation on Unanet
-def generateReport(start_date, end_date, folder):
-    currDir = os.getcwd()
-    downloadPath = os.path.join(currDir, folder)
-
-    chrome_options = webdriver.ChromeOptions()
-    # chrome_options.add_argument("start-maximized")
-    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    chrome_options.add_experimental_option("useAutomationExtension", False)
-    chrome_options.add_argument("--disable-extensions")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_experimental_option(
-        "prefs", {"download.default_directory": downloadPath,
-                "download.prompt_for_download": False,
-                "credentials_enable_service": False,
-                "profile.password_manager_enabled": False,
-        }
-    )
-    # DISABLE THE FILE DOWNLOAD ANIMATION
-    chrome_options.add_argument("--animation-duration-scale=0")
-    # DISABLE GUI
-    chrome_options.add_argument("--headless=new")
-    # DISABLE NOTIFICATIONS
-    chrome_options.add_argument("--disable-notifications")
-    if DEBUG:
-        # KEEP THE WINDOW OPEN
-        chrome_options.add_experimental_option("detach", True)
-
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get("https://attainit-byteratio.unanet.biz/attainit-byteratio/action/home")
-
-    global TT_username
-    global TT_password
-
-    username_XPATH = '//*[@id="username"]'
-    # Locate the login field
-    try:
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, username_XPATH))
-        )[0]
-        # Enter the login
-        driver.find_element(By.XPATH, username_XPATH).send_keys(str(TT_username))
-    except Exception as e:
-        return e
+# This function blocks until a download has finished and returns "Success", or an error after timeout seconds without progress
+# Chrome writes into "<name>.crdownload" and renames it when done, so the download is complete once the file exists,
+# no partial file is left in the folder, and its size has stopped changing
+def waitForDownload(file_path, timeout):
+    folder = os.path.dirname(file_path) or "."
+    start_time = time.time()
+    lastSize = -1
+    partialSize = -1
+
+    while time.time() - start_time <= timeout:
+        partials = [os.path.join(folder, file) for file in os.listdir(folder) if file.endswith(".crdownload")]
+        if partials:
+            # A growing partial file is progress, so large reports are not cut off by the timeout
+            size = sum(os.path.getsize(partial) for partial in partials if os.path.exists(partial))
+            if size != partialSize:
+                partialSize = size
+                start_time = time.time()
+            lastSize = -1
+        elif os.path.exists(file_path):
+            size = os.path.getsize(file_path)
+            if size == lastSize:
+                return "Success"
+            lastSize = size
+        time.sleep(DOWNLOAD_POLL)
 
-    password_XPATH = '//*[@id="password"]'
-    try:
-        # Locate the login field
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, password_XPATH))
-        )[0]
-        # Enter the login
-        driver.find_element(By.XPATH, password_XPATH).send_keys(str(TT_password))
-    except Exception as e:
-        return e
+    return TimeoutError(f"File not found within {timeout} seconds: {file_path}")
 
-    loginBtn_XPATH = '//*[@id="button_ok"]'
-    try:
-        # Clicking login
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, loginBtn_XPATH))
-        )[0].click()
-    except Exception as e:
-        return e
+# This class keeps one logged-in Chrome driver for as long as the application is open
+# Each report only changes the download folder and date range. The driver is restarted if it dies and logs in again if Unanet logs it out
+class UnanetSession:
+    def __init__(self):
+        self.driver = None
+        self.http = None
+
+    def startDriver(self):
+        chrome_options = webdriver.ChromeOptions()
+        # chrome_options.add_argument("start-maximized")
+        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        chrome_options.add_experimental_option("useAutomationExtension", False)
+        chrome_options.add_argument("--disable-extensions")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_experimental_option(
+            "prefs", {"download.prompt_for_download": False,
+                    "credentials_enable_service": False,
+                    "profile.password_manager_enabled": False,
+            }
+        )
+        # DISABLE THE FILE DOWNLOAD ANIMATION
+        chrome_options.add_argument("--animation-duration-scale=0")
+        # DISABLE GUI
+        chrome_options.add_argument("--headless=new")
+        # DISABLE NOTIFICATIONS
+        chrome_options.add_argument("--disable-notifications")
+        if DEBUG:
+            # KEEP THE WINDOW OPEN
+            chrome_options.add_experimental_option("detach", True)
+
+        self.driver = webdriver.Chrome(options=chrome_options)
+
+    # The driver is healthy as long as the browser still answers
+    def isAlive(self):
+        if self.driver is None:
+            return False
+        try:
+            self.driver.current_url
+            return True
+        except Exception:
+            return False
 
-    report_XPATH = '//*[@id="my_reports"]/ul/li/a'
-    try:
-        # Clicking the saved report
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, report_XPATH))
-        )[0].click()
-    except Exception as e:
-        return e
+    def quit(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+        self.driver = None
+        self.http = None
 
-    criteria_XPATH = '//*[@id="nav-links-top"]/a[1]'
-    try:
-        # Clicking the criteria
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, criteria_XPATH))
-        )[0].click()
-    except Exception as e:
-        return e
-    
-    startDate_XPATH = '//*[@id="range"]/input[1]'
-    try:
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, startDate_XPATH))
-        )[0]
-        driver.find_element(By.XPATH, startDate_XPATH).clear()
-        driver.find_element(By.XPATH, startDate_XPATH).send_keys(start_date) 
-    except Exception as e:
-        return e
+    def login(self):
+        driver = self.driver
 
-    endDate_XPATH = '//*[@id="range"]/input[2]'
-    try:
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, endDate_XPATH))
-        )[0]
-        driver.find_element(By.XPATH, endDate_XPATH).clear()
-        driver.find_element(By.XPATH, endDate_XPATH).send_keys(end_date) 
-    except Exception as e:
-        return e
+        global TT_username
+        global TT_password
 
-    RT_XPATH = '//*[@id="body"]/div/form[2]/table/tbody/tr[9]/td[2]/select/option[12]'
-    try:
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, RT_XPATH))
-        )[0].click()
-    except Exception as e:
-        return e
+        username_XPATH = '//*[@id="username"]'
+        # Locate the login field
+        try:
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, username_XPATH))
+            )[0]
+            # Enter the login
+            driver.find_element(By.XPATH, username_XPATH).send_keys(str(TT_username))
+        except Exception as e:
+            return e
+
+        password_XPATH = '//*[@id="password"]'
+        try:
+            # Locate the login field
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, password_XPATH))
+            )[0]
+            # Enter the login
+            driver.find_element(By.XPATH, password_XPATH).send_keys(str(TT_password))
+        except Exception as e:
+            return e
+
+        loginBtn_XPATH = '//*[@id="button_ok"]'
+        try:
+            # Clicking login
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, loginBtn_XPATH))
+            )[0].click()
+        except Exception as e:
+            return e
+
+        return "Success"
+
+    # This function opens the home page, starting the browser or logging in again only when needed
+    def openHome(self):
+        if not self.isAlive():
+            self.quit()
+            try:
+                self.startDriver()
+            except Exception as e:
+                return e
 
-    # Use the upper button because Selenium can't track the bottom one
-    download_XPATH = '//*[@id="body"]/div/form[2]/table/tbody/tr[1]/td/a[2]'
-    try:
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, download_XPATH))
-        )[0].click()
-    except Exception as e:
-        return e
+        try:
+            self.driver.get(UNANET_HOME)
+        except Exception as e:
+            self.quit()
+            return e
+
+        # The login form only shows up when the session has expired (or on the first visit)
+        if self.driver.find_elements(By.ID, "username"):
+            return self.login()
+        return "Success"
+
+    # This function builds an HTTP session from the browser's login cookies, logging in first if needed
+    def httpSession(self):
+        if self.http is None:
+            err = self.openHome()
+            if err != "Success":
+                return err
+
+            http = requests.Session()
+            for cookie in self.driver.get_cookies():
+                http.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+            self.http = http
+        return self.http
+
+    # This function downloads a saved report's CSV export straight over HTTP, without rendering any pages
+    # An expired session gets the login page back instead of a CSV, so it logs in again once and retries
+    def downloadReport(self, start_date, end_date, folder, report=SAVED_REPORT):
+        exportURL = REPORT_EXPORT_URLS.get(report)
+        if not exportURL:
+            return Exception("No export URL is set for saved report " + str(report))
+
+        for attempt in range(2):
+            http = self.httpSession()
+            if not isinstance(http, requests.Session):
+                return http
+
+            try:
+                response = http.get(exportURL, params={EXPORT_START_PARAM: start_date, EXPORT_END_PARAM: end_date}, timeout=WAIT * 6)
+            except Exception as e:
+                return e
+
+            if response.status_code == 200 and 'html' not in response.headers.get('Content-Type', ''):
+                break
+            self.http = None
+        else:
+            return Exception("Report export returned " + str(response.status_code) + " instead of a CSV")
 
-    # Make sure report has been uploaded
-    start_time = time.time()
-    while not os.path.exists(folder + "/report.csv"):
-        if time.time() - start_time > WAIT:
-            return TimeoutError(f"File not found within {WAIT} seconds: {folder}/report.csv")
-        time.sleep(0.2)
-    
-    driver.quit()
-    return "Success"
+        # Write next to the final name first so nothing reads a half written report
+        filePath = os.path.join(folder, "report.csv")
+        with open(filePath + ".part", 'wb') as reportFile:
+            reportFile.write(response.content)
+        os.replace(filePath + ".part", filePath)
+        return "Success"
+
+    def generateReport(self, start_date, end_date, folder, report=SAVED_REPORT):
+        currDir = os.getcwd()
+        downloadPath = os.path.join(currDir, folder)
+
+        err = self.openHome()
+        if err != "Success":
+            return err
+        driver = self.driver
+
+        try:
+            # Every report can go to a different folder without restarting the browser
+            driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": downloadPath})
+        except Exception as e:
+            return e
+
+        report_XPATH = '//*[@id="my_reports"]/ul/li/a'
+        try:
+            # Clicking the saved report
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, report_XPATH))
+            )[report].click()
+        except Exception as e:
+            return e
+
+        criteria_XPATH = '//*[@id="nav-links-top"]/a[1]'
+        try:
+            # Clicking the criteria
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, criteria_XPATH))
+            )[0].click()
+        except Exception as e:
+            return e
+        
+        startDate_XPATH = '//*[@id="range"]/input[1]'
+        try:
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, startDate_XPATH))
+            )[0]
+            driver.find_element(By.XPATH, startDate_XPATH).clear()
+            driver.find_element(By.XPATH, startDate_XPATH).send_keys(start_date) 
+        except Exception as e:
+            return e
+
+        endDate_XPATH = '//*[@id="range"]/input[2]'
+        try:
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, endDate_XPATH))
+            )[0]
+            driver.find_element(By.XPATH, endDate_XPATH).clear()
+            driver.find_element(By.XPATH, endDate_XPATH).send_keys(end_date) 
+        except Exception as e:
+            return e
+
+        RT_XPATH = '//*[@id="body"]/div/form[2]/table/tbody/tr[9]/td[2]/select/option[12]'
+        try:
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, RT_XPATH))
+            )[0].click()
+        except Exception as e:
+            return e
+
+        # Use the upper button because Selenium can't track the bottom one
+        download_XPATH = '//*[@id="body"]/div/form[2]/table/tbody/tr[1]/td/a[2]'
+        try:
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, download_XPATH))
+            )[0].click()
+        except Exception as e:
+            return e
+
+        # Make sure report has been downloaded
+        return waitForDownload(folder + "/report.csv", WAIT)
+
+# The session is shared by every report the application generates
+unanetSession = UnanetSession()
+
+# Reports with an export URL are downloaded directly. The browser is only used when that is not possible
+# The shared session is used unless the caller brings its own (each ReportPool worker has one)
+def generateReport(start_date, end_date, folder, report=SAVED_REPORT, session=None):
+    if session is None:
+        session = unanetSession
+
+    if REPORT_EXPORT_URLS.get(report):
+        err = session.downloadReport(start_date, end_date, folder, report)
+        if err == "Success":
+            return err
+        print("Direct report download failed, using the browser instead: " + str(err))
+
+    return session.generateReport(start_date, end_date, folder, report)
+
+# This class generates several reports at the same time, each in its own logged-in browser and download folder
+# At most REPORT_WORKERS browsers are open at once
+class ReportPool:
+    def __init__(self, workers=REPORT_WORKERS):
+        self.workers = workers
+        self.sessions = queue.Queue()
+        for i in range(workers):
+            folder = POOL_FOLDER + "/worker" + str(i)
+            os.makedirs(folder, exist_ok=True)
+            self.sessions.put((UnanetSession(), folder))
+
+    def runJob(self, job):
+        start_date, end_date, report = job
+        session, folder = self.sessions.get()
+        try:
+            if os.path.exists(folder + "/report.csv"):
+                os.remove(folder + "/report.csv")
+
+            err = generateReport(start_date, end_date, folder, report, session)
+            if err != "Success":
+                return err
+            return pd.read_csv(folder + "/report.csv")
+        finally:
+            self.sessions.put((session, folder))
+
+    # This function generates every (start_date, end_date, report) job and returns the reports as dataframes in job order
+    # progress is called with the number of finished jobs after each one completes
+    def generate(self, jobs, progress=None):
+        results = [None] * len(jobs)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.runJob, job): i for i, job in enumerate(jobs)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    results[futures[future]] = e
+                if progress is not None:
+                    progress(done)
+        return results
+
+    def close(self):
+        while not self.sessions.empty():
+            session, folder = self.sessions.get()
+            session.quit()
+
+# This function splits Jan 1 to end_date into Saturday to Friday ranges of POOL_WEEKS weeks for the report pool
+# The first range starts on Jan 1 and ends on the first Friday so every later range lines up with the pay periods
+def poolRanges(start_date, end_date):
+    ranges = []
+    rangeEnd = start_date
+    while rangeEnd.weekday() != 4 and rangeEnd < end_date:
+        rangeEnd += timedelta(days=1)
+    ranges.append((start_date, rangeEnd))
+
+    rangeStart = rangeEnd + timedelta(days=1)
+    while rangeStart <= end_date:
+        rangeEnd = min(rangeStart + timedelta(weeks=POOL_WEEKS, days=-1), end_date)
+        ranges.append((rangeStart, rangeEnd))
+        rangeStart = rangeEnd + timedelta(days=1)
+    return ranges
 
 # This function maintains a copy of the past report and creates space for the new one locally
 def replaceTimecardFiles():
@@ -699,12 +941,10 @@ def uploadTimecardFile(end_date):
         if result['statusCode'] == 500:
             return "An error occurred in\nthe lambda function"
 
-        # Make sure report has been uploaded
-        start_time = time.time()
-        while not os.path.exists(FILE_PATH_CURRENT):
-            if time.time() - start_time > WAIT:
-                return TimeoutError(f"File not found within {WAIT} seconds: {FILE_PATH_CURRENT}")
-            time.sleep(0.2)
+        # Make sure report has been downloaded
+        err = waitForDownload(FILE_PATH_CURRENT, WAIT)
+        if err != "Success":
+            return err
         
         # Add new report
         end_date = (datetime.strptime(end_date, "%m/%d/%Y")).strftime("%Y-%m-%d")
@@ -716,6 +956,127 @@ def uploadTimecardFile(end_date):
     
     return "Success"
 
+# This function splits a dated report into Saturday to Friday weeks, named after the day each week ends
+# The first week of the year starts on Jan 1 and the last one is cut off at Dec 31, like the weekly reports
+def splitReportByWeek(report_path, year):
+    # Make sure report has been downloaded
+    err = waitForDownload(report_path, WAIT)
+    if err != "Success":
+        return err
+
+    reportDF = pd.read_csv(report_path)
+    if DATE_COLUMN not in reportDF.columns:
+        return None
+
+    dates = pd.to_datetime(reportDF[DATE_COLUMN])
+    inYear = dates.dt.year == year
+    reportDF = reportDF[inYear]
+    dates = dates[inYear]
+
+    # Every day belongs to the week ending on the next Friday (weekday 4)
+    weekEnds = dates + pd.to_timedelta((4 - dates.dt.weekday) % 7, unit='D')
+    weekEnds = weekEnds.where(weekEnds.dt.year == year, pd.Timestamp(year, 12, 31))
+
+    weeks = {}
+    for weekEnd, rows in reportDF.groupby(weekEnds):
+        weeks[weekEnd.strftime("%Y-%m-%d")] = rows[REPORT_COLUMNS]
+    return weeks
+
+# This function returns the week number a report ending on week_end is stored under in DynamoDB
+# The last days of December are the "53rd" week so they do not overwrite the first week of the year
+def reportWeek(week_end):
+    week = week_end.isocalendar()[1]
+    if week_end.month == 12 and week == 1:
+        week = 53
+    return week
+
+# This function returns the end date of a stored week, for weeks that have no rows in the report
+def weekEndDate(week, year):
+    if week == 53:
+        return date(year, 12, 31).strftime("%Y-%m-%d")
+    return min(date.fromisocalendar(year, week, 5), date(year, 12, 31)).strftime("%Y-%m-%d")
+
+# This function lists the employees whose DynamoDB and report YTD totals differ
+def mismatchedEmployees(dynamoTotals, reportTotals):
+    mismatched = []
+    for employee in reportTotals:
+        if employee not in dynamoTotals:
+            mismatched.append(employee)
+        elif round(dynamoTotals[employee]['Direct'], 2) != round(reportTotals[employee]['Direct'], 2) or round(dynamoTotals[employee]['Indirect'], 2) != round(reportTotals[employee]['Indirect'], 2):
+            mismatched.append(employee)
+    return mismatched
+
+# This function compares every week of the dated report with DynamoDB for the mismatched employees
+# Only their rows in the weeks that differ are returned, so only the edited weeks get written again
+def divergentWeeks(weeks, dynamoWeeks, employees, year, last_week, identity):
+    noHours = {'Direct': 0.0, 'Indirect': 0.0}
+
+    # Employees who no longer have hours in a week still need a row to write zero hours
+    names = {}
+    reportWeeks = {}
+    for weekEnd, rows in weeks.items():
+        rowIDs = rows['Person'].map(lambda employeeName: target_tracking.reportEmployeeID(employeeName, year, identity))
+        for employeeID, employeeName in zip(rowIDs, rows['Person']):
+            names.setdefault(employeeID, employeeName)
+        weekNumber = str(reportWeek(datetime.strptime(weekEnd, "%Y-%m-%d").date()))
+        reportWeeks[weekNumber] = (weekEnd, rows, rowIDs, totalHours(rows, year, identity))
+
+    staged = {}
+    for employee in employees:
+        if employee not in names:
+            continue
+
+        storedWeeks = {week: hours for week, hours in dynamoWeeks.get(employee, {}).items() if int(week) <= last_week}
+        for weekNumber in sorted(set(storedWeeks) | set(reportWeeks), key=int):
+            if weekNumber in reportWeeks:
+                weekEnd, rows, rowIDs, totals = reportWeeks[weekNumber]
+                employeeRows = rows[rowIDs == employee]
+            else:
+                weekEnd = weekEndDate(int(weekNumber), year)
+                totals = {}
+                employeeRows = pd.DataFrame(columns=REPORT_COLUMNS)
+
+            reported = totals.get(employee, noHours)
+            stored = storedWeeks.get(weekNumber, noHours)
+            if round(reported['Direct'], 2) == round(stored['Direct'], 2) and round(reported['Indirect'], 2) == round(stored['Indirect'], 2):
+                continue
+
+            if employeeRows.empty:
+                employeeRows = pd.DataFrame([{'Person': names[employee], 'Project': '', 'Hours': 0.0}])
+            staged[weekEnd] = pd.concat([staged[weekEnd], employeeRows]) if weekEnd in staged else employeeRows
+
+    return staged
+
+# This function uploads the weekly reports to the batch run folder as a single archive
+def stageWeeklyReports(run_prefix, weeks):
+    try:
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zipped:
+            for weekEnd, rows in weeks.items():
+                zipped.writestr(weekEnd + ".csv", rows.to_csv(index=False))
+
+        s3_client.put_object(Bucket=TT_BUCKET, Key=run_prefix + "weeks.zip", Body=archive.getvalue())
+    except Exception as e:
+        return e
+
+    return "Success"
+
+# This function ingests every report staged under the batch run folder in a single lambda call
+def ingestBatch(run_prefix):
+    global local_username
+    global local_password
+
+    payload = {
+        "tt-batch": run_prefix,
+        "username": local_username,
+        "password": local_password
+    }
+    result = invoke_lambda_function(payload)
+    if result['statusCode'] == 500:
+        return "An error occurred in\nthe lambda function"
+
+    return "Success"
+
 # This function removes the old YTD report
 def replaceYTDFile():
     for file in os.listdir(YTD_FOLDER + "/"):
@@ -736,47 +1097,72 @@ def getDynamoYTD(year):
         return "ERROR"
     return result
 
+# This function gets every employee's stored weekly hours from DynamoDB
+def getDynamoWeeks(year):
+    global local_username
+    global local_password
+
+    payload = {
+        "getDynamoWeeks": year,
+        "username": local_username,
+        "password": local_password
+    }
+    result = invoke_lambda_function(payload)
+    if 'statusCode' in result:
+        return "ERROR"
+    return result
+
+# This function gets the Unanet/Microsoft name discrepency dictionary and indexes it the way the lambda function does
+# Report IDs are built from it, so they match the IDs getDynamoYTD and getDynamoWeeks return
+def getIdentityIndex():
+    global local_username
+    global local_password
+
+    payload = {
+        "getNames": LAMBDA_VALUE,
+        "username": local_username,
+        "password": local_password
+    }
+    result = invoke_lambda_function(payload)
+    if 'statusCode' in result:
+        return "ERROR"
+    return target_tracking.IdentityIndex(result)
+
 # This function totals employee direct and indirect hours from data in Unanet
-def getReportYTD():
+def getReportYTD(year=None, identity=None):
     reportFile = YTD_PATH
 
-    currYear = str(datetime.now().year)
+    currYear = str(year if year is not None else datetime.now().year)
 
-    # Make sure report has been uploaded
-    start_time = time.time()
-    while not os.path.exists(YTD_PATH):
-        if time.time() - start_time > WAIT:
-            return TimeoutError(f"File not found within {WAIT} seconds: {YTD_PATH}")
-        time.sleep(0.2)
+    # Make sure report has been downloaded
+    err = waitForDownload(YTD_PATH, WAIT)
+    if err != "Success":
+        return err
         
     # Creating a dataframe from the report
     reportCSV = pd.read_csv(reportFile)
     reportDF = pd.DataFrame(reportCSV)
 
-    totalHoursDict = {}
-
-    # Totaling everyone's direct and indirect hours from the report
-    for row in reportDF.index:
-        employeeName = reportDF.loc[row,'Person']
-        firstname = employeeName.replace(",", "").split(" ")[1]
-        lastname = employeeName.replace(",", "").split(" ")[0]
-        employeeID = str(firstname) + str(lastname) + str(currYear)
+    if identity is None:
+        identity = getIdentityIndex()
+        if identity == "ERROR":
+            return "Error getting the\nname discrepencies"
 
-        if employeeID not in totalHoursDict.keys():
-            totalHoursDict[employeeID] = {'Indirect':0.0, 'Direct':0.0}
+    return totalHours(reportDF, currYear, identity)
 
-        if 'OH_BR' in reportDF.loc[row, 'Project'] or 'BEREAVEMENT' in reportDF.loc[row, 'Project'] or 'PARENTAL' in reportDF.loc[row, 'Project']:
-            totalHoursDict[employeeID]['Indirect'] += float(reportDF.loc[row, 'Hours'])
-        elif 'FLEX_TIME' in reportDF.loc[row, 'Project']:
-            continue
-        else:
-            totalHoursDict[employeeID]['Direct'] += float(reportDF.loc[row, 'Hours'])
-        
-    return totalHoursDict
+# This function totals every employee's direct and indirect hours in a report
+# Blank cells are read as empty strings, the way the target-tracking function reads an uploaded report
+# Each total also keeps the employee's Unanet name for the discrepancies file
+def totalHours(reportDF, year, identity):
+    rows = reportDF.astype(object).where(reportDF.notna(), '').to_dict('records')
+    totals = target_tracking.reportYTDTotals(rows, year, identity)
+    for person in set(row['Person'] for row in rows if isinstance(row['Person'], str) and row['Person'].strip()):
+        totals[target_tracking.reportEmployeeID(person, year, identity)]['Name'] = target_tracking.reportName(person).strip()
+    return totals
 
 # This function compares the DynamoDB and Unanet data for mismatches
 def compareYTDTotals(dynamoTotals, reportTotals):
-    outputFile = open('Discrepancies/discrepancies.txt', 'w')
+    outputFile = open(DISCR_PATH, 'w')
     mismatches = 0
     for employee in reportTotals:
         # Comparing each employee and writing to an output
@@ -784,8 +1170,7 @@ def compareYTDTotals(dynamoTotals, reportTotals):
             if round(dynamoTotals[employee]['Direct'], 2) == round(reportTotals[employee]['Direct'], 2) and round(dynamoTotals[employee]['Indirect'], 2) == round(reportTotals[employee]['Indirect'], 2):
                 pass
             else:
-                fullname = splitID(str(employee))
-                fullname = fullname[0] + " " + fullname[1][:-4]
+                fullname = reportTotals[employee].get('Name', employee[:-4])
                 outputFile.write('------------HOURS DO NOT MATCH FOR: ' + str(fullname) + '------------\n')
                 outputFile.write('Direct hours from Dynamo   : ' + str(round(dynamoTotals[employee]['Direct'], 2)) + '\n')
                 outputFile.write('Indirect hours from Dynamo : ' + str(round(dynamoTotals[employee]['Indirect'], 2)) + '\n')
@@ -799,25 +1184,9 @@ def compareYTDTotals(dynamoTotals, reportTotals):
             mismatches += 1
     return mismatches
 
-# This function splits the DynamoDB ID into a firstname, lastname format
-def splitID(s):
-    capitalCount = 0
-    splitPos = -1
-
-    for i, char in enumerate(s):
-        if char.isupper():
-            capitalCount += 1
-            if capitalCount == 2:
-                splitPos = i
-                break
-
-    if splitPos != -1:
-        return [s[:splitPos], s[splitPos:]]
-    else:
-        return [s]
-
-# This function corrects discrepencies in Dynamo and Unanet's YTD reports starting from the previous pay period and working backwards
-# It will preemptively end once the correction has been made
+# This function corrects discrepencies in Dynamo and Unanet's YTD reports
+# A single dated report from Jan 1 to the previous pay period is split into weeks and compared with DynamoDB week by week
+# Only the weeks that differ for the mismatched employees are ingested again
 def fixDynamoYTD(self, report_date):
     # Check if we need to replace the file
     replaceYTDFile()
@@ -844,7 +1213,14 @@ def fixDynamoYTD(self, report_date):
     if dynamoTotals == "ERROR":
         return "Error getting DynamoDB YTD totals"
     
-    reportTotals = getReportYTD()
+    # Report IDs are built from the name discrepencies, so they are fetched once for the whole run
+    identity = getIdentityIndex()
+    if identity == "ERROR":
+        return "Error getting the\nname discrepencies"
+
+    reportTotals = getReportYTD(report_date.year, identity)
+    if isinstance(reportTotals, str):
+        return reportTotals
 
     # Totals already match. No need to generate reports
     err = compareYTDTotals(dynamoTotals, reportTotals)
@@ -853,89 +1229,83 @@ def fixDynamoYTD(self, report_date):
         self.progress.emit(95)
         return "YTD records already match!"
 
-    firstDay = date(report_date.year, 1, 1)
-    
-    start_date = end_date
-    while start_date.weekday() != 5:
-        start_date -= timedelta(days=1)
-
     replaceTimecardFiles()
 
-    # Generate the first report of the year which could end on any day of the week
-
-    err = generateReport(start_date.strftime("%m/%d/%Y"), end_date.strftime("%m/%d/%Y"), REPORT_FOLDER)
-    if err != 'Success':
-        return err
-
-    err = uploadTimecardFile(end_date.strftime("%m/%d/%Y"))
-    if err != 'Success':
-        return err
-    
-    # This is a check for when the end date is not a Friday (when we generate on 12/31) so we don't generate the same report twice
-    if end_date.weekday() != 4:
-        while end_date.weekday() != 4:
-            end_date -= timedelta(days=1)
-    else:
-        end_date = end_date - timedelta(days=7)
-    start_date = end_date - timedelta(days=6)
-
-    currentWeek = datetime.now().isocalendar()[1]
-    progressInc = (int)((1 / currentWeek) * 90)
-
-    iterations = 0
-
-    # Go backwards from the current time period until the first day of the year
-    while start_date > firstDay:
-        iterations += 1
-
-        replaceTimecardFiles()
-
-        err = generateReport(start_date.strftime("%m/%d/%Y"), end_date.strftime("%m/%d/%Y"), REPORT_FOLDER)
-        self.progress.emit(5 + iterations * progressInc)
+    # The dated report for the year is generated in week ranges by several browsers at once, then put back together
+    jobs = [(rangeStart.strftime("%m/%d/%Y"), rangeEnd.strftime("%m/%d/%Y"), DATED_REPORT) for rangeStart, rangeEnd in poolRanges(start_date, end_date)]
+    pool = ReportPool(min(REPORT_WORKERS, len(jobs)))
+    try:
+        reports = pool.generate(jobs, lambda done: self.progress.emit(5 + (int)(done / len(jobs) * 45)))
+    finally:
+        pool.close()
+
+    for report in reports:
+        if not isinstance(report, pd.DataFrame):
+            return report
+    pd.concat(reports, ignore_index=True).to_csv(FILE_PATH_CURRENT, index=False)
+
+    weeks = splitReportByWeek(FILE_PATH_CURRENT, report_date.year)
+    if weeks is None:
+        return "The dated report is missing\nthe " + DATE_COLUMN + " column"
+    if isinstance(weeks, Exception):
+        return weeks
+
+    dynamoWeeks = getDynamoWeeks(report_date.year)
+    if dynamoWeeks == "ERROR":
+        return "Error getting DynamoDB\nweekly hours"
+
+    employees = mismatchedEmployees(dynamoTotals, reportTotals)
+    weeks = divergentWeeks(weeks, dynamoWeeks, employees, report_date.year, reportWeek(end_date), identity)
+    if weeks:
+        runPrefix = BATCH_PREFIX + datetime.now().strftime("%Y%m%d%H%M%S") + "/"
+
+        err = stageWeeklyReports(runPrefix, weeks)
+        self.progress.emit(70)
         if err != 'Success':
             return err
 
-        err = uploadTimecardFile(end_date.strftime("%m/%d/%Y"))
+        err = ingestBatch(runPrefix)
         if err != 'Success':
             return err
 
-        start_date -= timedelta(days=7)
-        end_date -= timedelta(days=7)
-
-        # Every two weeks, check if YTD has been corrected. If it has, no need to generate more reports
-        if iterations%2 == 0:
-            dynamoTotals = getDynamoYTD(report_date.year)
+    err = repairDriftedTotals(report_date.year, reportTotals)
+    self.progress.emit(100)
+    return err
 
-            if dynamoTotals == "ERROR":
-                return "Error getting DynamoDB YTD totals"
+# This function recomputes the running YTD totals of a year from the weekly hours stored in DynamoDB
+def repairYTD(year):
+    global local_username
+    global local_password
 
-            reportTotals = getReportYTD()
-            
-            mismatches = compareYTDTotals(dynamoTotals, reportTotals)
-            if mismatches == 0:
-                self.progress.emit(100)
-                return "Success"
-            
-    # Still need to generate the report running from Jan 1 to the first Friday
-    nextFriday = firstDay
-    while nextFriday.weekday() != 4:
-        nextFriday += timedelta(days=1)
-    
-    start_date = firstDay
-    end_date = nextFriday
+    payload = {
+        "repairYTD": year,
+        "username": local_username,
+        "password": local_password
+    }
+    result = invoke_lambda_function(payload)
+    if 'statusCode' in result:
+        return "An error occurred in\nthe lambda function"
+    return "Success"
 
-    replaceTimecardFiles()
-    # Generate the last report here since it may not match Saturday to Friday period
-    err = generateReport(start_date.strftime("%m/%d/%Y"), end_date.strftime("%m/%d/%Y"), REPORT_FOLDER)
-    if err != 'Success':
-        return err
+# This function runs once every week matches the report
+# Any totals that still differ come from running DirectYTD/IndirectYTD totals that drifted from the weeks, so those totals are recomputed
+def repairDriftedTotals(year, reportTotals):
+    dynamoTotals = getDynamoYTD(year)
+    if dynamoTotals == "ERROR":
+        return "Error getting DynamoDB YTD totals"
+    if compareYTDTotals(dynamoTotals, reportTotals) == 0:
+        return "Success"
 
-    err = uploadTimecardFile(end_date.strftime("%m/%d/%Y"))
+    err = repairYTD(year)
     if err != 'Success':
         return err
-    
-    self.progress.emit(100)
 
+    dynamoTotals = getDynamoYTD(year)
+    if dynamoTotals == "ERROR":
+        return "Error getting DynamoDB YTD totals"
+    mismatches = compareYTDTotals(dynamoTotals, reportTotals)
+    if mismatches > 0:
+        return str(mismatches) + " YTD totals still differ\nfrom the report after repairing them"
     return "Success"
 
 # This function writes error messages to the error file
@@ -967,6 +1337,8 @@ def main():
         sys.exit(app.exec_())
     except SystemExit:
         print('Closing Window...')
+    finally:
+        unanetSession.quit()
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,25 @@
-import pandas as pd
+import time
+# Measured before anything else is imported so the cold start log covers the whole module
+MODULE_INIT_STARTED = time.perf_counter()
+
 from datetime import datetime, date
+import os
 import boto3
-import io
 import json
+import re
+import io
+import csv
+import zipfile
+from urllib.parse import unquote_plus
+import random
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# pandas is only needed for the target and name files, so it is imported the first time one is read (see loadPandas)
+pd = None
 
 USERNAME = ""
 PASSWORD = ""
@@ -13,24 +30,289 @@ REPORT_PREFIX = "Reports/"
 TARGET_PREFIX = "Targets/"
 AUTO_PREFIX = "Auto/"
 NAME_PREFIX = "Names/"
-
-s3 = boto3.client('s3')
-dynamodb = boto3.client('dynamodb')
-secrets = boto3.client('secretsmanager')
+# Multi-week uploads go under a run folder here, e.g. "Batch/20250718093000/". This folder has no S3 trigger
+BATCH_PREFIX = "Batch/"
+
+# Projects containing any of these are counted as indirect hours
+INDIRECT_PROJECTS = ['OH_BR', 'BEREAVEMENT', 'PARENTAL']
+# Projects containing any of these are not counted toward direct or indirect hours
+EXCLUDED_PROJECTS = ['FLEX_TIME']
+
+# S3 accepts at most 1000 keys per DeleteObjects request
+DELETE_LIMIT = 1000
+# Rows parsed at a time when reading a CSV from S3. Memory stays flat no matter how large the file is
+CSV_CHUNK_ROWS = 5000
+# Report columns used when totaling hours
+REPORT_COLUMNS = ['Person', 'Project', 'Hours']
+# DynamoDB accepts at most 100 keys per BatchGetItem request
+BATCH_GET_LIMIT = 100
+# How many times unprocessed BatchGetItem keys are retried before giving up
+BATCH_RETRIES = 5
+# Weekly hour attributes. Each kind keeps a running total in <kind>YTD (DirectYTD / IndirectYTD)
+WEEK_ATTRIBUTE = re.compile(r'^(Direct|Indirect)([0-9]+)$')
+YTD_ATTRIBUTES = ['DirectYTD', 'IndirectYTD']
+# Number of table segments scanned in parallel
+SCAN_SEGMENTS = 4
+# Number of buffered employee updates written in parallel when a WriteBuffer is flushed
+WRITE_WORKERS = 8
+# DynamoDB calls that draw on the table's read or write capacity. Every one of them goes through a CapacityLimiter
+READ_OPERATIONS = {'get_item', 'batch_get_item', 'query', 'scan'}
+WRITE_OPERATIONS = {'update_item', 'put_item', 'delete_item', 'batch_write_item'}
+# Errors DynamoDB returns when the table is over capacity. They slow the limiter down before the request is retried
+THROTTLE_ERRORS = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+# Errors that are retried without slowing down
+RETRY_ERRORS = {'InternalServerError', 'ServiceUnavailable'}
+# How many times a throttled request is retried before the error is raised
+THROTTLE_RETRIES = 8
+# Capacity units per second assumed for on-demand tables, or when the table can't be described
+ON_DEMAND_CAPACITY = 1000
+# DynamoDB lets a table save up to 300 seconds of unused capacity for bursts
+BURST_SECONDS = 300
+# AIMD: a throttle multiplies the limiter's rate by THROTTLE_DECREASE, and every success adds RATE_STEP of the table's capacity back
+THROTTLE_DECREASE = 0.5
+RATE_STEP = 0.05
+# Targets are stored as Target, Target2, Target3... each time an employee's target changes
+MAX_TARGETS = 20
+
+# How long the names dictionary is reused across warm invocations, in seconds
+CACHE_TTL = 300
+# CloudWatch namespace for the metrics record every invocation prints
+METRICS_NAMESPACE = "TargetTracking"
+# Invocations with "profile": true, or every invocation when TARGET_TRACKING_PROFILE is set, are profiled
+# The profile and a summary are written to S3 under DIAGNOSTICS_PREFIX/<route>/<timestamp>/
+PROFILE_ENABLED = os.environ.get('TARGET_TRACKING_PROFILE', '').lower() in ('1', 'true', 'yes')
+DIAGNOSTICS_PREFIX = "Diagnostics/"
+# Number of functions and allocation sites listed in a profile summary
+PROFILE_TOP = 25
+
+# Reference data kept between warm Lambda invocations. Each entry is {'value', 'expires', 'version'}
+referenceCache = {}
+
+# Time spent loading lazy dependencies (pandas, AWS clients) during the current invocation, in seconds
+lazyInit = {'seconds': 0.0}
+# False once this container has handled an invocation
+coldStart = True
+
+# This class adds up one invocation's stage timings and counts, and prints them as a CloudWatch Embedded Metric Format record
+# Names ending in "Ms" are milliseconds. Pool threads add to the same totals, so DynamoDB time is summed over every request
+class InvocationMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.seen = {}
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+            self.seen = {}
+
+    def add(self, name, value):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    # Counts each key once per invocation, however many times it is reported (an employee in every week of a batch)
+    def addDistinct(self, name, keys):
+        with self.lock:
+            seen = self.seen.setdefault(name, set())
+            seen.update(keys)
+            self.values[name] = len(seen)
+
+    def get(self, name):
+        return self.values.get(name, 0)
+
+    # Times a stage. Time recorded under exclude while the stage runs (S3 downloads streamed into a parser) is left out
+    @contextmanager
+    def stage(self, name, exclude=None):
+        started = time.perf_counter()
+        excluded = self.get(exclude)
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            if exclude is not None:
+                elapsed -= self.get(exclude) - excluded
+            self.add(name, elapsed)
+
+    def record(self, route, coldStart):
+        with self.lock:
+            values = {name: round(value, 1) if name.endswith('Ms') else round(value, 2) for name, value in self.values.items()}
+        return dict({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['route']],
+                    'Metrics': [{'Name': name, 'Unit': 'Milliseconds' if name.endswith('Ms') else 'Count'} for name in values]
+                }]
+            },
+            'route': route,
+            'coldStart': coldStart
+        }, **values)
+
+metrics = InvocationMetrics()
+
+# This class creates its boto3 client the first time it is used, and keeps it for later warm invocations
+class LazyClient:
+    def __init__(self, service, **kwargs):
+        self.service = service
+        self.kwargs = kwargs
+        self.client = None
+        # Pool threads can make the first call at the same time
+        self.lock = threading.RLock()
+
+    def __getattr__(self, name):
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    started = time.perf_counter()
+                    self.client = boto3.client(self.service, **self.kwargs)
+                    lazyInit['seconds'] += time.perf_counter() - started
+        return getattr(self.client, name)
+
+# This class is a token bucket of DynamoDB capacity units
+# Its refill rate follows AIMD: it is cut when DynamoDB throttles and climbs back toward the table's capacity as requests succeed
+class CapacityLimiter:
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.rate = self.capacity
+        self.size = self.capacity * BURST_SECONDS
+        self.tokens = self.size
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.size, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # This function blocks until the bucket holds enough units for a request
+    def acquire(self, units=1.0):
+        units = min(float(units), self.size)
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= units:
+                    self.tokens -= units
+                    return
+                wait = (units - self.tokens) / self.rate
+            time.sleep(wait)
+
+    # Requests are admitted on an estimate. Once DynamoDB reports what was consumed, the difference is charged (or refunded)
+    def charge(self, units):
+        with self.lock:
+            self.tokens = min(self.size, self.tokens - units)
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.capacity * RATE_STEP, self.rate * THROTTLE_DECREASE)
+            # Being throttled means whatever burst we counted on is gone
+            self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.capacity, self.rate + self.capacity * RATE_STEP)
+
+# This function estimates the capacity units of a request before it is sent. Batches cost one unit per item
+def requestUnits(kwargs):
+    requestItems = kwargs.get('RequestItems')
+    if requestItems is None:
+        return 1.0
+    units = 0
+    for request in requestItems.values():
+        units += len(request['Keys']) if isinstance(request, dict) else len(request)
+    return float(max(units, 1))
+
+# This function totals the capacity units DynamoDB reports for a response, or returns None when it reports none
+def consumedUnits(response):
+    consumed = response.get('ConsumedCapacity')
+    if consumed is None:
+        return None
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return sum(float(capacity.get('CapacityUnits', 0.0)) for capacity in consumed)
+
+# This client sends every DynamoDB read and write through a CapacityLimiter sized from the table's provisioned capacity
+# Throttled requests are retried with jittered backoff instead of being lost, and the limiter slows down for everyone
+class ThrottledClient(LazyClient):
+    def __init__(self, service, **kwargs):
+        super().__init__(service, **kwargs)
+        self.limiters = None
+
+    def __getattr__(self, name):
+        method = super().__getattr__(name)
+        if name in READ_OPERATIONS:
+            return lambda **kwargs: self.call(method, 'read', kwargs)
+        if name in WRITE_OPERATIONS:
+            return lambda **kwargs: self.call(method, 'write', kwargs)
+        return method
+
+    def limiter(self, kind):
+        if self.limiters is None:
+            with self.lock:
+                if self.limiters is None:
+                    read, write = ON_DEMAND_CAPACITY, ON_DEMAND_CAPACITY
+                    try:
+                        table = self.describe_table(TableName=DYNAMO_TABLE)['Table']
+                        throughput = table.get('ProvisionedThroughput', {})
+                        # On-demand tables report 0 provisioned units
+                        read = throughput.get('ReadCapacityUnits') or ON_DEMAND_CAPACITY
+                        write = throughput.get('WriteCapacityUnits') or ON_DEMAND_CAPACITY
+                    except Exception as e:
+                        print(e)
+                    self.limiters = {'read': CapacityLimiter(read), 'write': CapacityLimiter(write)}
+        return self.limiters[kind]
+
+    def throttled(self, kind):
+        self.limiter(kind).throttled()
+
+    def call(self, method, kind, kwargs):
+        limiter = self.limiter(kind)
+        kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        units = requestUnits(kwargs)
+        for attempt in range(THROTTLE_RETRIES + 1):
+            with metrics.stage('capacityWaitMs'):
+                limiter.acquire(units)
+            try:
+                with metrics.stage('dynamo' + kind.capitalize() + 'Ms'):
+                    response = method(**kwargs)
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if attempt == THROTTLE_RETRIES or (code not in THROTTLE_ERRORS and code not in RETRY_ERRORS):
+                    raise
+                if code in THROTTLE_ERRORS:
+                    metrics.add('throttles', 1)
+                    limiter.throttled()
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+                continue
+
+            limiter.succeeded()
+            metrics.add('dynamo' + kind.capitalize() + 's', 1)
+            consumed = consumedUnits(response)
+            if consumed is not None:
+                metrics.add(kind + 'CapacityUnits', consumed)
+                limiter.charge(consumed - units)
+            return response
+
+def loadPandas():
+    global pd
+    if pd is None:
+        started = time.perf_counter()
+        import pandas
+        pd = pandas
+        lazyInit['seconds'] += time.perf_counter() - started
+    return pd
+
+s3 = LazyClient('s3')
+# Throttles are retried by ThrottledClient so the limiter sees them, not hidden inside botocore's own retries
+dynamodb = ThrottledClient('dynamodb', config=Config(retries={'mode': 'standard', 'max_attempts': 1}))
+secrets = LazyClient('secretsmanager', region_name='us-east-1')
 
 def get_secret():
     secret_name = "target-tracking-unanet-login"
     region_name = "us-east-1"
 
-    # Create a Secrets Manager client
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name='us-east-1'
-    )
-
     try:
-        get_secret_value_response = client.get_secret_value(
+        get_secret_value_response = secrets.get_secret_value(
             SecretId='target-tracking-unanet-login'
         )
     except Exception as e:
@@ -39,86 +321,269 @@ def get_secret():
     secret = get_secret_value_response['SecretString']
     return secret
 
-def getDynamoIDs():
-    partition_key = 'ID'
-    all_ids = []
-    emp_ids = []
-    last_evaluated_key = None
-
-    projection_expression = partition_key
-
+def scanSegment(segment, scanParams):
+    items = []
+    scanParams = dict(scanParams, Segment=segment, TotalSegments=SCAN_SEGMENTS)
     while True:
-        scan_params = {
-            'TableName': DYNAMO_TABLE,
-            'ProjectionExpression': projection_expression
-        }
-        if last_evaluated_key:
-            scan_params['ExclusiveStartKey'] = last_evaluated_key
-
-        response = dynamodb.scan(**scan_params)
-
-        for item in response.get('Items', []):
-            # Extract and store the primary key
-            primary_key = {}
-            primary_key[partition_key] = item[partition_key]
-            all_ids.append(primary_key)
+        response = dynamodb.scan(**scanParams)
+        items.extend(response.get('Items', []))
 
         last_evaluated_key = response.get('LastEvaluatedKey')
         if not last_evaluated_key:
-            break
+            return items
+        scanParams['ExclusiveStartKey'] = last_evaluated_key
+
+def parallelScan(attributes, filterExpression=None, expressionValues=None):
+    attributeNames = {'#attr' + str(i): attribute for i, attribute in enumerate(['ID'] + list(attributes))}
+    scanParams = {
+        'TableName': DYNAMO_TABLE,
+        'ProjectionExpression': ', '.join(attributeNames.keys()),
+        'ExpressionAttributeNames': attributeNames
+    }
+    if filterExpression is not None:
+        # The filter refers to the ID as #attr0
+        scanParams['FilterExpression'] = filterExpression
+        scanParams['ExpressionAttributeValues'] = expressionValues
+
+    # Each segment is an independent slice of the table, so they can be read at the same time
+    with ThreadPoolExecutor(max_workers=SCAN_SEGMENTS) as executor:
+        segments = executor.map(lambda segment: scanSegment(segment, scanParams), range(SCAN_SEGMENTS))
+
+        items = {}
+        for segmentItems in segments:
+            for item in segmentItems:
+                items[item['ID']['S']] = item
+    return list(items.values())
+
+# Names are compared without regard to case or repeated spaces
+def normalizeName(name):
+    return " ".join(str(name).split()).casefold()
+
+# Employee IDs are the first two words of a name joined together ("Peter Parker" -> "PeterParker")
+def nameToID(name):
+    return "".join(str(name).split(" ")[:2])
+
+# Unanet reports list people as "Last, First". This turns that into "First Last"
+def reportName(person):
+    nameParts = str(person).replace(",", "").split(" ")
+    firstname = nameParts[1] if len(nameParts) > 1 else ""
+    return firstname + " " + nameParts[0]
+
+# This class maps Unanet names and DynamoDB IDs to each other
+# It is built once from the "names" dictionary (Unanet name -> Microsoft name) and every lookup is a dictionary access
+class IdentityIndex:
+    def __init__(self, namesDict):
+        self.namesDict = namesDict
+        # Normalized Unanet name -> ID (without the year) built from the Microsoft name
+        self.microsoftIDs = {}
+        # Normalized ID (without the year) built from the Microsoft name -> ID built from the Unanet name
+        self.unanetIDs = {}
+        # Normalized Unanet name -> the whole Microsoft name without spaces, which targets are stored under
+        self.targetIDs = {}
+
+        for unanetName, microsoftName in namesDict.items():
+            self.microsoftIDs[normalizeName(unanetName)] = nameToID(microsoftName)
+            self.targetIDs[normalizeName(unanetName)] = microsoftName.replace(" ", "")
+            self.unanetIDs[nameToID(microsoftName).casefold()] = nameToID(unanetName)
+
+    # DynamoDB ID for a Unanet "First Last" name
+    def employeeID(self, unanetName, year):
+        return self.microsoftIDs.get(normalizeName(unanetName), nameToID(unanetName)) + str(year)
+
+    # DynamoDB ID for a "First Last" name in the targets file. Every word of the name is kept ("Mary Jane Watson" -> "MaryJaneWatson")
+    def targetID(self, unanetName, year):
+        return self.targetIDs.get(normalizeName(unanetName), unanetName.replace(" ", "")) + str(year)
+
+    # The ID the Unanet reports use for a DynamoDB ID. This is what the YTD comparisons are keyed on
+    def unanetID(self, employeeID):
+        baseID = employeeID[:-4]
+        return self.unanetIDs.get(baseID.casefold(), baseID) + employeeID[-4:]
+
+# The ID the YTD comparisons use for a "Last, First" report name. It goes through the employee's DynamoDB ID,
+# so it is the same ID getDynamoYTD and getDynamoWeeks return for them
+def reportEmployeeID(person, year, identity):
+    return identity.unanetID(identity.employeeID(reportName(person), year))
+
+def getIdentityIndex():
+    with metrics.stage('referenceLoadMs'):
+        namesDict = getCorrectNames()
+        # Without the names every renamed employee would be written under the wrong ID
+        if isinstance(namesDict, Exception):
+            raise namesDict
+
+        # Rebuild only when getCorrectNames hands back a different dictionary
+        cached = referenceCache.get('identity')
+        if cached is not None and cached['value'].namesDict is namesDict:
+            return cached['value']
+
+        index = IdentityIndex(namesDict)
+        referenceCache['identity'] = {'value': index, 'expires': None, 'version': None}
+        return index
 
-    for i in range(len(all_ids)):
-        employeeID = all_ids[i]['ID']['S']
+def getDynamoIDs():
+    with metrics.stage('referenceLoadMs'):
+        emp_ids = []
 
-        # We don't include the Unanet/Microsoft name discrepency dict
-        if employeeID == 'names':
-            continue
+        for item in parallelScan([]):
+            employeeID = item['ID']['S']
 
-        emp_ids.append(employeeID)
-    
-    return emp_ids
+            # We don't include the Unanet/Microsoft name discrepency dict
+            if employeeID == 'names':
+                continue
+
+            emp_ids.append(employeeID)
+
+        return emp_ids
 
 def getDynamoYTD(year):
 
     employeeTotals = {}
-    namesDict = getCorrectNames()
-    reversedNameDict = {value: key for key, value in namesDict.items()}
+    year = int(year)
+
+    # The current year is totaled through last week. Previous years are totaled in full
+    today = date.today()
+    if year != today.year:
+        lastWeek = 53
+    elif today.isocalendar()[0] != today.year:
+        # The first days of January can still be in the last ISO week of the previous year
+        lastWeek = 0
+    else:
+        lastWeek = today.isocalendar()[1] - 1
+    if lastWeek == 0:
+        return employeeTotals
+
+    identity = getIdentityIndex()
 
-    employeeIDs = getDynamoIDs()
+    # The running totals cover every stored week, so only weeks after the cutoff need to be read and taken back out
+    laterWeeks = range(lastWeek + 1, 54)
+    attributes = YTD_ATTRIBUTES + ['Direct' + str(week) for week in laterWeeks] + ['Indirect' + str(week) for week in laterWeeks]
+    items = parallelScan(attributes, 'contains(#attr0, :year)', {':year': {'S': str(year)}})
+    items = [item for item in items if item['ID']['S'].endswith(str(year))]
+
+    # Employees written before running totals existed are summed from their weeks instead
+    weeks = range(1, lastWeek + 1)
+    legacyIDs = set(item['ID']['S'] for item in items if not all(ytdKey in item for ytdKey in YTD_ATTRIBUTES))
+    legacyItems = batchGetItems(legacyIDs, ['Direct' + str(week) for week in weeks] + ['Indirect' + str(week) for week in weeks])
+
+    for item in items:
+        employee = item['ID']['S']
 
-    for employee in employeeIDs:
         # The YTD logic compares based on Unanet names. Convert the Microsoft names to Unanet names
-        employeeName = splitID(employee)
-        employeeName = employeeName[0] + " " + employeeName[1][:-4]
-        if employeeName in reversedNameDict:
-            employeeName = reversedNameDict[employeeName].split(" ")
-            employeeName = employeeName[0] + employeeName[1] + str(year)
+        employeeName = identity.unanetID(employee)
+
+        if employee in legacyIDs:
+            direct, indirect = sumWeeks(legacyItems.get(employee, {}), weeks)
         else:
-            employeeName = employee
-
-        response = dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': employee} })
-        if employee not in employeeTotals:
-            employeeTotals[employeeName] = {'Direct': 0.0, 'Indirect': 0.0}
-        addDirect = 0.0
-        addIndirect = 0.0
-        prevWeek = date.today().isocalendar()[1] - 1
-        if prevWeek == 0:
-            return employeeTotals
-        for i in range(prevWeek):
-            try:
-                addDirect += float(response['Item']['Direct' + str(i+1)]['N'])
-            except:
-                pass
-            try:
-                addIndirect += float(response['Item']['Indirect' + str(i+1)]['N'])
-            except:
-                pass
-            employeeTotals[employeeName]['Direct'] = round(addDirect, 2)
-            employeeTotals[employeeName]['Indirect'] = round(addIndirect, 2)
+            laterDirect, laterIndirect = sumWeeks(item, laterWeeks)
+            direct = getNumber(item, 'DirectYTD') - laterDirect
+            indirect = getNumber(item, 'IndirectYTD') - laterIndirect
+        employeeTotals[employeeName] = {'Direct': round(direct, 2), 'Indirect': round(indirect, 2)}
 
+    metrics.addDistinct('employees', employeeTotals)
     return employeeTotals
 
+# This function returns every employee's stored weekly hours for a year, keyed by Unanet ID and then week number
+# Weeks without hours are left out. The YTD reconciliation compares these against a dated report to find the weeks that differ
+def getDynamoWeeks(year):
+    year = int(year)
+    identity = getIdentityIndex()
+
+    weeks = range(1, 54)
+    attributes = ['Direct' + str(week) for week in weeks] + ['Indirect' + str(week) for week in weeks]
+    items = parallelScan(attributes, 'contains(#attr0, :year)', {':year': {'S': str(year)}})
+
+    employeeWeeks = {}
+    for item in items:
+        employee = item['ID']['S']
+        if not employee.endswith(str(year)):
+            continue
+
+        storedWeeks = {}
+        for week in weeks:
+            direct, indirect = sumWeeks(item, [week])
+            if direct or indirect:
+                storedWeeks[str(week)] = {'Direct': round(direct, 2), 'Indirect': round(indirect, 2)}
+        employeeWeeks[identity.unanetID(employee)] = storedWeeks
+
+    return employeeWeeks
+
+# This class collects SET and ADD updates by key so each key is written with a single update_item
+# A SET after an ADD to the same attribute replaces it, and an ADD after a SET is folded into the set value
+class WriteBuffer:
+    def __init__(self, workers=WRITE_WORKERS):
+        self.workers = workers
+        # key -> {'SET': {attribute: {datatype: value}}, 'ADD': {attribute: delta}}
+        self.updates = {}
+        # key -> attribute values the last flush replaced (ReturnValues='UPDATED_OLD')
+        self.replaced = {}
+
+    def __len__(self):
+        return len(self.updates)
+
+    def set(self, key, attribute, value, datatype="N"):
+        update = self.updates.setdefault(key, {'SET': {}, 'ADD': {}})
+        update['ADD'].pop(attribute, None)
+        update['SET'][attribute] = {datatype: str(value)}
+
+    def add(self, key, attribute, delta):
+        update = self.updates.setdefault(key, {'SET': {}, 'ADD': {}})
+        if attribute in update['SET']:
+            update['SET'][attribute] = {'N': str(round(float(update['SET'][attribute]['N']) + float(delta), 2))}
+        else:
+            update['ADD'][attribute] = update['ADD'].get(attribute, 0.0) + float(delta)
+
+    def write(self, key, update):
+        try:
+            attributeNames = {}
+            attributeValues = {}
+            clauses = []
+            for action, prefix in (('SET', 'set'), ('ADD', 'add')):
+                parts = []
+                for i, (attribute, value) in enumerate(update[action].items()):
+                    attributeNames['#' + prefix + str(i)] = attribute
+                    if action == 'SET':
+                        attributeValues[':' + prefix + str(i)] = value
+                        parts.append('#' + prefix + str(i) + ' = :' + prefix + str(i))
+                    else:
+                        attributeValues[':' + prefix + str(i)] = {'N': str(round(value, 2))}
+                        parts.append('#' + prefix + str(i) + ' :' + prefix + str(i))
+                if parts:
+                    clauses.append(action + ' ' + ', '.join(parts))
+
+            response = dynamodb.update_item(
+                TableName=DYNAMO_TABLE,
+                Key={'ID': {'S': str(key)}},
+                UpdateExpression=' '.join(clauses),
+                ExpressionAttributeNames=attributeNames,
+                ExpressionAttributeValues=attributeValues,
+                ReturnValues='UPDATED_OLD'
+            )
+            if (str(response['ResponseMetadata']['HTTPStatusCode']) != "200"):
+                print("ERROR:\n\n" + str(response['ResponseMetadata']['HTTPStatusCode']))
+                return ("ERROR:\n\n" + str(response['ResponseMetadata']['HTTPStatusCode']))
+            self.replaced[key] = response.get('Attributes', {})
+            return "Success!"
+        except Exception as e:
+            print(e)
+            return e
+
+    # This function writes every buffered key and empties the buffer
+    # It returns {key: "Success!" or the error} so callers can tell which employees were not written
+    def flush(self):
+        updates = self.updates
+        self.updates = {}
+        self.replaced = {}
+        if not updates:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(updates)))) as executor:
+            futures = {key: executor.submit(self.write, key, update) for key, update in updates.items()}
+        return {key: future.result() for key, future in futures.items()}
+
 def updateHours(employeeID, key, hours):
+    # Weekly hours also move the employee's running YTD total
+    if WEEK_ATTRIBUTE.match(str(key)):
+        return setWeekHours(employeeID, {str(key): hours})
+
     try:
         response = dynamodb.update_item(
                 TableName=DYNAMO_TABLE,
@@ -141,27 +606,259 @@ def updateHours(employeeID, key, hours):
         print(e)
         return e
 
-def getHours(prefix):
+def getNumber(item, attribute):
+    if attribute in item:
+        return float(item[attribute]['N'])
+    return 0.0
+
+def sumWeeks(item, weeks=range(1, 54)):
+    direct = sum(getNumber(item, 'Direct' + str(week)) for week in weeks)
+    indirect = sum(getNumber(item, 'Indirect' + str(week)) for week in weeks)
+    return round(direct, 2), round(indirect, 2)
+
+def setWeekHours(employeeID, hours, item=None):
     try:
-        # Read the file from S3
-        response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=prefix, MaxKeys=5)
-        # Check if the 'Contents' key is present in the response
-        if 'Contents' in response:
-            # Get the file under the Reports/ folder
-            file_name = response['Contents'][1]['Key']
-        response = s3.get_object(Bucket=BUCKET_NAME, Key=file_name)
-        file_content = response['Body'].read().decode('utf-8')
-
-        reportCSV = pd.read_csv(io.StringIO(file_content))
+        # item is what we believe is stored for these weeks. Read it if the caller doesn't already have it
+        if item is None:
+            attributeNames = {'#attr' + str(i): attribute for i, attribute in enumerate(['ID'] + list(hours) + YTD_ATTRIBUTES)}
+            response = dynamodb.get_item(
+                TableName=DYNAMO_TABLE,
+                Key={'ID': {'S': employeeID}},
+                ProjectionExpression=', '.join(attributeNames.keys()),
+                ExpressionAttributeNames=attributeNames
+            )
+            item = response.get('Item', {})
+
+        buffer = WriteBuffer(workers=1)
+        bufferWeekHours(buffer, employeeID, hours, item)
+        err = buffer.flush()[employeeID]
+        if (err != "Success!"):
+            return err
+        return settleWeekHours(employeeID, hours, item, buffer.replaced.get(employeeID, {}))
+    except Exception as e:
+        print(e)
+        return e
+
+# This function buffers the weeks' hours and the matching change to the running YTD totals
+# Overwriting a week and moving the running total happen in the same atomic write
+def bufferWeekHours(buffer, employeeID, hours, item):
+    for key, value in hours.items():
+        buffer.set(employeeID, key, value)
+        ytdKey = WEEK_ATTRIBUTE.match(key).group(1) + "YTD"
+        buffer.add(employeeID, ytdKey, float(value) - getNumber(item, key))
+
+# This function runs after a buffered week write. replaced holds the week values the write overwrote
+def settleWeekHours(employeeID, hours, item, replaced):
+    try:
+        # Employees written before running totals existed get theirs computed from every stored week once
+        ytdKeys = set(WEEK_ATTRIBUTE.match(key).group(1) + "YTD" for key in hours)
+        if 'ID' in item and any(ytdKey not in item for ytdKey in ytdKeys):
+            return repairEmployeeYTD(employeeID)
+
+        # Someone else changed these weeks after item was read. Correct the totals by what was actually replaced
+        corrections = {}
+        for key in hours:
+            ytdKey = WEEK_ATTRIBUTE.match(key).group(1) + "YTD"
+            corrections[ytdKey] = corrections.get(ytdKey, 0.0) + getNumber(item, key) - getNumber(replaced, key)
+        corrections = {ytdKey: round(correction, 2) for ytdKey, correction in corrections.items() if round(correction, 2) != 0}
+        if corrections:
+            dynamodb.update_item(
+                TableName=DYNAMO_TABLE,
+                Key={'ID': {'S': employeeID}},
+                UpdateExpression='ADD ' + ', '.join('#ytd' + str(i) + ' :delta' + str(i) for i in range(len(corrections))),
+                ExpressionAttributeNames={'#ytd' + str(i): ytdKey for i, ytdKey in enumerate(corrections)},
+                ExpressionAttributeValues={':delta' + str(i): {'N': str(correction)} for i, correction in enumerate(corrections.values())}
+            )
+        return "Success!"
+    except Exception as e:
+        print(e)
+        return e
+
+def repairEmployeeYTD(employeeID):
+    try:
+        response = dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': employeeID}})
+        direct, indirect = sumWeeks(response.get('Item', {}))
+        dynamodb.update_item(
+            TableName=DYNAMO_TABLE,
+            Key={'ID': {'S': employeeID}},
+            UpdateExpression='SET #direct = :direct, #indirect = :indirect',
+            ExpressionAttributeNames={'#direct': 'DirectYTD', '#indirect': 'IndirectYTD'},
+            ExpressionAttributeValues={':direct': {'N': str(direct)}, ':indirect': {'N': str(indirect)}}
+        )
+        return "Success!"
     except Exception as e:
         print(e)
+        return e
+
+# This function recomputes every employee's running YTD totals from their weekly hours
+# Totals that don't match are reported, and rewritten when repair is True
+def repairYTD(year=None, repair=True):
+    weeks = range(1, 54)
+    attributes = ['Direct' + str(week) for week in weeks] + ['Indirect' + str(week) for week in weeks] + YTD_ATTRIBUTES
+    if year is None:
+        items = parallelScan(attributes)
+    else:
+        items = [item for item in parallelScan(attributes, 'contains(#attr0, :year)', {':year': {'S': str(year)}}) if item['ID']['S'].endswith(str(year))]
+
+    mismatches = {}
+    for item in items:
+        employeeID = item['ID']['S']
+        if employeeID == 'names':
+            continue
+
+        direct, indirect = sumWeeks(item)
+        stored = (round(getNumber(item, 'DirectYTD'), 2), round(getNumber(item, 'IndirectYTD'), 2))
+        if 'DirectYTD' in item and 'IndirectYTD' in item and stored == (direct, indirect):
+            continue
 
-    # Create a dataframe for the csv file
-    reportDF = pd.DataFrame(reportCSV)
+        mismatches[employeeID] = {
+            'Stored': {'Direct': stored[0], 'Indirect': stored[1]},
+            'Weeks': {'Direct': direct, 'Indirect': indirect}
+        }
+        if repair:
+            dynamodb.update_item(
+                TableName=DYNAMO_TABLE,
+                Key={'ID': {'S': employeeID}},
+                UpdateExpression='SET #direct = :direct, #indirect = :indirect',
+                ExpressionAttributeNames={'#direct': 'DirectYTD', '#indirect': 'IndirectYTD'},
+                ExpressionAttributeValues={':direct': {'N': str(direct)}, ':indirect': {'N': str(indirect)}}
+            )
 
-    reportEndDate = datetime.strptime(str(file_name).split('/')[1].split('.')[0], '%Y-%m-%d')
-    currYear = reportEndDate.year
+    return {'checked': len(items), 'mismatched': mismatches}
+
+def batchGetItems(employeeIDs, attributes=None):
+    items = {}
+    # Duplicate keys in a single BatchGetItem request are rejected
+    employeeIDs = list(dict.fromkeys(employeeIDs))
+
+    for start in range(0, len(employeeIDs), BATCH_GET_LIMIT):
+        request = {'Keys': [{'ID': {'S': employeeID}} for employeeID in employeeIDs[start:start + BATCH_GET_LIMIT]]}
+        # Only pull the attributes the caller needs
+        if attributes is not None:
+            attributeNames = {'#attr' + str(i): attribute for i, attribute in enumerate(['ID'] + list(attributes))}
+            request['ProjectionExpression'] = ', '.join(attributeNames.keys())
+            request['ExpressionAttributeNames'] = attributeNames
+
+        requestItems = {DYNAMO_TABLE: request}
+        retries = 0
+        while requestItems:
+            response = dynamodb.batch_get_item(RequestItems=requestItems)
+            for item in response['Responses'].get(DYNAMO_TABLE, []):
+                items[item['ID']['S']] = item
+
+            # DynamoDB may hand back part of the batch when it is throttled. Retry just those keys with backoff
+            requestItems = response.get('UnprocessedKeys')
+            if requestItems:
+                dynamodb.throttled('read')
+                retries += 1
+                if retries > BATCH_RETRIES:
+                    raise Exception("Unable to read " + str(len(requestItems[DYNAMO_TABLE]['Keys'])) + " employees from DynamoDB")
+                time.sleep(random.uniform(0, 0.05 * 2 ** retries))
+
+    return items
+
+def getLatestTarget(item):
+    if "Target" not in item:
+        return None
+    target = item["Target"]["N"]
+    i = 2
+    # Get the latest target
+    while "Target" + str(i) in item:
+        target = item["Target" + str(i)]["N"]
+        i += 1
+    return target
+
+# This function totals report rows (dicts with Person, Project and Hours) using only the standard library
+# Just one [direct, indirect] pair is kept per employee, so memory follows the number of employees rather than rows
+# It replaces the vectorized pandas aggregation so report routes don't import pandas. Names are still resolved once per
+# person and projects classified with one compiled pattern, and ingestWeeks still writes each employee once
+def totalReportRows(rows, currYear, identity):
+    indirectProjects = re.compile('|'.join(map(re.escape, INDIRECT_PROJECTS)))
+    excludedProjects = re.compile('|'.join(map(re.escape, EXCLUDED_PROJECTS)))
+
+    # Rows streamed from S3 are downloaded while they are parsed. That time is already counted in s3FetchMs
+    with metrics.stage('parseMs', exclude='s3FetchMs'):
+        rowCount = 0
+        totals = {}
+        employeeIDs = {}
+        for row in rows:
+            rowCount += 1
+            person = row.get('Person')
+            # Rows without a person (blank lines, report footers) carry no hours
+            if not isinstance(person, str) or not person.strip():
+                continue
+
+            employeeID = employeeIDs.get(person)
+            if employeeID is None:
+                # If there is a Unanet/Microsoft name discrepency, we use the Microsoft name
+                employeeID = identity.employeeID(reportName(person), currYear)
+                employeeIDs[person] = employeeID
 
+            try:
+                hours = float(row.get('Hours') or 0.0)
+            except ValueError:
+                hours = 0.0
+            if hours != hours:
+                hours = 0.0
+
+            # Excluded projects (FLEX_TIME) count toward neither total
+            project = str(row.get('Project'))
+            total = totals.setdefault(employeeID, [0.0, 0.0])
+            if indirectProjects.search(project):
+                total[1] += hours
+            elif not excludedProjects.search(project):
+                total[0] += hours
+
+    metrics.add('rows', rowCount)
+    metrics.addDistinct('employees', totals)
+    return {employeeID: (round(direct, 2), round(indirect, 2)) for employeeID, (direct, indirect) in totals.items()}
+
+# This function totals report rows the way totalReportRows does, keyed by the IDs the YTD comparisons use
+def reportYTDTotals(rows, year, identity):
+    totals = totalReportRows(rows, year, identity)
+    return {identity.unanetID(employeeID): {'Direct': direct, 'Indirect': indirect} for employeeID, (direct, indirect) in totals.items()}
+
+# This function finds the file uploaded under a prefix. It is only used when the caller doesn't say which file to read
+def findObjectKey(prefix, bucket=BUCKET_NAME):
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
+    for obj in response.get('Contents', []):
+        # Skip the folder itself
+        if obj['Key'] != prefix:
+            return obj['Key']
+    raise Exception("No file found under " + prefix)
+
+# This class wraps an S3 body so time spent downloading it counts toward s3FetchMs, even while it is streamed into a parser
+class MeteredBody:
+    def __init__(self, body):
+        self.body = body
+
+    def read(self, *args):
+        with metrics.stage('s3FetchMs'):
+            return self.body.read(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.body, name)
+
+def getObjectBody(key, bucket=BUCKET_NAME):
+    with metrics.stage('s3FetchMs'):
+        response = s3.get_object(Bucket=bucket, Key=key)
+    return MeteredBody(response['Body'])
+
+# This function streams a CSV file from S3 as DataFrame chunks of at most CSV_CHUNK_ROWS rows
+# The S3 body is parsed as it downloads, so the whole file is never held in memory
+def readCSV(key, columns=None, bucket=BUCKET_NAME):
+    pd = loadPandas()
+    with pd.read_csv(getObjectBody(key, bucket), chunksize=CSV_CHUNK_ROWS, usecols=columns, encoding='utf-8') as chunks:
+        for chunk in chunks:
+            yield chunk
+
+# This function streams a CSV file from S3 as dict rows, without pandas
+def readCSVRows(key, bucket=BUCKET_NAME):
+    # newline='' leaves line endings inside quoted fields for the csv module to handle
+    yield from csv.DictReader(io.TextIOWrapper(getObjectBody(key, bucket), encoding='utf-8-sig', newline=''))
+
+# This function returns the (year, week) a report ending on reportEndDate belongs to
+def reportWeek(reportEndDate):
     # Get the week the report information belongs to
     current_week = reportEndDate.isocalendar()[1]
 
@@ -169,105 +866,156 @@ def getHours(prefix):
     if reportEndDate.month == 12 and current_week == 1:
         current_week = 53
 
-    emp_ids = getDynamoIDs()
-
-    emp_data = {}
-
-    namesDict = getCorrectNames()
-
-    for row in reportDF.index:
-        # Get employee name / ID information
-        employeeName = reportDF.loc[row, 'Person']
-        # If employee has a different name in Microsoft, use that name
-        firstname = employeeName.replace(",", "").split(" ")[1]
-        lastname = employeeName.replace(",", "").split(" ")[0]
-        fullname = firstname + " " + lastname
-        employeeID = str(firstname) + str(lastname) + str(currYear)
-
-        # If there is a Unanet/Microsoft name discrepency, we use the Microsoft name
-        if fullname in namesDict:
-            employeeID = namesDict[fullname].split(" ")
-            employeeID = employeeID[0] + employeeID[1] + str(currYear)
-        
-        # Create emp data instance
-        if employeeID not in emp_data:
-            emp_data[employeeID] = {"Direct": 0, "Indirect": 0}
-
-        response = dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': employeeID} })
-        target = None
-
-        # Check if employee already has an entry in the database for the given year
-        if "Item" not in response:
-            employeeID = employeeID[:-4] + str(currYear-1)
-            # Check if employee has an entry for the previous year
-            response = dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': employeeID} })
-            # If employee has target from previous year use it for this year
-            if "Item" in response:
-                if "Target" in response["Item"]:
-                    target = response["Item"]["Target"]["N"]
-                    i = 2
-                    # Get the latest target
-                    while True:
-                        if "Target" + str(i) in response["Item"]:
-                            target = response["Item"]["Target" + str(i)]["N"]
-                            i += 1
-                        else:
-                            break
-
-        employeeID = employeeID[:-4] + str(currYear)
-        # Employee had a target from previous year, use it for current year here
-        if target is not None:
-            err = addItem(employeeID, target, "N", "Target")
+    return reportEndDate.year, current_week
+
+# Reports are named after the last day they cover, e.g. "Reports/2025-07-18.csv"
+def reportEndDateFromKey(key):
+    return datetime.strptime(key.split('/')[-1].split('.')[0], '%Y-%m-%d')
+
+# key is the uploaded report, e.g. "Reports/2025-07-18.csv". Without it, the report is looked up under prefix
+def getHours(prefix, key=None, bucket=BUCKET_NAME, identity=None):
+    if key is None:
+        key = findObjectKey(prefix, bucket)
+
+    currYear, current_week = reportWeek(reportEndDateFromKey(key))
+
+    if identity is None:
+        identity = getIdentityIndex()
+    weekTotals = totalReportRows(readCSVRows(key, bucket), currYear, identity)
+
+    ingestWeeks({(currYear, current_week): weekTotals})
+
+# This function ingests every weekly report under a run prefix (e.g. "Batch/20250718093000/") in one invocation
+# The prefix can hold weekly CSVs named after their end dates, or zip archives of them
+def getHoursBatch(runPrefix, bucket=BUCKET_NAME, identity=None):
+    if identity is None:
+        identity = getIdentityIndex()
+
+    keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=runPrefix):
+        keys += [obj['Key'] for obj in page.get('Contents', []) if obj['Key'] != runPrefix]
+
+    # Files are read in name order. If two files cover the same week, the later one wins like it would with separate uploads
+    weekTables = {}
+    for key in sorted(keys):
+        if key.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(getObjectBody(key, bucket).read())) as archive:
+                for member in sorted(archive.namelist()):
+                    if not member.lower().endswith('.csv'):
+                        continue
+                    year, week = reportWeek(reportEndDateFromKey(member))
+                    with archive.open(member) as reportFile:
+                        rows = csv.DictReader(io.TextIOWrapper(reportFile, encoding='utf-8-sig', newline=''))
+                        weekTables[(year, week)] = totalReportRows(rows, year, identity)
+        elif key.lower().endswith('.csv'):
+            year, week = reportWeek(reportEndDateFromKey(key))
+            weekTables[(year, week)] = totalReportRows(readCSVRows(key, bucket), year, identity)
+
+    ingestWeeks(weekTables)
+    return sorted(weekTables.keys())
+
+# These functions let the auto app ingest reports it has already downloaded, without going through S3 and another invocation
+# reportEndDate is the last day the report covers
+def ingestReportFile(reportPath, reportEndDate, identity=None):
+    currYear, current_week = reportWeek(reportEndDate)
+
+    if identity is None:
+        identity = getIdentityIndex()
+    with open(reportPath, newline='', encoding='utf-8-sig') as reportFile:
+        weekTotals = totalReportRows(csv.DictReader(reportFile), currYear, identity)
+
+    ingestWeeks({(currYear, current_week): weekTotals})
+
+# weekReports maps the day each week ends ("2025-07-18") to that week's report rows
+def ingestWeeklyReports(weekReports, identity=None):
+    if identity is None:
+        identity = getIdentityIndex()
+
+    weekTables = {}
+    for weekEnd, reportDF in sorted(weekReports.items()):
+        year, week = reportWeek(datetime.strptime(weekEnd, '%Y-%m-%d'))
+        weekTables[(year, week)] = totalReportRows(reportDF.to_dict('records'), year, identity)
+
+    ingestWeeks(weekTables)
+    return sorted(weekTables.keys())
+
+# This function writes per-employee weekly totals to DynamoDB
+# weekTables maps (year, week) to {employee ID: (direct, indirect)}
+# Every employee gets a single write covering all of their weeks for the year
+def ingestWeeks(weekTables):
+    for currYear in sorted(set(year for year, week in weekTables)):
+        employeeHours = {}
+        for (year, current_week), weekTotals in sorted(weekTables.items()):
+            if year != currYear:
+                continue
+            for employeeID, (direct, indirect) in weekTotals.items():
+                hours = employeeHours.setdefault(employeeID, {})
+                hours["Direct" + str(current_week)] = round(float(direct), 2)
+                hours["Indirect" + str(current_week)] = round(float(indirect), 2)
+
+        # Load every employee in the reports up front. Only employees missing this year need last year's targets
+        weekAttributes = sorted(set(key for hours in employeeHours.values() for key in hours)) + YTD_ATTRIBUTES
+        employeeItems = batchGetItems(employeeHours.keys(), weekAttributes)
+        previousIDs = [employeeID[:-4] + str(currYear-1) for employeeID in employeeHours if employeeID not in employeeItems]
+        targetAttributes = ['Target'] + ['Target' + str(i) for i in range(2, MAX_TARGETS + 1)]
+        previousItems = batchGetItems(previousIDs, targetAttributes)
+
+        # Each employee's target, weeks and running totals go out as one write
+        buffer = WriteBuffer()
+        for employeeID, hours in employeeHours.items():
+            item = employeeItems.get(employeeID, {})
+
+            # Employee has no entry for the given year. If they have a target from the previous year use it for this year
+            if employeeID not in employeeItems:
+                target = getLatestTarget(previousItems.get(employeeID[:-4] + str(currYear-1), {}))
+                if target is not None:
+                    buffer.set(employeeID, "Target", target, "N")
+
+            # Check if they already have hours populated for the given weeks
+            # If they do, we overwrite them with the new data
+            for key in hours:
+                if getNumber(item, key) > 0:
+                    kind, week = WEEK_ATTRIBUTE.match(key).groups()
+                    print("OVERRIDING " + kind.upper() + " HOURS FOR " + str(employeeID) + " FOR WEEK " + week)
+
+            bufferWeekHours(buffer, employeeID, hours, item)
+
+        for employeeID, err in buffer.flush().items():
+            if (err == "Success!"):
+                err = settleWeekHours(employeeID, employeeHours[employeeID], employeeItems.get(employeeID, {}), buffer.replaced.get(employeeID, {}))
             if (err != "Success!"):
                 print(err)
-    
-        # Check if they already have hours populated for the given week
-        # If they do, we overwrite them with the new data
-        try:
-            direct = float(response['Item']['Direct' + str(current_week)])
-            if (direct > 0):
-                print("OVERRIDING DIRECT HOURS FOR " + str(employeeID) + " FOR WEEK " + str(current_week))
-        except:
-            pass
-        try:
-            indirect = float(response['Item']['Indirect' + str(current_week)])
-            if (indirect > 0):
-                print("OVERRIDING INDIRECT HOURS FOR " + str(employeeID) + " FOR WEEK " + str(current_week))
-        except:
-            pass
-
-        if 'OH_BR' in reportDF.loc[row, 'Project'] or 'BEREAVEMENT' in reportDF.loc[row, 'Project'] or 'PARENTAL' in reportDF.loc[row, 'Project']:
-            emp_data[employeeID]['Indirect'] += float(reportDF.loc[row, 'Hours'])
-        elif 'FLEX_TIME' in reportDF.loc[row, 'Project']:
-            continue
-        else:
-            emp_data[employeeID]['Direct'] += float(reportDF.loc[row, 'Hours'])
-
-        # Add the direct hours to the database
-        key = "Direct" + str(current_week)
-
-        err = updateHours(employeeID, key, round(emp_data[employeeID]['Direct'], 2))
-        if (err != "Success!"):
-            print(err)
-        
-        # Add the indirect hours to the database
-        key = "Indirect" + str(current_week)
-        err = updateHours(employeeID, key, round(emp_data[employeeID]['Indirect'], 2))
-        if (err != "Success!"):
-            print(err)
 
 def deleteS3(s3_prefix):
     try:
-        # Remove old report(s)
-        objects = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=s3_prefix)
-
-        if 'Contents' in objects:
-            for obj in objects['Contents']:
+        # Remove old report(s). The listing is paged, so prefixes with more than 1000 files are fully cleared
+        keys = []
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=s3_prefix):
+            for obj in page.get('Contents', []):
                 if (obj['Key'] != s3_prefix):
-                    response = s3.delete_object(
-                        Bucket=BUCKET_NAME, 
-                        Key=obj['Key']
-                    )
+                    keys.append(obj['Key'])
+
+        errors = []
+        for start in range(0, len(keys), DELETE_LIMIT):
+            response = s3.delete_objects(
+                Bucket=BUCKET_NAME,
+                Delete={
+                    'Objects': [{'Key': key} for key in keys[start:start + DELETE_LIMIT]],
+                    'Quiet': True
+                }
+            )
+            # Quiet mode only reports the keys that could not be deleted
+            for error in response.get('Errors', []):
+                errors.append({'key': error['Key'], 'code': error.get('Code'), 'message': error.get('Message')})
+
+        if errors:
+            return {
+                        'statusCode': 500,
+                        'body': 'Unable to remove ' + str(len(errors)) + ' of ' + str(len(keys)) + ' S3 files',
+                        'errors': errors
+                    }
         return {
                     'statusCode': 200,
                     'body': 'Successfully removed S3 files'
@@ -278,59 +1026,70 @@ def deleteS3(s3_prefix):
                     'body': str(e)
                 }
 
-def getTargets():
-    try:
-        # Read the file from S3
-        response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=TARGET_PREFIX, MaxKeys=5)
-        # Check if the 'Contents' key is present in the response
-        if 'Contents' in response:
-            # Get the file under the Targets/ folder
-            file_name = response['Contents'][1]['Key']
-        response = s3.get_object(Bucket=BUCKET_NAME, Key=file_name)
-        file_content = response['Body'].read().decode('utf-8')
-
-        targetCSV = pd.read_csv(io.StringIO(file_content))
-    except Exception as e:
-        print(e)
-
-    # Create a dataframe for the csv file
-    targetDF = pd.DataFrame(targetCSV)
+def getTargets(key=None, bucket=BUCKET_NAME, identity=None):
+    if key is None:
+        key = findObjectKey(TARGET_PREFIX, bucket)
+    targetChunks = readCSV(key, None, bucket)
 
     employeeTargets = {}
     currYear = datetime.now().year
 
-    namesDict = getCorrectNames()
+    if identity is None:
+        identity = getIdentityIndex()
+
+    with metrics.stage('parseMs', exclude='s3FetchMs'):
+        for targetDF in targetChunks:
+            metrics.add('rows', len(targetDF.index))
+            for row in targetDF.index:
+                # Get employee name / ID information
+                employeeName = targetDF.loc[row, 'Person']
+                # Skip empty rows
+                if not isinstance(employeeName, str):
+                    continue
+                # If employee has a different name in Microsoft, use that name
+                employeeID = identity.targetID(employeeName, currYear)
+
+                description = targetDF.loc[row, 'Description']
+                if not isinstance(description, str) or len(description) == 0:
+                    description = "Initial entry"
 
-    for row in targetDF.index:
-        # Get employee name / ID information
-        employeeName = targetDF.loc[row, 'Person']
-        # If employee has a different name in Microsoft, use that name
-        if employeeName in namesDict:
-            employeeName = namesDict[employeeName]
-        # Skip empty rows
-        if not isinstance(employeeName, str):
-            continue
-        firstlast = employeeName.replace(" ", "")
-        employeeID = str(firstlast) + str(currYear)
+                employeeTargets[employeeID] = {
+                    "Target": targetDF.loc[row, 'Target'],
+                    "Target2": targetDF.loc[row, 'Target2'],
+                    "Description": description
+                }
+    metrics.addDistinct('employees', employeeTargets)
 
-        target = targetDF.loc[row, 'Target']
-        target2 = targetDF.loc[row, 'Target2']
+    # Re-uploading a targets file should not rewrite targets that are already set
+    employeeItems = batchGetItems(employeeTargets.keys(), ['Target', 'Target2', 'Description'])
 
-        addItem(employeeID, target, "N", "Target")
+    # Every changed attribute of an employee goes out in one write
+    buffer = WriteBuffer()
+    for employeeID, targets in employeeTargets.items():
+        item = employeeItems.get(employeeID, {})
+        target = targets["Target"]
+        target2 = targets["Target2"]
+
+        if not sameNumber(item.get("Target"), target):
+            buffer.set(employeeID, "Target", target, "N")
         # If the employee has multiple targets, add the new one with an initial or given description
         if target != target2:
-            addItem(employeeID, target2, "N", "Target2")
-            description = targetDF.loc[row, 'Description']
-            if isinstance(description, str):
-                if len(description) == 0:
-                    description = "Initial entry"
-            else:
-                description = "Initial entry"
-            addItem(employeeID, description, "S", "Description")
+            if sameNumber(item.get("Target2"), target2) and item.get("Description", {}).get("S") == targets["Description"]:
+                continue
+            buffer.set(employeeID, "Target2", target2, "N")
+            buffer.set(employeeID, "Description", targets["Description"], "S")
             dateChanged2 = str(datetime.now())
-            addItem(employeeID, dateChanged2, "S", "dateChanged2")
+            buffer.set(employeeID, "dateChanged2", dateChanged2, "S")
+    buffer.flush()
 
-    deleteS3(TARGET_PREFIX) 
+    # Only remove the file we read. Another upload may be waiting under the same prefix
+    s3.delete_object(Bucket=bucket, Key=key)
+
+def sameNumber(attribute, value):
+    try:
+        return attribute is not None and float(attribute["N"]) == float(value)
+    except (KeyError, TypeError, ValueError):
+        return False
 
 def addItem(employeeID, data, datatype, header):
     try:
@@ -351,92 +1110,228 @@ def addItem(employeeID, data, datatype, header):
         print(e)
         return e
 
-def setCorrectNames():
-    try:
-        # Read the file from S3
-        response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=NAME_PREFIX, MaxKeys=5)
-        # Check if the 'Contents' key is present in the response
-        if 'Contents' in response:
-            # Get the file under the Names/ folder
-            file_name = response['Contents'][1]['Key']
-        response = s3.get_object(Bucket=BUCKET_NAME, Key=file_name)
-        file_content = response['Body'].read().decode('utf-8')
-
-        nameCSV = pd.read_csv(io.StringIO(file_content))
-    except Exception as e:
-        print(e)
-
-    # Create a dataframe for the csv file
-    nameDF = pd.DataFrame(nameCSV)
+def setCorrectNames(key=None, bucket=BUCKET_NAME):
+    if key is None:
+        key = findObjectKey(NAME_PREFIX, bucket)
+    nameChunks = readCSV(key, ['Unanet Name', 'Microsoft Name'], bucket)
 
     nameDict = {}
     
-    for row in nameDF.index:
-        unanetName = nameDF.loc[row, 'Unanet Name']
-        microsoftName = nameDF.loc[row, 'Microsoft Name']
+    with metrics.stage('parseMs', exclude='s3FetchMs'):
+        for nameDF in nameChunks:
+            metrics.add('rows', len(nameDF.index))
+            for row in nameDF.index:
+                unanetName = nameDF.loc[row, 'Unanet Name']
+                microsoftName = nameDF.loc[row, 'Microsoft Name']
 
-        if not isinstance(unanetName, str) or not isinstance(microsoftName, str):
-            continue
-        nameDict[unanetName] = microsoftName
+                if not isinstance(unanetName, str) or not isinstance(microsoftName, str):
+                    continue
+                nameDict[unanetName] = microsoftName
 
     # Add the dictionary of Unanet/Microsoft name values to DynamoDB under the ID "names"
-    addItem("names", json.dumps(nameDict), "S", "UnanetKey")
-    
-    deleteS3(NAME_PREFIX)
+    buffer = WriteBuffer()
+    buffer.set("names", "UnanetKey", json.dumps(nameDict), "S")
+    # Warm containers compare this stamp to decide whether their cached dictionary is stale
+    buffer.set("names", "NamesVersion", str(datetime.now()), "S")
+    buffer.flush()
+    invalidateCache('names')
+
+    # Only remove the file we read. Another upload may be waiting under the same prefix
+    s3.delete_object(Bucket=bucket, Key=key)
 
 def getCorrectNames():
+    cached = referenceCache.get('names')
+    if cached is not None and cached['expires'] > time.time():
+        return cached['value']
+
     try:
+        # The cached dictionary expired. If setCorrectNames hasn't stamped a new version, keep using it
+        if cached is not None and cached['version'] is not None:
+            response = dynamodb.get_item(
+                TableName=DYNAMO_TABLE,
+                Key={'ID': {'S': "names"}},
+                ProjectionExpression='#version',
+                ExpressionAttributeNames={'#version': 'NamesVersion'}
+            )
+            if response.get('Item', {}).get('NamesVersion', {}).get('S') == cached['version']:
+                cached['expires'] = time.time() + CACHE_TTL
+                return cached['value']
+
         # Get the dictionary of names
         response = dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': "names"} })
         if not 'Item' in response:
-            return {}
-        dict = json.loads(response['Item']['UnanetKey']['S'])
+            dict = {}
+            version = None
+        else:
+            dict = json.loads(response['Item']['UnanetKey']['S'])
+            version = response['Item'].get('NamesVersion', {}).get('S')
+        referenceCache['names'] = {'value': dict, 'expires': time.time() + CACHE_TTL, 'version': version}
         return dict
     except Exception as e:
         print(e)
         return e
 
-def splitID(s):
-    capitalCount = 0
-    splitPos = -1
+# This function drops cached reference data so the next lookup reads DynamoDB again
+def invalidateCache(name=None):
+    if name is None:
+        referenceCache.clear()
+    else:
+        referenceCache.pop(name, None)
+
+# This function runs one parser for one uploaded file and reports how it went
+def readRecord(key, parser, *args):
+    try:
+        parser(*args)
+        return {'key': key, 'statusCode': 200, 'body': 'File read successfully!'}
+    except Exception as e:
+        print("Something went wrong reading " + key + ": " + str(e))
+        return {'key': key, 'statusCode': 500, 'body': str(e)}
 
-    for i, char in enumerate(s):
-        if char.isupper():
-            capitalCount += 1
-            if capitalCount == 2:
-                splitPos = i
-                break
+# This function handles every file in an S3 event. S3 can batch several uploads into one event
+def processRecords(records):
+    folders = {}
+    for record in records:
+        bucket = record['s3']['bucket']['name']
+        key = unquote_plus(record['s3']['object']['key'])
+        folders.setdefault(key.split("/")[0], []).append((bucket, key))
 
-    if splitPos != -1:
-        return [s[:splitPos], s[splitPos:]]
-    else:
-        return [s]
+    results = []
+
+    # Updating Unanet/Microsoft name discrepency dictionary. This changes how the other files are read, so it goes first
+    for bucket, key in folders.pop("Names", []):
+        results.append(readRecord(key, setCorrectNames, key, bucket))
+
+    # Report was generated by step function
+    for bucket, key in folders.pop("Auto", []):
+        print("Something went wrong with the auto report trigger")
+        results.append({'key': key, 'statusCode': 500, 'body': 'Something went wrong with the auto report trigger'})
+
+    # Batch runs are staged for the tt-batch invocation, which reads the whole folder at once
+    for bucket, key in folders.pop(BATCH_PREFIX.rstrip("/"), []):
+        results.append({'key': key, 'statusCode': 200, 'body': 'Staged for batch ingest'})
+
+    # Profiles are written by this function. Reading them would trigger another upload
+    for bucket, key in folders.pop(DIAGNOSTICS_PREFIX.rstrip("/"), []):
+        results.append({'key': key, 'statusCode': 200, 'body': 'Diagnostics are not read'})
+
+    # Files outside the known folders are left alone
+    for folder in [folder for folder in folders if folder not in (REPORT_PREFIX.rstrip("/"), TARGET_PREFIX.rstrip("/"))]:
+        for bucket, key in folders.pop(folder):
+            print("No handler for " + key)
+            results.append({'key': key, 'statusCode': 400, 'body': 'No handler for this folder'})
+
+    if not folders:
+        return results
+
+    # Load the names once for every remaining file
+    identity = getIdentityIndex()
 
+    # Report was generated locally
+    for bucket, key in folders.pop(REPORT_PREFIX.rstrip("/"), []):
+        results.append(readRecord(key, getHours, REPORT_PREFIX, key, bucket, identity))
+
+    # Initial target settings
+    for bucket, key in folders.pop(TARGET_PREFIX.rstrip("/"), []):
+        results.append(readRecord(key, getTargets, key, bucket, identity))
+
+    return results
+
+# Event keys that choose what the function does, in the order they are checked
+ROUTES = ['Records', 'tt-auto', 'tt-batch', 'login', 'getDynamoYTD', 'getDynamoWeeks', 'getNames', 'repairYTD', 'deleteS3']
+
+def eventRoute(event):
+    for route in ROUTES:
+        if route in event:
+            return route
+    return 'unknown'
+
+# Every invocation prints one metrics record for its route: stage timings, DynamoDB requests and consumed capacity,
+# row and employee counts, and how long the container took to start and load lazy dependencies
 def lambda_handler(event, context):
+    global coldStart
+
+    route = eventRoute(event)
+    lazyInit['seconds'] = 0.0
+    metrics.reset()
+    started = time.perf_counter()
+    try:
+        if PROFILE_ENABLED or event.get('profile') is True:
+            return profileEvent(event, context, route)
+        return handleEvent(event, context)
+    finally:
+        metrics.add('durationMs', (time.perf_counter() - started) * 1000)
+        metrics.add('moduleInitMs', MODULE_INIT_SECONDS * 1000 if coldStart else 0.0)
+        metrics.add('lazyInitMs', lazyInit['seconds'] * 1000)
+        metrics.add('coldStarts', 1 if coldStart else 0)
+        print(json.dumps(metrics.record(route, coldStart)))
+        coldStart = False
+
+# This function runs handleEvent under cProfile and tracemalloc. The profilers are only imported when an invocation asks for them
+# cProfile only sees the handler's thread, so time spent in pool threads (scans, buffered writes) shows up as waiting on them
+def profileEvent(event, context, route):
+    import cProfile
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        return handleEvent(event, context)
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # A failed upload must not change the invocation's response
+        try:
+            writeProfile(route, profiler, snapshot, peak)
+        except Exception as e:
+            print(e)
+
+# This function uploads the raw profile (loadable with pstats) and a text summary of the slowest functions and largest allocations
+def writeProfile(route, profiler, snapshot, peak):
+    import marshal
+    import pstats
+
+    prefix = DIAGNOSTICS_PREFIX + route + "/" + datetime.now().strftime('%Y%m%d%H%M%S%f') + "/"
+
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+    summary.write("Peak traced memory: " + str(round(peak / 1024, 1)) + " KB\n\n")
+    summary.write("Top " + str(PROFILE_TOP) + " allocation sites\n")
+    for statistic in snapshot.statistics('lineno')[:PROFILE_TOP]:
+        summary.write(str(statistic) + "\n")
+
+    s3.put_object(Bucket=BUCKET_NAME, Key=prefix + "profile.pstats", Body=marshal.dumps(stats.stats))
+    s3.put_object(Bucket=BUCKET_NAME, Key=prefix + "summary.txt", Body=summary.getvalue().encode('utf-8'))
+    print("Profile written to " + prefix)
+    return prefix
+
+def handleEvent(event, context):
     try:
         # Lambda function was triggered by S3 bucket
         if 'Records' in event:
-            # Report was generated locally
-            if (event['Records'][0]['s3']['object']['key'].split("/")[0] == "Reports"):
-                getHours(REPORT_PREFIX)
-            # Report was generated by step function
-            elif (event['Records'][0]['s3']['object']['key'].split("/")[0] == "Auto"):
-                print("Something went wrong with the auto report trigger")
-                raise Exception("Something went wrong with the auto report trigger")
-                return
-            # Updating Unanet/Microsoft name discrepency dictionary
-            elif (event['Records'][0]['s3']['object']['key'].split("/")[0] == "Names"):
-                setCorrectNames()
-            # Initial target settings
-            else:
-                getTargets()
+            results = processRecords(event['Records'])
+            failures = [result for result in results if result['statusCode'] != 200]
+            if failures:
+                return {
+                    'statusCode': 500,
+                    'body': str(len(failures)) + ' of ' + str(len(results)) + ' files could not be read',
+                    'results': results
+                }
             return {
                 'statusCode': 200,
-                'body': 'File read successfully!'
+                'body': 'File read successfully!',
+                'results': results
             }
         elif 'tt-auto' in event:
             if event['username'] == USERNAME and event['password'] == PASSWORD:
-                getHours(AUTO_PREFIX)
+                # The auto script names the report it uploaded. Older callers leave it to be looked up
+                getHours(AUTO_PREFIX, event.get('key'))
+                # Every week is uploaded under its own key, so remove it once read instead of clearing the folder before each upload
+                if event.get('key'):
+                    s3.delete_object(Bucket=BUCKET_NAME, Key=event['key'])
                 return {
                     'statusCode': 200,
                     'body': 'File read successfully!'
@@ -446,6 +1341,26 @@ def lambda_handler(event, context):
                     'statusCode': 500,
                     'body': 'Invalid credentials'
                 }
+        elif 'tt-batch' in event:
+            if event['username'] == USERNAME and event['password'] == PASSWORD:
+                # Only run folders under Batch/ can be ingested this way
+                runPrefix = event['tt-batch']
+                if not runPrefix.startswith(BATCH_PREFIX) or runPrefix == BATCH_PREFIX:
+                    return {
+                        'statusCode': 500,
+                        'body': 'Invalid batch folder'
+                    }
+                weeks = getHoursBatch(runPrefix)
+                deleteS3(runPrefix)
+                return {
+                    'statusCode': 200,
+                    'body': 'Read ' + str(len(weeks)) + ' weeks successfully!'
+                }
+            else:
+                return {
+                    'statusCode': 500,
+                    'body': 'Invalid credentials'
+                }
         elif 'login' in event:
             if event['username'] == USERNAME and event['password'] == PASSWORD:
                 return get_secret()
@@ -462,6 +1377,36 @@ def lambda_handler(event, context):
                     'statusCode': 500,
                     'body': 'Invalid credentials'
                 }
+        elif 'getDynamoWeeks' in event:
+            if event['username'] == USERNAME and event['password'] == PASSWORD:
+                return getDynamoWeeks(event['getDynamoWeeks'])
+            else:
+                return {
+                    'statusCode': 500,
+                    'body': 'Invalid credentials'
+                }
+        elif 'getNames' in event:
+            if event['username'] == USERNAME and event['password'] == PASSWORD:
+                # The local reconciler builds report IDs with the same names map
+                namesDict = getCorrectNames()
+                if isinstance(namesDict, Exception):
+                    raise namesDict
+                return namesDict
+            else:
+                return {
+                    'statusCode': 500,
+                    'body': 'Invalid credentials'
+                }
+        elif 'repairYTD' in event:
+            if event['username'] == USERNAME and event['password'] == PASSWORD:
+                # "ALL" checks every year. Pass "repair": false to only report mismatches
+                year = None if event['repairYTD'] == "ALL" else event['repairYTD']
+                return repairYTD(year, event.get('repair', True))
+            else:
+                return {
+                    'statusCode': 500,
+                    'body': 'Invalid credentials'
+                }
         elif 'deleteS3' in event:
             if event['deleteS3'] == "AUTO":
                 return deleteS3(AUTO_PREFIX)
@@ -485,3 +1430,4 @@ def lambda_handler(event, context):
             'body': 'Error running lambda function'
         }
 
+MODULE_INIT_SECONDS = time.perf_counter() - MODULE_INIT_STARTED
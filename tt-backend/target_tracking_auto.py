@@ -12,9 +12,16 @@ from selenium.webdriver.support import expected_conditions as EC
 
 from datetime import date, datetime, timedelta
 import json
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+import requests
 import pandas as pd
 
+# The parsing and DynamoDB code of the target-tracking lambda function, copied into the image next to this file
+import target_tracking
+
 LOCAL_USERNAME = ""
 LOCAL_PASSWORD = ""
 
@@ -22,16 +29,38 @@ LOCAL_PASSWORD = ""
 WAIT = 5
 # This is just for the Lambda function parsing
 LAMBDA_VALUE = "LambdaUseOnly"
+# Unanet home page. It shows the login form when there is no session
+UNANET_HOME = "https://attainit-byteratio.unanet.biz/attainit-byteratio/action/home"
 # Name of the target-tracking Lambda function
 LAMBDA_FUNCTION = "target-tracking"
 # This is where the report file gets downloaded to
 DOWNLOAD_DIR = "/tmp/Downloads"
 # This is the name of the downloaded report
 FILE_NAME = "report.csv"
+# How often in seconds a download is checked while waiting for it to finish
+DOWNLOAD_POLL = 0.05
+# Downloaded reports wait here while they upload, so the next download can start
+UPLOAD_DIR = "/tmp/Uploads"
+# Number of reports uploaded and ingested at the same time
+INGEST_WORKERS = 2
 # This is where YTD report files get downloaded
 YTD_DIR = "/tmp/YTD"
 # The s3 bucket name
 TT_BUCKET = "target-tracking-selenium"
+# Folder in the s3 bucket that ingested reports are archived under. Nothing is triggered by uploads here
+ARCHIVE_PREFIX = "Auto/"
+# Position of the saved reports in Unanet. The dated report has the same columns plus the date of each entry
+SAVED_REPORT = 0
+DATED_REPORT = 1
+# CSV export URL of each saved report. Reports without one are always downloaded through the browser
+REPORT_EXPORT_URLS = {SAVED_REPORT: "", DATED_REPORT: ""}
+# Query parameters the export URL takes for the date range
+EXPORT_START_PARAM = "beginDate"
+EXPORT_END_PARAM = "endDate"
+# Name of the entry date column in the dated report
+DATE_COLUMN = "Date"
+# Columns the target-tracking lambda reads from a report
+REPORT_COLUMNS = ['Person', 'Project', 'Hours']
 
 AWS_ACCESS_KEY_ID = ""
 AWS_SECRET_ACCESS_KEY = ""
@@ -51,148 +80,280 @@ s3_client = boto3.client(
     aws_secret_access_key = AWS_SECRET_ACCESS_KEY
 )
 
-def generateReport(start_date, end_date, folder):
-    currDir = os.getcwd()
-    downloadPath = os.path.join(currDir, folder)
-
-    chrome_options = ChromeOptions()
-    chrome_options.add_argument("--headless=new")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--disable-dev-tools")
-    chrome_options.add_argument("--no-zygote")
-    chrome_options.add_argument("--single-process")
-    chrome_options.add_argument(f"--user-data-dir={mkdtemp()}")
-    chrome_options.add_argument(f"--data-path={mkdtemp()}")
-    chrome_options.add_argument(f"--disk-cache-dir={mkdtemp()}")
-    chrome_options.add_argument("--remote-debugging-pipe")
-    chrome_options.add_argument("--verbose")
-    chrome_options.add_argument("--log-path=/tmp")
-    chrome_options.binary_location = "/opt/chrome/chrome-linux64/chrome"
-
-    chrome_options.add_experimental_option(
-        "prefs", {"download.default_directory": downloadPath,
-                "download.prompt_for_download": False,
-                "credentials_enable_service": False,
-                "profile.password_manager_enabled": False,
-        }
-    )
-
-    service = Service(
-        executable_path="/opt/chrome-driver/chromedriver-linux64/chromedriver",
-        service_log_path="/tmp/chromedriver.log"
-    )
-
-    driver = webdriver.Chrome(
-        service=service,
-        options=chrome_options
-    )
-    
-    driver.get("https://attainit-byteratio.unanet.biz/attainit-byteratio/action/home")
+# This function blocks until a download has finished and returns "Success", or an error after timeout seconds without progress
+# Chrome writes into "<name>.crdownload" and renames it when done, so the download is complete once the file exists,
+# no partial file is left in the folder, and its size has stopped changing
+def waitForDownload(file_path, timeout):
+    folder = os.path.dirname(file_path) or "."
+    start_time = time.time()
+    lastSize = -1
+    partialSize = -1
+
+    while time.time() - start_time <= timeout:
+        partials = [os.path.join(folder, file) for file in os.listdir(folder) if file.endswith(".crdownload")]
+        if partials:
+            # A growing partial file is progress, so large reports are not cut off by the timeout
+            size = sum(os.path.getsize(partial) for partial in partials if os.path.exists(partial))
+            if size != partialSize:
+                partialSize = size
+                start_time = time.time()
+            lastSize = -1
+        elif os.path.exists(file_path):
+            size = os.path.getsize(file_path)
+            if size == lastSize:
+                return "Success"
+            lastSize = size
+        time.sleep(DOWNLOAD_POLL)
+
+    return TimeoutError(f"File not found within {timeout} seconds: {file_path}")
+
+# This class keeps one logged-in Chrome driver for a whole run, and across warm Lambda invocations
+# Each report only changes the download folder and date range. The driver is restarted if it dies and logs in again if Unanet logs it out
+class UnanetSession:
+    def __init__(self):
+        self.driver = None
+        self.http = None
+
+    def startDriver(self):
+        chrome_options = ChromeOptions()
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--disable-dev-tools")
+        chrome_options.add_argument("--no-zygote")
+        chrome_options.add_argument("--single-process")
+        chrome_options.add_argument(f"--user-data-dir={mkdtemp()}")
+        chrome_options.add_argument(f"--data-path={mkdtemp()}")
+        chrome_options.add_argument(f"--disk-cache-dir={mkdtemp()}")
+        chrome_options.add_argument("--remote-debugging-pipe")
+        chrome_options.add_argument("--verbose")
+        chrome_options.add_argument("--log-path=/tmp")
+        chrome_options.binary_location = "/opt/chrome/chrome-linux64/chrome"
+
+        chrome_options.add_experimental_option(
+            "prefs", {"download.prompt_for_download": False,
+                    "credentials_enable_service": False,
+                    "profile.password_manager_enabled": False,
+            }
+        )
 
-    global TT_username
-    global TT_password
+        service = Service(
+            executable_path="/opt/chrome-driver/chromedriver-linux64/chromedriver",
+            service_log_path="/tmp/chromedriver.log"
+        )
 
-    username_XPATH = '//*[@id="username"]'
-    # Locate the login field
-    try:
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, username_XPATH))
-        )[0]
-        # Enter the login
-        driver.find_element(By.XPATH, username_XPATH).send_keys(str(TT_username))
-    except Exception as e:
-        return e
+        self.driver = webdriver.Chrome(
+            service=service,
+            options=chrome_options
+        )
 
-    password_XPATH = '//*[@id="password"]'
-    try:
+    # The driver is healthy as long as the browser still answers
+    def isAlive(self):
+        if self.driver is None:
+            return False
+        try:
+            self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def quit(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+        self.driver = None
+        self.http = None
+
+    def login(self):
+        driver = self.driver
+
+        global TT_username
+        global TT_password
+
+        username_XPATH = '//*[@id="username"]'
         # Locate the login field
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, password_XPATH))
-        )[0]
-        # Enter the login
-        driver.find_element(By.XPATH, password_XPATH).send_keys(str(TT_password))
-    except Exception as e:
-        return e
+        try:
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, username_XPATH))
+            )[0]
+            # Enter the login
+            driver.find_element(By.XPATH, username_XPATH).send_keys(str(TT_username))
+        except Exception as e:
+            return e
+
+        password_XPATH = '//*[@id="password"]'
+        try:
+            # Locate the login field
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, password_XPATH))
+            )[0]
+            # Enter the login
+            driver.find_element(By.XPATH, password_XPATH).send_keys(str(TT_password))
+        except Exception as e:
+            return e
+
+        loginBtn_XPATH = '//*[@id="button_ok"]'
+        try:
+            # Clicking login
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, loginBtn_XPATH))
+            )[0].click()
+        except Exception as e:
+            return e
+
+        return "Success"
+
+    # This function opens the home page, starting the browser or logging in again only when needed
+    def openHome(self):
+        if not self.isAlive():
+            self.quit()
+            try:
+                self.startDriver()
+            except Exception as e:
+                return e
 
-    loginBtn_XPATH = '//*[@id="button_ok"]'
-    try:
-        # Clicking login
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, loginBtn_XPATH))
-        )[0].click()
-    except Exception as e:
-        return e
+        try:
+            self.driver.get(UNANET_HOME)
+        except Exception as e:
+            self.quit()
+            return e
+
+        # The login form only shows up when the session has expired (or on the first visit)
+        if self.driver.find_elements(By.ID, "username"):
+            return self.login()
+        return "Success"
+
+    # This function builds an HTTP session from the browser's login cookies, logging in first if needed
+    def httpSession(self):
+        if self.http is None:
+            err = self.openHome()
+            if err != "Success":
+                return err
+
+            http = requests.Session()
+            for cookie in self.driver.get_cookies():
+                http.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+            self.http = http
+        return self.http
+
+    # This function downloads a saved report's CSV export straight over HTTP, without rendering any pages
+    # An expired session gets the login page back instead of a CSV, so it logs in again once and retries
+    def downloadReport(self, start_date, end_date, folder, report=SAVED_REPORT):
+        exportURL = REPORT_EXPORT_URLS.get(report)
+        if not exportURL:
+            return Exception("No export URL is set for saved report " + str(report))
+
+        for attempt in range(2):
+            http = self.httpSession()
+            if not isinstance(http, requests.Session):
+                return http
+
+            try:
+                response = http.get(exportURL, params={EXPORT_START_PARAM: start_date, EXPORT_END_PARAM: end_date}, timeout=WAIT * 6)
+            except Exception as e:
+                return e
+
+            if response.status_code == 200 and 'html' not in response.headers.get('Content-Type', ''):
+                break
+            self.http = None
+        else:
+            return Exception("Report export returned " + str(response.status_code) + " instead of a CSV")
 
-    report_XPATH = '//*[@id="my_reports"]/ul/li/a'
-    try:
-        # Clicking the saved report
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, report_XPATH))
-        )[0].click()
-    except Exception as e:
-        return e
+        # Write next to the final name first so nothing reads a half written report
+        filePath = os.path.join(folder, FILE_NAME)
+        with open(filePath + ".part", 'wb') as reportFile:
+            reportFile.write(response.content)
+        os.replace(filePath + ".part", filePath)
+        return "Success"
 
-    criteria_XPATH = '//*[@id="nav-links-top"]/a[1]'
-    try:
-        # Clicking the criteria
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, criteria_XPATH))
-        )[0].click()
-    except Exception as e:
-        return e
-    
-    startDate_XPATH = '//*[@id="range"]/input[1]'
-    try:
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, startDate_XPATH))
-        )[0]
-        driver.find_element(By.XPATH, startDate_XPATH).clear()
-        driver.find_element(By.XPATH, startDate_XPATH).send_keys(start_date) 
-    except Exception as e:
-        return e
+    def generateReport(self, start_date, end_date, folder, report=SAVED_REPORT):
+        currDir = os.getcwd()
+        downloadPath = os.path.join(currDir, folder)
 
-    endDate_XPATH = '//*[@id="range"]/input[2]'
-    try:
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, endDate_XPATH))
-        )[0]
-        driver.find_element(By.XPATH, endDate_XPATH).clear()
-        driver.find_element(By.XPATH, endDate_XPATH).send_keys(end_date) 
-    except Exception as e:
-        return e
+        err = self.openHome()
+        if err != "Success":
+            return err
+        driver = self.driver
 
-    RT_XPATH = '//*[@id="body"]/div/form[2]/table/tbody/tr[9]/td[2]/select/option[12]'
-    try:
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, RT_XPATH))
-        )[0].click()
-    except Exception as e:
-        return e
+        try:
+            # Every report can go to a different folder without restarting the browser
+            driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": downloadPath})
+        except Exception as e:
+            return e
 
-    # Use the upper button because Selenium can't track the bottom one
-    download_XPATH = '//*[@id="body"]/div/form[2]/table/tbody/tr[1]/td/a[2]'
-    try:
-        WebDriverWait(driver, WAIT).until(
-            EC.visibility_of_any_elements_located((By.XPATH, download_XPATH))
-        )[0].click()
-    except Exception as e:
-        return e
+        report_XPATH = '//*[@id="my_reports"]/ul/li/a'
+        try:
+            # Clicking the saved report
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, report_XPATH))
+            )[report].click()
+        except Exception as e:
+            return e
+
+        criteria_XPATH = '//*[@id="nav-links-top"]/a[1]'
+        try:
+            # Clicking the criteria
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, criteria_XPATH))
+            )[0].click()
+        except Exception as e:
+            return e
+        
+        startDate_XPATH = '//*[@id="range"]/input[1]'
+        try:
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, startDate_XPATH))
+            )[0]
+            driver.find_element(By.XPATH, startDate_XPATH).clear()
+            driver.find_element(By.XPATH, startDate_XPATH).send_keys(start_date) 
+        except Exception as e:
+            return e
+
+        endDate_XPATH = '//*[@id="range"]/input[2]'
+        try:
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, endDate_XPATH))
+            )[0]
+            driver.find_element(By.XPATH, endDate_XPATH).clear()
+            driver.find_element(By.XPATH, endDate_XPATH).send_keys(end_date) 
+        except Exception as e:
+            return e
+
+        RT_XPATH = '//*[@id="body"]/div/form[2]/table/tbody/tr[9]/td[2]/select/option[12]'
+        try:
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, RT_XPATH))
+            )[0].click()
+        except Exception as e:
+            return e
+
+        # Use the upper button because Selenium can't track the bottom one
+        download_XPATH = '//*[@id="body"]/div/form[2]/table/tbody/tr[1]/td/a[2]'
+        try:
+            WebDriverWait(driver, WAIT).until(
+                EC.visibility_of_any_elements_located((By.XPATH, download_XPATH))
+            )[0].click()
+        except Exception as e:
+            return e
+
+        # Need to make sure the file actually got saved locally
+        return waitForDownload(folder + "/" + FILE_NAME, WAIT * 2)
+
+# The session is module level so warm Lambda invocations reuse the logged-in browser
+unanetSession = UnanetSession()
+
+# Reports with an export URL are downloaded directly. The browser is only used when that is not possible
+def generateReport(start_date, end_date, folder, report=SAVED_REPORT):
+    if REPORT_EXPORT_URLS.get(report):
+        err = unanetSession.downloadReport(start_date, end_date, folder, report)
+        if err == "Success":
+            return err
+        print("Direct report download failed, using the browser instead: " + str(err))
 
-    # Need to make sure the file actually got saved locally
-    start_time = time.time()
-    while not os.path.exists(folder + "/" + FILE_NAME):
-        if time.time() - start_time > WAIT * 2:
-            driver.quit()
-            return Exception(f"File not found within {WAIT * 2} seconds: {folder}/{FILE_NAME}")
-        time.sleep(0.2)
-    
-    # Despite saving locally, Selenium has a delay in processing the download
-    # This sleep prevents a "cancel download" prompt caused by that
-    time.sleep(0.5)
-    driver.quit()
-    return "Success"
+    return unanetSession.generateReport(start_date, end_date, folder, report)
 
 # This function invokes the target-tracking lambda function with the given payload
 def invoke_lambda_function(payload):
@@ -208,41 +369,135 @@ def invoke_lambda_function(payload):
     except Exception as e:
         return {'statusCode': 500, 'body': 'Error invoking target-tracking lambda: ' + str(e)}
     
-# This function replaces the current s3 csv file with the newly generated one
-def uploadTimecardFile(end_date):
+# This function writes a downloaded report straight to DynamoDB, then keeps a copy in the s3 bucket as an archive
+def uploadTimecardFile(end_date, report_path=DOWNLOAD_DIR + "/" + FILE_NAME):
     try:
-        payload = {
-            "deleteS3": "AUTO",
-            "username": LOCAL_USERNAME,
-            "password": LOCAL_PASSWORD
-        }
-        result = invoke_lambda_function(payload)
-        if result['statusCode'] == 500:
-            return "An error occurred in the target-tracking lambda function"
-        
-        # Add new report
-        end_date = (datetime.strptime(end_date, "%m/%d/%Y")).strftime("%Y-%m-%d")
-        s3_file_path = "Auto/" + str(end_date) + ".csv"
-
-        s3_client.upload_file(DOWNLOAD_DIR + "/" + FILE_NAME, TT_BUCKET, str(s3_file_path))
-
-        # Since this script runs in the state machine, we need to trigger the second lambda function manually to catch errors
-        payload = {
-            "tt-auto": LAMBDA_VALUE,
-            "username": LOCAL_USERNAME,
-            "password": LOCAL_PASSWORD
-        }
-        result = invoke_lambda_function(payload)
-        if result['statusCode'] == 500:
-            return "An error occurred in the target-tracking lambda function"
+        reportEndDate = datetime.strptime(end_date, "%m/%d/%Y")
+        target_tracking.ingestReportFile(report_path, reportEndDate)
+
+        s3_file_path = ARCHIVE_PREFIX + reportEndDate.strftime("%Y-%m-%d") + ".csv"
+        s3_client.upload_file(report_path, TT_BUCKET, str(s3_file_path))
     except Exception as e:
         return e
     
     return "Success"
 
-# This function corrects discrepencies in Dynamo and Unanet's YTD reports starting from the current pay period and working backwards
-# It will preemptively end once the correction has been made
-def fixDynamoYTD(report_date):
+# Uploads and ingestion run here while the next report downloads
+ingestExecutor = ThreadPoolExecutor(max_workers=INGEST_WORKERS)
+
+# This function starts uploading and ingesting the downloaded report in the background
+# The report is moved out of the download folder first so the next download can start straight away
+# It returns a future that resolves to "Success" or the error
+def submitTimecardFile(end_date):
+    reportPath = UPLOAD_DIR + "/" + datetime.strptime(end_date, "%m/%d/%Y").strftime("%Y-%m-%d") + ".csv"
+    os.replace(DOWNLOAD_DIR + "/" + FILE_NAME, reportPath)
+    return ingestExecutor.submit(uploadTimecardFile, end_date, reportPath)
+
+# This function splits a dated report into Saturday to Friday weeks, named after the day each week ends
+# The first week of the year starts on Jan 1 and the last one is cut off at Dec 31, like the weekly reports
+def splitReportByWeek(report_path, year):
+    reportDF = pd.read_csv(report_path)
+    if DATE_COLUMN not in reportDF.columns:
+        return None
+
+    dates = pd.to_datetime(reportDF[DATE_COLUMN])
+    inYear = dates.dt.year == year
+    reportDF = reportDF[inYear]
+    dates = dates[inYear]
+
+    # Every day belongs to the week ending on the next Friday (weekday 4)
+    weekEnds = dates + pd.to_timedelta((4 - dates.dt.weekday) % 7, unit='D')
+    weekEnds = weekEnds.where(weekEnds.dt.year == year, pd.Timestamp(year, 12, 31))
+
+    weeks = {}
+    for weekEnd, rows in reportDF.groupby(weekEnds):
+        weeks[weekEnd.strftime("%Y-%m-%d")] = rows[REPORT_COLUMNS]
+    return weeks
+
+# This function returns the week number a report ending on week_end is stored under in DynamoDB
+# The last days of December are the "53rd" week so they do not overwrite the first week of the year
+def reportWeek(week_end):
+    week = week_end.isocalendar()[1]
+    if week_end.month == 12 and week == 1:
+        week = 53
+    return week
+
+# This function returns the end date of a stored week, for weeks that have no rows in the report
+def weekEndDate(week, year):
+    if week == 53:
+        return date(year, 12, 31).strftime("%Y-%m-%d")
+    return min(date.fromisocalendar(year, week, 5), date(year, 12, 31)).strftime("%Y-%m-%d")
+
+# This function lists the employees whose DynamoDB and report YTD totals differ
+def mismatchedEmployees(dynamoTotals, reportTotals):
+    mismatched = []
+    for employee in reportTotals:
+        if employee not in dynamoTotals:
+            mismatched.append(employee)
+        elif round(dynamoTotals[employee]['Direct'], 2) != round(reportTotals[employee]['Direct'], 2) or round(dynamoTotals[employee]['Indirect'], 2) != round(reportTotals[employee]['Indirect'], 2):
+            mismatched.append(employee)
+    return mismatched
+
+# This function compares every week of the dated report with DynamoDB for the mismatched employees
+# Only their rows in the weeks that differ are returned, so only the edited weeks get written again
+def divergentWeeks(weeks, dynamoWeeks, employees, year, last_week, identity):
+    noHours = {'Direct': 0.0, 'Indirect': 0.0}
+
+    # Employees who no longer have hours in a week still need a row to write zero hours
+    names = {}
+    reportWeeks = {}
+    for weekEnd, rows in weeks.items():
+        rowIDs = rows['Person'].map(lambda employeeName: target_tracking.reportEmployeeID(employeeName, year, identity))
+        for employeeID, employeeName in zip(rowIDs, rows['Person']):
+            names.setdefault(employeeID, employeeName)
+        weekNumber = str(reportWeek(datetime.strptime(weekEnd, "%Y-%m-%d").date()))
+        reportWeeks[weekNumber] = (weekEnd, rows, rowIDs, totalHours(rows, year, identity))
+
+    staged = {}
+    for employee in employees:
+        if employee not in names:
+            continue
+
+        storedWeeks = {week: hours for week, hours in dynamoWeeks.get(employee, {}).items() if int(week) <= last_week}
+        for weekNumber in sorted(set(storedWeeks) | set(reportWeeks), key=int):
+            if weekNumber in reportWeeks:
+                weekEnd, rows, rowIDs, totals = reportWeeks[weekNumber]
+                employeeRows = rows[rowIDs == employee]
+            else:
+                weekEnd = weekEndDate(int(weekNumber), year)
+                totals = {}
+                employeeRows = pd.DataFrame(columns=REPORT_COLUMNS)
+
+            reported = totals.get(employee, noHours)
+            stored = storedWeeks.get(weekNumber, noHours)
+            if round(reported['Direct'], 2) == round(stored['Direct'], 2) and round(reported['Indirect'], 2) == round(stored['Indirect'], 2):
+                continue
+
+            if employeeRows.empty:
+                employeeRows = pd.DataFrame([{'Person': names[employee], 'Project': '', 'Hours': 0.0}])
+            staged[weekEnd] = pd.concat([staged[weekEnd], employeeRows]) if weekEnd in staged else employeeRows
+
+    return staged
+
+# This function keeps a copy of the corrected weekly reports in the s3 bucket as a single archive
+def archiveWeeklyReports(archive_key, weeks):
+    try:
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zipped:
+            for weekEnd, rows in weeks.items():
+                zipped.writestr(weekEnd + ".csv", rows.to_csv(index=False))
+
+        s3_client.put_object(Bucket=TT_BUCKET, Key=archive_key, Body=archive.getvalue())
+    except Exception as e:
+        return e
+
+    return "Success"
+
+# This function corrects discrepencies in Dynamo and Unanet's YTD reports
+# A single dated report from Jan 1 to the last pay period is split into weeks and compared with DynamoDB week by week
+# Only the weeks that differ for the mismatched employees are ingested again
+# ingest is the pending upload of the week just generated, if there is one
+def fixDynamoYTD(report_date, ingest=None):
     # Check if we need to replace the file
     removeFiles(YTD_DIR)
 
@@ -263,94 +518,81 @@ def fixDynamoYTD(report_date):
     if err != 'Success':
         return err
 
+    # The week just uploaded has to be in DynamoDB before the totals are compared
+    if ingest is not None:
+        err = ingest.result()
+        if err != 'Success':
+            return "Unable to upload timecard. Error: " + str(err)
+
     dynamoTotals = getDynamoYTD(reportYear)
 
     if dynamoTotals == "ERROR":
         return "Error getting DynamoDB YTD totals"
     
-    reportTotals = getReportYTD()
+    # Report IDs are built from the name discrepencies, so they are loaded once for the whole run
+    try:
+        identity = target_tracking.getIdentityIndex()
+    except Exception as e:
+        return e
+
+    reportTotals = getReportYTD(reportYear, identity)
+    if isinstance(reportTotals, str):
+        return reportTotals
 
     # Totals already match. No need to generate reports
     err = compareYTDTotals(dynamoTotals, reportTotals)
     if err == 0:
         return "YTD records already match!"
 
-    firstDay = date(reportYear, 1, 1)
-    
-    start_date = end_date
-    while start_date.weekday() != 5:
-        start_date -= timedelta(days=1)
-
     removeFiles(DOWNLOAD_DIR)
 
-    # Generate the first report of the year which could end on any day of the week
-
-    err = generateReport(start_date.strftime("%m/%d/%Y"), end_date.strftime("%m/%d/%Y"), DOWNLOAD_DIR)
+    # One report for the whole year, with the date of every entry
+    err = generateReport(start_date.strftime("%m/%d/%Y"), end_date.strftime("%m/%d/%Y"), DOWNLOAD_DIR, DATED_REPORT)
     if err != 'Success':
         return err
 
-    err = uploadTimecardFile(end_date.strftime("%m/%d/%Y"))
-    if err != 'Success':
-        return err
-    
-    # This is a check for when the end date is not a Friday (when we generate on 12/31) so we don't generate the same report twice
-    if end_date.weekday() != 4:
-        while end_date.weekday() != 4:
-            end_date -= timedelta(days=1)
-    else:
-        end_date = end_date - timedelta(days=7)
-    start_date = end_date - timedelta(days=6)
-
-    iterations = 0
-
-    # Go backwards from the current time period until the first day of the year
-    while start_date > firstDay:
-        iterations += 1
+    weeks = splitReportByWeek(DOWNLOAD_DIR + "/" + FILE_NAME, reportYear)
+    if weeks is None:
+        return "The dated report is missing the " + DATE_COLUMN + " column"
 
-        removeFiles(DOWNLOAD_DIR)
+    dynamoWeeks = getDynamoWeeks(reportYear)
+    if dynamoWeeks == "ERROR":
+        return "Error getting DynamoDB weekly hours"
 
-        err = generateReport(start_date.strftime("%m/%d/%Y"), end_date.strftime("%m/%d/%Y"), DOWNLOAD_DIR)
-        if err != 'Success':
-            return err
+    employees = mismatchedEmployees(dynamoTotals, reportTotals)
+    weeks = divergentWeeks(weeks, dynamoWeeks, employees, reportYear, reportWeek(end_date), identity)
+    if weeks:
+        try:
+            target_tracking.ingestWeeklyReports(weeks)
+        except Exception as e:
+            return e
 
-        err = uploadTimecardFile(end_date.strftime("%m/%d/%Y"))
+        err = archiveWeeklyReports(ARCHIVE_PREFIX + "YTD-" + datetime.now().strftime("%Y%m%d%H%M%S") + ".zip", weeks)
         if err != 'Success':
             return err
 
-        start_date -= timedelta(days=7)
-        end_date -= timedelta(days=7)
-
-        # Every two weeks, check if YTD has been corrected. If it has, no need to generate more reports
-        if iterations%2 == 0:
-            dynamoTotals = getDynamoYTD(reportYear)
+    return repairDriftedTotals(reportYear, reportTotals)
 
-            if dynamoTotals == "ERROR":
-                return "Error getting DynamoDB YTD totals"
-
-            reportTotals = getReportYTD()
-            
-            mismatches = compareYTDTotals(dynamoTotals, reportTotals)
-            if mismatches == 0:
-                return "Success"
-            
-    # Still need to generate the report running from Jan 1 to the first Friday
-    nextFriday = firstDay
-    while nextFriday.weekday() != 4:
-        nextFriday += timedelta(days=1)
-    
-    start_date = firstDay
-    end_date = nextFriday
-
-    removeFiles(DOWNLOAD_DIR)
-    # Generate the last report here since it may not match Saturday to Friday period
-    err = generateReport(start_date.strftime("%m/%d/%Y"), end_date.strftime("%m/%d/%Y"), DOWNLOAD_DIR)
-    if err != 'Success':
-        return err
+# This function runs once every week matches the report
+# Any totals that still differ come from running DirectYTD/IndirectYTD totals that drifted from the weeks, so those totals are recomputed
+def repairDriftedTotals(year, reportTotals):
+    dynamoTotals = getDynamoYTD(year)
+    if dynamoTotals == "ERROR":
+        return "Error getting DynamoDB YTD totals"
+    if compareYTDTotals(dynamoTotals, reportTotals) == 0:
+        return "Success"
 
-    err = uploadTimecardFile(end_date.strftime("%m/%d/%Y"))
-    if err != 'Success':
-        return err
+    try:
+        target_tracking.repairYTD(year)
+    except Exception as e:
+        return e
 
+    dynamoTotals = getDynamoYTD(year)
+    if dynamoTotals == "ERROR":
+        return "Error getting DynamoDB YTD totals"
+    mismatches = compareYTDTotals(dynamoTotals, reportTotals)
+    if mismatches > 0:
+        return str(mismatches) + " YTD totals still differ from the report after repairing them"
     return "Success"
 
 # This function removes everything from a directory
@@ -371,76 +613,48 @@ def getDynamoYTD(year):
         return "ERROR"
     return result
 
+# This function gets every employee's stored weekly hours from DynamoDB
+def getDynamoWeeks(year):
+
+    payload = {
+        "getDynamoWeeks": year,
+        "username": LOCAL_USERNAME,
+        "password": LOCAL_PASSWORD
+    }
+    result = invoke_lambda_function(payload)
+    if 'statusCode' in result:
+        return "ERROR"
+    return result
+
 # This function totals employee direct and indirect hours from data in Unanet
-def getReportYTD():
+def getReportYTD(year=None, identity=None):
     reportFile = YTD_DIR + "/" + FILE_NAME
 
-    currYear = str(datetime.now().year)
+    currYear = str(year if year is not None else datetime.now().year)
 
-    # Make sure report has been uploaded
-    start_time = time.time()
-    while not os.path.exists(YTD_DIR + "/" + FILE_NAME):
-        if time.time() - start_time > WAIT * 2:
-            return TimeoutError(f"File not found within {WAIT * 2} seconds: {YTD_DIR}/{FILE_NAME}")
-        time.sleep(0.2)
+    # Make sure report has been downloaded
+    err = waitForDownload(YTD_DIR + "/" + FILE_NAME, WAIT * 2)
+    if err != "Success":
+        return err
         
     # Creating a dataframe from the report
     reportCSV = pd.read_csv(reportFile)
     reportDF = pd.DataFrame(reportCSV)
 
-    totalHoursDict = {}
-
-    # Totaling everyone's direct and indirect hours from the report
-    for row in reportDF.index:
-        employeeName = reportDF.loc[row,'Person']
-        firstname = employeeName.replace(",", "").split(" ")[1]
-        lastname = employeeName.replace(",", "").split(" ")[0]
-        employeeID = str(firstname) + str(lastname) + str(currYear)
+    if identity is None:
+        identity = target_tracking.getIdentityIndex()
 
-        if employeeID not in totalHoursDict.keys():
-            totalHoursDict[employeeID] = {'Indirect':0.0, 'Direct':0.0}
+    return totalHours(reportDF, currYear, identity)
 
-        if 'OH_BR' in reportDF.loc[row, 'Project'] or 'BEREAVEMENT' in reportDF.loc[row, 'Project'] or 'PARENTAL' in reportDF.loc[row, 'Project']:
-            totalHoursDict[employeeID]['Indirect'] += float(reportDF.loc[row, 'Hours'])
-        elif 'FLEX_TIME' in reportDF.loc[row, 'Project']:
-            continue
-        else:
-            totalHoursDict[employeeID]['Direct'] += float(reportDF.loc[row, 'Hours'])
-        
-    return totalHoursDict
+# This function totals every employee's direct and indirect hours in a report
+# The rows are totaled the same way the target-tracking function totals an uploaded report. Blank cells are read as empty strings
+def totalHours(reportDF, year, identity):
+    rows = reportDF.astype(object).where(reportDF.notna(), '').to_dict('records')
+    return target_tracking.reportYTDTotals(rows, year, identity)
 
 # This function compares the DynamoDB and Unanet data for mismatches
 def compareYTDTotals(dynamoTotals, reportTotals):
-    mismatches = 0
-    for employee in reportTotals:
-        # Comparing each employee and writing to an output
-        try:
-            if round(dynamoTotals[employee]['Direct'], 2) == round(reportTotals[employee]['Direct'], 2) and round(dynamoTotals[employee]['Indirect'], 2) == round(reportTotals[employee]['Indirect'], 2):
-                pass
-            else:
-                fullname = splitID(str(employee))
-                fullname = fullname[0] + " " + fullname[1][:-4]
-                mismatches += 1
-        except KeyError:
-            mismatches += 1
-    return mismatches
-
-# This function splits the DynamoDB ID into a firstname, lastname format
-def splitID(s):
-    capitalCount = 0
-    splitPos = -1
-
-    for i, char in enumerate(s):
-        if char.isupper():
-            capitalCount += 1
-            if capitalCount == 2:
-                splitPos = i
-                break
-
-    if splitPos != -1:
-        return [s[:splitPos], s[splitPos:]]
-    else:
-        return [s]
+    return len(mismatchedEmployees(dynamoTotals, reportTotals))
 
 def getCreds():
     global TT_username
@@ -486,10 +700,12 @@ def lambda_handler(event, context):
 
     os.makedirs("/tmp/Downloads", exist_ok=True)
     os.makedirs("/tmp/YTD", exist_ok=True)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
 
     # Lambda function might have a "warm start" in which data can carry over
     # Remove any files that may exist from a previous iteration
     removeFiles(DOWNLOAD_DIR)
+    removeFiles(UPLOAD_DIR)
 
     # We need to generate a report from the previous year and the current year
     if end_date_2 is not None:
@@ -502,30 +718,23 @@ def lambda_handler(event, context):
             raise Exception("An error occurred: " + str(err))
         
         # Upload the report to the S3 bucket where the target-tracking Lambda function will take over parsing
-        err = uploadTimecardFile(end_date_2)
-        if err != "Success":
-            raise Exception("Unable to upload timecard. Error: " + str(err))
-        
-        removeFiles(DOWNLOAD_DIR)
+        # This runs in the background while the current year's report downloads
+        previousIngest = submitTimecardFile(end_date_2)
 
         # Current year
         err = generateReport(start_date_2, end_date, DOWNLOAD_DIR)
         if err != "Success":
             raise Exception("An error occurred: " + str(err))
         
-        # Upload the report to the S3 bucket where the target-tracking Lambda function will take over parsing
-        err = uploadTimecardFile(end_date)
-        if err != "Success":
-            raise Exception("Unable to upload timecard. Error: " + str(err))
+        currentIngest = submitTimecardFile(end_date)
         
-        time.sleep(2)
-        # Previous year
-        err = fixDynamoYTD(end_date_2)
+        # Previous year. The current year's report can still be ingesting while this runs
+        err = fixDynamoYTD(end_date_2, previousIngest)
         if not (err == "Success" or err == "YTD records already match!"):
             raise Exception("An error occurred while fixing YTD totals: " + str(err))
 
         # Current year
-        err = fixDynamoYTD(end_date)
+        err = fixDynamoYTD(end_date, currentIngest)
         if not (err == "Success" or err == "YTD records already match!"):
             raise Exception("An error occurred while fixing YTD totals: " + str(err))
     # Only generate information for the current year
@@ -535,10 +744,9 @@ def lambda_handler(event, context):
             raise Exception("An error occurred: " + str(err))
         
         # Upload the report to the S3 bucket where the target-tracking Lambda function will take over parsing
-        err = uploadTimecardFile(end_date)
-        if err != "Success":
-            raise Exception("Unable to upload timecard. Error: " + str(err))
+        # The YTD report downloads while this runs
+        currentIngest = submitTimecardFile(end_date)
 
-        err = fixDynamoYTD(end_date)
+        err = fixDynamoYTD(end_date, currentIngest)
         if not (err == "Success" or err == "YTD records already match!"):
             raise Exception("An error occurred while fixing YTD totals: " + str(err))
\ No newline at end of file
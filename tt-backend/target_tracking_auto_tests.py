@@ -0,0 +1,97 @@
+import unittest
+from unittest.mock import patch
+import json
+import os
+import tempfile
+from moto import mock_aws
+import boto3
+import target_tracking
+import target_tracking_auto as ttauto
+
+DYNAMO_TABLE = "target-tracking-concrete"
+BUCKET_NAME = 'target-tracking-selenium'
+REPORT_HEADER = "Person Organization,Person,Project,TransactionCurrency,Hours,TimeTC"
+
+class TestSuite(unittest.TestCase):
+
+    def setUp(self):
+        # The auto app reaches the target-tracking function through invoke_lambda_function. Here it runs in-process
+        target_tracking.USERNAME = ttauto.LOCAL_USERNAME
+        target_tracking.PASSWORD = ttauto.LOCAL_PASSWORD
+        target_tracking.invalidateCache()
+        target_tracking.dynamodb.limiters = None
+
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+
+        self.dynamodb = boto3.client('dynamodb', region_name='us-east-1')
+        self.dynamodb.create_table(
+            TableName=DYNAMO_TABLE,
+            KeySchema=[{'AttributeName': 'ID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'ID', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+        )
+        self.dynamodb.put_item(TableName=DYNAMO_TABLE, Item={"ID": {"S": "names"}, "UnanetKey": {"S": json.dumps({})}, "NamesVersion": {"S": "v1"}})
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET_NAME)
+
+        self.folder = tempfile.TemporaryDirectory()
+        for name in ["YTD", "Downloads"]:
+            os.makedirs(os.path.join(self.folder.name, name))
+        self.paths = patch.multiple(ttauto, YTD_DIR=os.path.join(self.folder.name, "YTD"), DOWNLOAD_DIR=os.path.join(self.folder.name, "Downloads"))
+        self.paths.start()
+
+    def tearDown(self):
+        self.paths.stop()
+        self.folder.cleanup()
+        self.mock_aws.stop()
+
+    # This function stands in for Unanet. The YTD report is written to YTD_DIR and the dated report to DOWNLOAD_DIR
+    def fakeReports(self, ytdRows, datedRows):
+        def generateReport(start_date, end_date, folder, report=ttauto.SAVED_REPORT):
+            with open(folder + "/" + ttauto.FILE_NAME, 'w') as reportFile:
+                if report == ttauto.DATED_REPORT:
+                    reportFile.write(REPORT_HEADER + ",Date\n")
+                    for row in datedRows:
+                        reportFile.write(",".join('"' + str(value) + '"' for value in row) + "\n")
+                else:
+                    reportFile.write(REPORT_HEADER + "\n")
+                    for row in ytdRows:
+                        reportFile.write(",".join('"' + str(value) + '"' for value in row) + "\n")
+            return "Success"
+        return generateReport
+
+    def invokeLambda(self, payload):
+        return target_tracking.lambda_handler(payload, None)
+
+    def test_fix_dynamo_ytd_drifted_totals(self):
+        # Every stored week matches the report, but the running DirectYTD total has drifted
+        self.dynamodb.put_item(TableName=DYNAMO_TABLE, Item={
+            "ID": {"S": "JohnDoe2025"},
+            "Direct1": {"N": "30"}, "Indirect1": {"N": "2"},
+            "Direct2": {"N": "10"}, "Indirect2": {"N": "0"},
+            "DirectYTD": {"N": "95"}, "IndirectYTD": {"N": "2"}
+        })
+        ytdRows = [
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "40", "0"],
+            ["ByteRatio", "Doe, John", "BYTERATIO OH_BR -- OH_BR", "USD", "2", "0"]
+        ]
+        datedRows = [
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "30", "0", "2025-01-02"],
+            ["ByteRatio", "Doe, John", "BYTERATIO OH_BR -- OH_BR", "USD", "2", "0", "2025-01-03"],
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "10", "0", "2025-01-07"]
+        ]
+
+        with patch.object(ttauto, 'generateReport', side_effect=self.fakeReports(ytdRows, datedRows)), \
+             patch.object(ttauto, 'invoke_lambda_function', side_effect=self.invokeLambda), \
+             patch.object(target_tracking, 'ingestWeeklyReports') as mockIngest:
+            response = ttauto.fixDynamoYTD("07/25/2025")
+
+        self.assertEqual(response, "Success")
+        # No week differed, so nothing was written again. Only the totals were recomputed
+        mockIngest.assert_not_called()
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(float(response["Item"]["DirectYTD"]["N"]), 40)
+        self.assertEqual(float(response["Item"]["IndirectYTD"]["N"]), 2)
+
+if __name__ == '__main__':
+    unittest.main()
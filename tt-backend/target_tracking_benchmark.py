@@ -0,0 +1,212 @@
+import os
+import io
+import csv
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from datetime import date, timedelta
+from collections import Counter
+
+# moto needs credentials and a region before any client is created
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from moto import mock_aws
+import boto3
+import target_tracking as ttlambda
+
+# Offline benchmark for the ingest and YTD paths of target_tracking.py
+# Runs getHours, getTargets, setCorrectNames and getDynamoYTD end to end against moto on a synthetic Unanet export,
+# and compares the time, AWS API calls and peak memory of each against a stored baseline
+# totalReportRows is also timed on its own. It is the aggregation every report route ships with, and in getHours its
+# time is hidden behind the DynamoDB writes
+#
+#   python target_tracking_benchmark.py                 compare against the baseline
+#   python target_tracking_benchmark.py --update        store this run as the new baseline
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# A benchmark regresses when it is this many times slower or larger than the baseline. API calls must not go up at all
+TIME_TOLERANCE = 1.5
+MEMORY_TOLERANCE = 1.25
+
+FIRST_NAMES = ["Peter", "John", "Bruce", "Tony", "Clark", "Diana", "Natasha", "Wanda", "Steve", "Carol", "Doc", "Sally", "Lightning", "Mater", "Luigi", "Ramone"]
+LAST_NAMES = ["Parker", "Doe", "Banner", "Stark", "Kent", "Prince", "Romanoff", "Maximoff", "Rogers", "Danvers", "Hudson", "Carrera", "McQueen", "Tow", "Guido", "Flo"]
+# Unanet trade names for the employees with a name discrepency (Unanet name -> Microsoft name)
+TRADE_NAMES = {"Peter": "Pete", "John": "Johnny", "Bruce": "Bruno", "Tony": "Anthony", "Steve": "Steven"}
+# Every employee has a client project. The rest of their rows cycle through overhead, excluded, leave and more client work
+PROJECT_MIX = ["BYTERATIO OH_BR -- OH_BR", "BYTERATIO FLEX_TIME", "CLIENT{n} -- TEST", "PARENTAL LEAVE", "CLIENT{n} -- SUPPORT", "BEREAVEMENT"]
+REPORT_HEADER = ["Person Organization", "Person", "Project", "TransactionCurrency", "Hours", "TimeTC"]
+
+# This function builds a synthetic Unanet export: employees x projects rows for each of weeks weeks ending on Fridays of year
+# Every mismatchEvery-th employee is in Unanet under a trade name that the names file maps to their Microsoft name
+# It returns {week end: report CSV}, the names CSV and the targets CSV
+def syntheticReports(employees, projects, weeks, year, mismatchEvery=5, seed=0):
+    randomizer = random.Random(seed)
+
+    people = []
+    for i in range(employees):
+        first = FIRST_NAMES[i % len(FIRST_NAMES)]
+        last = LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]
+        # Past the first 256 combinations, a suffix keeps last names unique
+        if i >= len(FIRST_NAMES) * len(LAST_NAMES):
+            last += str(i // (len(FIRST_NAMES) * len(LAST_NAMES)))
+        unanetFirst = first
+        if mismatchEvery and i % mismatchEvery == 0 and first in TRADE_NAMES:
+            unanetFirst = TRADE_NAMES[first]
+        people.append((unanetFirst, first, last, i))
+
+    names = "Unanet Name,Microsoft Name\n"
+    targets = "Person,Target,Target2,Description,\n"
+    for unanetFirst, first, last, i in people:
+        if unanetFirst != first:
+            names += unanetFirst + " " + last + "," + first + " " + last + "\n"
+        target = randomizer.choice(["1776.00", "1824.00", "1860.00"])
+        target2 = target if i % 3 else randomizer.choice(["1700.00", "1900.00"])
+        targets += unanetFirst + " " + last + "," + target + "," + target2 + ",,\n"
+
+    firstFriday = date(year, 1, 1) + timedelta(days=(4 - date(year, 1, 1).weekday()) % 7)
+    reports = {}
+    for week in range(weeks):
+        lines = [",".join(REPORT_HEADER)]
+        for unanetFirst, first, last, i in people:
+            for project in range(projects):
+                if project == 0:
+                    name = "CLIENT" + str(i % 7) + " -- DEV"
+                else:
+                    name = PROJECT_MIX[(project - 1) % len(PROJECT_MIX)].format(n=i % 7)
+                hours = round(randomizer.uniform(0.25, 40 / projects), 2)
+                lines.append(",".join('"' + str(value) + '"' for value in ["ByteRatio", last + ", " + unanetFirst, name, "USD", hours, "0"]))
+        reports[str(firstFriday + timedelta(weeks=week))] = "\n".join(lines) + "\n"
+
+    return reports, names, targets
+
+def createResources():
+    dynamodb = boto3.client('dynamodb', region_name='us-east-1')
+    dynamodb.create_table(
+        TableName=ttlambda.DYNAMO_TABLE,
+        KeySchema=[{'AttributeName': 'ID', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'ID', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    s3 = boto3.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket=ttlambda.BUCKET_NAME)
+    return s3
+
+# This function runs one benchmark and returns its wall time, AWS API calls by operation and peak traced memory
+def measure(calls, run):
+    ttlambda.invalidateCache()
+    ttlambda.metrics.reset()
+    calls.clear()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        run()
+    finally:
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'seconds': round(seconds, 3),
+        'apiCalls': sum(calls.values()),
+        'calls': dict(sorted(calls.items())),
+        'peakKB': round(peak / 1024, 1),
+        'capacityUnits': round(ttlambda.metrics.get('readCapacityUnits') + ttlambda.metrics.get('writeCapacityUnits'), 1)
+    }
+
+def runBenchmarks(employees, projects, weeks, year):
+    reports, names, targets = syntheticReports(employees, projects, weeks, year)
+
+    with mock_aws():
+        s3 = createResources()
+        # Fresh clients and limiters inside the mock. Every request they make is counted by service and operation
+        ttlambda.s3.client = None
+        ttlambda.dynamodb.client = None
+        ttlambda.dynamodb.limiters = None
+        calls = Counter()
+        def countCall(model, **kwargs):
+            calls[model.service_model.service_name + "." + model.name] += 1
+        for client in (ttlambda.s3, ttlambda.dynamodb):
+            client.meta.events.register('before-call.*.*', countCall)
+
+        s3.put_object(Bucket=ttlambda.BUCKET_NAME, Key=ttlambda.NAME_PREFIX + "names.csv", Body=names.encode('utf-8'))
+        s3.put_object(Bucket=ttlambda.BUCKET_NAME, Key=ttlambda.TARGET_PREFIX + "targets.csv", Body=targets.encode('utf-8'))
+        for weekEnd, report in reports.items():
+            s3.put_object(Bucket=ttlambda.BUCKET_NAME, Key=ttlambda.REPORT_PREFIX + weekEnd + ".csv", Body=report.encode('utf-8'))
+
+        results = {}
+        results['setCorrectNames'] = measure(calls, lambda: ttlambda.setCorrectNames(ttlambda.NAME_PREFIX + "names.csv"))
+        identity = ttlambda.getIdentityIndex()
+        results['totalReportRows'] = measure(calls, lambda: [ttlambda.totalReportRows(csv.DictReader(io.StringIO(report)), year, identity) for report in reports.values()])
+        results['getTargets'] = measure(calls, lambda: ttlambda.getTargets(ttlambda.TARGET_PREFIX + "targets.csv"))
+        results['getHours'] = measure(calls, lambda: [ttlambda.getHours(ttlambda.REPORT_PREFIX, ttlambda.REPORT_PREFIX + weekEnd + ".csv") for weekEnd in sorted(reports)])
+        results['getDynamoYTD'] = measure(calls, lambda: ttlambda.getDynamoYTD(year))
+
+        # The clients belong to this mock. Later users of the module get new ones
+        ttlambda.s3.client = None
+        ttlambda.dynamodb.client = None
+        ttlambda.dynamodb.limiters = None
+
+    return results
+
+# This function lists every way results are worse than baseline
+def regressions(results, baseline):
+    found = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['apiCalls'] > expected['apiCalls']:
+            found.append(name + ": " + str(result['apiCalls']) + " API calls, baseline " + str(expected['apiCalls']))
+        if result['seconds'] > expected['seconds'] * TIME_TOLERANCE:
+            found.append(name + ": " + str(result['seconds']) + "s, baseline " + str(expected['seconds']) + "s")
+        if result['peakKB'] > expected['peakKB'] * MEMORY_TOLERANCE:
+            found.append(name + ": " + str(result['peakKB']) + "KB peak, baseline " + str(expected['peakKB']) + "KB")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the target-tracking ingest and YTD paths against moto")
+    parser.add_argument('--employees', type=int, default=200)
+    parser.add_argument('--projects', type=int, default=6)
+    parser.add_argument('--weeks', type=int, default=4)
+    parser.add_argument('--year', type=int, default=2025)
+    parser.add_argument('--update', action='store_true', help="store this run as the baseline")
+    args = parser.parse_args()
+
+    size = {'employees': args.employees, 'projects': args.projects, 'weeks': args.weeks, 'year': args.year}
+    results = runBenchmarks(args.employees, args.projects, args.weeks, args.year)
+
+    print("%-16s %10s %10s %12s %10s" % ("benchmark", "seconds", "API calls", "peak KB", "capacity"))
+    for name, result in results.items():
+        print("%-16s %10.3f %10d %12.1f %10.1f" % (name, result['seconds'], result['apiCalls'], result['peakKB'], result['capacityUnits']))
+
+    if args.update:
+        with open(BASELINE_FILE, 'w') as baselineFile:
+            json.dump({'size': size, 'results': results}, baselineFile, indent=4)
+            baselineFile.write("\n")
+        print("Baseline written to " + BASELINE_FILE)
+        return 0
+
+    if not os.path.exists(BASELINE_FILE):
+        print("No baseline yet. Run with --update to store one")
+        return 0
+    with open(BASELINE_FILE) as baselineFile:
+        baseline = json.load(baselineFile)
+    if baseline['size'] != size:
+        print("Baseline was recorded for " + json.dumps(baseline['size']) + ", not compared")
+        return 0
+
+    found = regressions(results, baseline['results'])
+    for regression in found:
+        print("REGRESSION " + regression)
+    if not found:
+        print("No regressions against the baseline")
+    return 1 if found else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
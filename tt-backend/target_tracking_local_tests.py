@@ -1,11 +1,15 @@
 import unittest
 import sys
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from unittest.mock import patch
 import json
 import os
 import csv
 import time
+import threading
+import requests
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 
 # Import the local target tracking script
 local_script_path = sys.path.append(os.path.abspath('./LocalScript'))
@@ -82,19 +86,6 @@ class TestSuite(unittest.TestCase):
         for file in os.listdir("LocalScript/YTD/"):
             os.remove("LocalScript/YTD/" + file)
 
-    def test_splitID_ValidID(self):
-        empID = "BruceBanner2025"
-        response = ttlambda.splitID(empID)
-        self.assertEqual(len(response), 2)
-        self.assertEqual(response[0], "Bruce")
-        self.assertEqual(response[1], "Banner2025")
-    
-    def test_splitID_InvalidID(self):
-        empID = "Brucebanner2025"
-        response = ttlambda.splitID(empID)
-        self.assertEqual(len(response), 1)
-        self.assertEqual(response[0], "Brucebanner2025")
-    
     def test_report_gen_success(self):
         # Generate a report from Jan 4 to 10, 2025 since these values should not change
         start_date = date(2025, 1, 4).strftime("%m/%d/%Y")
@@ -112,6 +103,279 @@ class TestSuite(unittest.TestCase):
         response = ttlambda.generateReport(start_date, end_date, REPORT_FOLDER)
         self.assertEqual(response, "File not found within 5 seconds: LocalScript/Reports/report.csv")
     
+    def test_report_download_direct(self):
+        # Stand-in for the Unanet export. Only logged in requests get the CSV, everyone else gets the login page
+        class ExportHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                if 'session=valid' in self.headers.get('Cookie', ''):
+                    body = "Person,Project,Hours\n\"Doe, John\",CLIENT -- DEV," + query['beginDate'][0] + "\n"
+                    contentType = 'text/csv'
+                else:
+                    body = "<html>login</html>"
+                    contentType = 'text/html'
+                self.send_response(200)
+                self.send_header('Content-Type', contentType)
+                self.end_headers()
+                self.wfile.write(body.encode('utf-8'))
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), ExportHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        session = ttlambda.UnanetSession()
+        try:
+            with patch.dict(ttlambda.REPORT_EXPORT_URLS, {ttlambda.SAVED_REPORT: "http://127.0.0.1:" + str(server.server_port) + "/export"}):
+                session.http = requests.Session()
+                session.http.cookies.set('session', 'valid')
+                response = session.downloadReport("01/04/2025", "01/10/2025", REPORT_FOLDER)
+                self.assertEqual(response, "Success")
+                with open(FILE_PATH_CURRENT) as reportFile:
+                    self.assertIn("01/04/2025", reportFile.read())
+                os.remove(FILE_PATH_CURRENT)
+
+                # An expired session logs in again through the browser before retrying
+                session.http = requests.Session()
+                with patch.object(session, 'openHome', return_value="Login failed"):
+                    response = session.downloadReport("01/04/2025", "01/10/2025", REPORT_FOLDER)
+                self.assertEqual(response, "Login failed")
+                self.assertFalse(os.path.exists(FILE_PATH_CURRENT))
+        finally:
+            server.shutdown()
+
+    def test_wait_for_download(self):
+        # Chrome writes to a partial file first and renames it once every byte is on disk
+        partialPath = FILE_PATH_CURRENT + ".crdownload"
+        def download():
+            with open(partialPath, 'w') as partialFile:
+                for i in range(5):
+                    partialFile.write("Person,Project,Hours\n")
+                    partialFile.flush()
+                    time.sleep(0.1)
+            os.rename(partialPath, FILE_PATH_CURRENT)
+
+        writer = threading.Thread(target=download)
+        writer.start()
+        # The partial file keeps growing past the timeout, so the wait is not cut off
+        response = ttlambda.waitForDownload(FILE_PATH_CURRENT, 0.3)
+        writer.join()
+        self.assertEqual(response, "Success")
+        self.assertFalse(os.path.exists(partialPath))
+        with open(FILE_PATH_CURRENT) as reportFile:
+            self.assertEqual(len(reportFile.readlines()), 5)
+        os.remove(FILE_PATH_CURRENT)
+
+        response = ttlambda.waitForDownload(FILE_PATH_CURRENT, 0.3)
+        self.assertEqual(str(response), "File not found within 0.3 seconds: " + FILE_PATH_CURRENT)
+
+    def test_pool_ranges(self):
+        ranges = ttlambda.poolRanges(date(2025, 1, 1), date(2025, 7, 18))
+        self.assertEqual(ranges[0], (date(2025, 1, 1), date(2025, 1, 3)))
+        self.assertEqual(ranges[1], (date(2025, 1, 4), date(2025, 4, 4)))
+        self.assertEqual(ranges[-1][1], date(2025, 7, 18))
+        for (previousStart, previousEnd), (rangeStart, rangeEnd) in zip(ranges, ranges[1:]):
+            self.assertEqual(rangeStart, previousEnd + timedelta(days=1))
+            self.assertEqual(rangeStart.weekday(), 5)
+
+    def test_report_pool(self):
+        # Stand-in browser sessions that record how many reports are being generated at once
+        running = []
+        lock = threading.Lock()
+        class FakeSession:
+            def generateReport(self, start_date, end_date, folder, report):
+                with lock:
+                    running.append(1)
+                    peaks.append(len(running))
+                time.sleep(0.1)
+                with open(folder + "/report.csv", 'w') as reportFile:
+                    reportFile.write("Person,Project,Date,Hours\n\"Doe, John\",CLIENT -- DEV," + start_date + ",8\n")
+                with lock:
+                    running.pop()
+                return "Success"
+
+            def quit(self):
+                pass
+
+        peaks = []
+        finished = []
+        jobs = [(rangeStart.strftime("%m/%d/%Y"), rangeEnd.strftime("%m/%d/%Y"), ttlambda.DATED_REPORT) for rangeStart, rangeEnd in ttlambda.poolRanges(date(2025, 1, 1), date(2025, 12, 31))]
+        with patch.object(ttlambda, 'UnanetSession', FakeSession), patch.object(ttlambda, 'POOL_FOLDER', REPORT_FOLDER + "/Pool"):
+            pool = ttlambda.ReportPool(2)
+            reports = pool.generate(jobs, finished.append)
+            pool.close()
+
+        self.assertEqual(max(peaks), 2)
+        self.assertEqual(finished, list(range(1, len(jobs) + 1)))
+        self.assertEqual([report.loc[0, 'Date'] for report in reports], [job[0] for job in jobs])
+        for folder in os.listdir(REPORT_FOLDER + "/Pool"):
+            os.remove(REPORT_FOLDER + "/Pool/" + folder + "/report.csv")
+            os.rmdir(REPORT_FOLDER + "/Pool/" + folder)
+        os.rmdir(REPORT_FOLDER + "/Pool")
+
+    def test_report_pool_direct_download(self):
+        # The first range exports over HTTP. The second export fails and falls back to the browser
+        calls = []
+        class FakeSession:
+            def downloadReport(self, start_date, end_date, folder, report):
+                calls.append(("download", start_date))
+                if start_date != "01/01/2025":
+                    return Exception("Report export returned 500 instead of a CSV")
+                with open(folder + "/report.csv", 'w') as reportFile:
+                    reportFile.write("Person,Project,Date,Hours\n\"Doe, John\",CLIENT -- DEV," + start_date + ",8\n")
+                return "Success"
+
+            def generateReport(self, start_date, end_date, folder, report):
+                calls.append(("browser", start_date))
+                with open(folder + "/report.csv", 'w') as reportFile:
+                    reportFile.write("Person,Project,Date,Hours\n\"Doe, John\",CLIENT -- DEV," + start_date + ",8\n")
+                return "Success"
+
+            def quit(self):
+                pass
+
+        jobs = [("01/01/2025", "01/31/2025", ttlambda.DATED_REPORT), ("02/01/2025", "02/28/2025", ttlambda.DATED_REPORT)]
+        with patch.object(ttlambda, 'UnanetSession', FakeSession), patch.object(ttlambda, 'POOL_FOLDER', REPORT_FOLDER + "/Pool"), \
+             patch.dict(ttlambda.REPORT_EXPORT_URLS, {ttlambda.DATED_REPORT: "https://unanet.example/export"}):
+            pool = ttlambda.ReportPool(1)
+            reports = pool.generate(jobs)
+            pool.close()
+
+        self.assertEqual(calls, [("download", "01/01/2025"), ("download", "02/01/2025"), ("browser", "02/01/2025")])
+        self.assertEqual([report.loc[0, 'Date'] for report in reports], ["01/01/2025", "02/01/2025"])
+        for folder in os.listdir(REPORT_FOLDER + "/Pool"):
+            os.remove(REPORT_FOLDER + "/Pool/" + folder + "/report.csv")
+            os.rmdir(REPORT_FOLDER + "/Pool/" + folder)
+        os.rmdir(REPORT_FOLDER + "/Pool")
+
+    # This function writes a dated report (the weekly report columns plus the day of each entry) to FILE_PATH_CURRENT
+    def writeDatedReport(self, rows):
+        with open(FILE_PATH_CURRENT, 'w', newline='') as csvfile:
+            csv_writer = csv.writer(csvfile)
+            csv_writer.writerow(["Person Organization", "Person", "Project", "TransactionCurrency", "Hours", "TimeTC", "Date"])
+            csv_writer.writerows(rows)
+
+    def test_split_report_jan1_partial_week(self):
+        # Jan 1, 2025 is a Wednesday. The first week runs from Jan 1 to Friday Jan 3
+        self.writeDatedReport([
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "8", "0", "2024-12-31"],
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "8", "0", "2025-01-01"],
+            ["ByteRatio", "Doe, John", "BYTERATIO OH_BR -- OH_BR", "USD", "2", "0", "2025-01-03"],
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "6", "0", "2025-01-04"],
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "7", "0", "2025-01-10"]
+        ])
+        weeks = ttlambda.splitReportByWeek(FILE_PATH_CURRENT, 2025)
+        os.remove(FILE_PATH_CURRENT)
+
+        # Last year's entry is left out, and Saturday Jan 4 starts the second week
+        self.assertEqual(list(weeks.keys()), ["2025-01-03", "2025-01-10"])
+        self.assertEqual(list(weeks["2025-01-03"]['Hours']), [8, 2])
+        self.assertEqual(list(weeks["2025-01-10"]['Hours']), [6, 7])
+        self.assertEqual(list(weeks["2025-01-03"].columns), ['Person', 'Project', 'Hours'])
+        self.assertEqual(ttlambda.reportWeek(date(2025, 1, 3)), 1)
+        self.assertEqual(ttlambda.reportWeek(date(2025, 1, 10)), 2)
+        self.assertEqual(ttlambda.weekEndDate(1, 2025), "2025-01-03")
+        self.assertEqual(ttlambda.weekEndDate(2, 2025), "2025-01-10")
+
+    def test_split_report_dec31_week53(self):
+        # Dec 31, 2024 is a Tuesday in ISO week 1 of 2025. The last week is cut off at Dec 31 and stored as week 53
+        self.writeDatedReport([
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "8", "0", "2024-12-27"],
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "5", "0", "2024-12-28"],
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "4", "0", "2024-12-31"],
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "9", "0", "2025-01-02"]
+        ])
+        weeks = ttlambda.splitReportByWeek(FILE_PATH_CURRENT, 2024)
+        os.remove(FILE_PATH_CURRENT)
+
+        self.assertEqual(list(weeks.keys()), ["2024-12-27", "2024-12-31"])
+        self.assertEqual(list(weeks["2024-12-31"]['Hours']), [5, 4])
+        self.assertEqual(ttlambda.reportWeek(date(2024, 12, 27)), 52)
+        self.assertEqual(ttlambda.reportWeek(date(2024, 12, 31)), 53)
+        self.assertEqual(ttlambda.weekEndDate(53, 2024), "2024-12-31")
+        self.assertEqual(ttlambda.weekEndDate(52, 2024), "2024-12-27")
+
+    def test_total_hours_blank_project(self):
+        self.writeDatedReport([
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "8", "0", "2025-01-03"],
+            ["ByteRatio", "Doe, John", "", "USD", "4", "0", "2025-01-03"],
+            ["ByteRatio", "Doe, John", "BYTERATIO OH_BR -- OH_BR", "USD", "2", "0", "2025-01-03"],
+            ["ByteRatio", "Doe, John", "BYTERATIO FLEX_TIME", "USD", "3", "0", "2025-01-03"],
+            ["ByteRatio", "Parker, Peter", "", "USD", "", "0", "2025-01-03"]
+        ])
+        weeks = ttlambda.splitReportByWeek(FILE_PATH_CURRENT, 2025)
+        os.remove(FILE_PATH_CURRENT)
+
+        # A blank project is direct time, and FLEX_TIME counts toward neither total, the same as in the target-tracking function
+        response = ttlambda.totalHours(weeks["2025-01-03"], 2025, ttlambda.target_tracking.IdentityIndex({}))
+        self.assertEqual(response, {
+            'JohnDoe2025': {'Direct': 12.0, 'Indirect': 2.0, 'Name': "John Doe"},
+            'PeterParker2025': {'Direct': 0.0, 'Indirect': 0.0, 'Name': "Peter Parker"}
+        })
+
+    def test_compare_YTD_identity_index(self):
+        ttlambda.DISCR_PATH = DISCR_PATH
+        for file in os.listdir(DISCR_FOLDER + "/"):
+            os.remove(DISCR_FOLDER + "/" + file)
+        self.writeDatedReport([
+            ["ByteRatio", "McDonald, Ronald", "CLIENT -- DEV", "USD", "8", "0", "2025-01-03"],
+            ["ByteRatio", "Doe, Johnny", "CLIENT -- DEV", "USD", "6", "0", "2025-01-03"],
+            ["ByteRatio", "doe, johnny", "BYTERATIO OH_BR -- OH_BR", "USD", "2", "0", "2025-01-03"]
+        ])
+        weeks = ttlambda.splitReportByWeek(FILE_PATH_CURRENT, 2025)
+        os.remove(FILE_PATH_CURRENT)
+
+        # Johnny Doe is stored as JohnDoe2025. getDynamoYTD hands his totals back under his Unanet ID
+        identity = ttlambda.target_tracking.IdentityIndex({"Johnny Doe": "John Doe"})
+        reportYTD = ttlambda.totalHours(weeks["2025-01-03"], 2025, identity)
+        self.assertEqual(reportYTD['JohnnyDoe2025']['Direct'], 6.0)
+        self.assertEqual(reportYTD['JohnnyDoe2025']['Indirect'], 2.0)
+        dynamoYTD = {
+            identity.unanetID('JohnDoe2025'): {'Direct': 6.0, 'Indirect': 2.0},
+            'RonaldMcDonald2025': {'Direct': 7.0, 'Indirect': 0.0}
+        }
+        response = ttlambda.compareYTDTotals(dynamoYTD, reportYTD)
+        self.assertEqual(response, 1)
+
+        # The discrepancy names the employee as the report does, and the renamed employee is found
+        with open(DISCR_PATH, 'r') as file:
+            content = file.read()
+        self.assertIn("HOURS DO NOT MATCH FOR: Ronald McDonald-", content)
+        self.assertNotIn("CANT FIND", content)
+        os.remove(DISCR_PATH)
+
+    def test_divergent_weeks_partial_year(self):
+        self.writeDatedReport([
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "40", "0", "2025-01-03"],
+            ["ByteRatio", "Parker, Peter", "CLIENT -- DEV", "USD", "30", "0", "2025-01-03"],
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "35", "0", "2025-01-10"],
+            ["ByteRatio", "Doe, John", "BYTERATIO OH_BR -- OH_BR", "USD", "5", "0", "2025-01-10"],
+            ["ByteRatio", "Parker, Peter", "CLIENT -- DEV", "USD", "20", "0", "2025-01-10"],
+            ["ByteRatio", "Banner, Bruce", "CLIENT -- DEV", "USD", "12", "0", "2025-01-10"],
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "40", "0", "2025-01-17"],
+            ["ByteRatio", "Parker, Peter", "CLIENT -- DEV", "USD", "40", "0", "2025-01-17"]
+        ])
+        weeks = ttlambda.splitReportByWeek(FILE_PATH_CURRENT, 2025)
+        os.remove(FILE_PATH_CURRENT)
+
+        dynamoWeeks = {
+            # Week 2 was edited in Unanet, and week 4 was removed from it
+            'JohnDoe2025': {'1': {'Direct': 40.0, 'Indirect': 0.0}, '2': {'Direct': 35.0, 'Indirect': 0.0}, '3': {'Direct': 40.0, 'Indirect': 0.0}, '4': {'Direct': 8.0, 'Indirect': 0.0}, '30': {'Direct': 8.0, 'Indirect': 0.0}},
+            # Week 3 differs, but Peter's totals match so he is not in the mismatched list
+            'PeterParker2025': {'1': {'Direct': 30.0, 'Indirect': 0.0}, '2': {'Direct': 20.0, 'Indirect': 0.0}, '3': {'Direct': 10.0, 'Indirect': 0.0}},
+            # Bruce's week 2 differs too, and he is mismatched
+            'BruceBanner2025': {}
+        }
+        staged = ttlambda.divergentWeeks(weeks, dynamoWeeks, ['JohnDoe2025', 'BruceBanner2025'], 2025, 4, ttlambda.target_tracking.IdentityIndex({}))
+
+        # Only the weeks that differ for the mismatched employees. Week 30 is past the last week compared
+        self.assertEqual(sorted(staged.keys()), ["2025-01-10", "2025-01-24"])
+        self.assertEqual(sorted(zip(staged["2025-01-10"]['Person'], staged["2025-01-10"]['Hours'])), [("Banner, Bruce", 12), ("Doe, John", 5), ("Doe, John", 35)])
+        # A week with no rows left is staged as zero hours so the stored week is cleared
+        self.assertEqual(list(staged["2025-01-24"]['Person']), ["Doe, John"])
+        self.assertEqual(list(staged["2025-01-24"]['Hours']), [0.0])
+        self.assertNotIn("Parker, Peter", set(staged["2025-01-10"]['Person']))
+
     def test_replace_timecards_single(self):
         ttlambda.REPORT_FOLDER = REPORT_FOLDER
         ttlambda.FILE_PATH_CURRENT = FILE_PATH_CURRENT
@@ -264,7 +528,8 @@ class TestSuite(unittest.TestCase):
             },
             'MikeHollar2025': {
                 'Indirect': 143.85, # This should be 140.85
-                'Direct': 0.0
+                'Direct': 0.0,
+                'Name': "Mike Hollar"
             }
         }
         dynamoYTD = {
@@ -3,11 +3,17 @@ import sys
 from datetime import datetime, date
 from unittest.mock import patch
 import json
+import io
+import zipfile
 import os
 import csv
 import time
+import tempfile
+import pstats
 from moto import mock_aws
 import boto3
+from botocore.exceptions import ClientError
+import pandas as pd
 import target_tracking as ttlambda
 
 USERNAME = "username"
@@ -60,11 +66,27 @@ class TestSuite(unittest.TestCase):
         except Exception as e:
             return e
 
+    def uploadReport(self, key, rows):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        if BUCKET_NAME not in [bucket['Name'] for bucket in s3.list_buckets()['Buckets']]:
+            s3.create_bucket(Bucket=BUCKET_NAME)
+        s3.put_object(Bucket=BUCKET_NAME, Key=key.split("/")[0] + "/", Body=b"")
+
+        header = ["Person Organization", "Person", "Project", "TransactionCurrency", "Hours", "TimeTC"]
+        body = ",".join(header) + "\n"
+        for row in rows:
+            body += ",".join('"' + str(value) + '"' for value in row) + "\n"
+        s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=body.encode('utf-8'))
+
     @classmethod
     def setUp(self):
         # Change global creds
         ttlambda.USERNAME = USERNAME
         ttlambda.PASSWORD = PASSWORD
+        # Every test starts with an empty table, so nothing cached by an earlier test applies
+        ttlambda.invalidateCache()
+        # Limiters are sized from the table, which each test creates again
+        ttlambda.dynamodb.limiters = None
 
         self.mock_aws = mock_aws()
         self.mock_aws.start()
@@ -108,7 +130,7 @@ class TestSuite(unittest.TestCase):
         self.assertEqual(set(response), set(expectedValues))
     
     def test_get_dynamo_ytd(self):
-        response = ttlambda.getDynamoYTD()
+        response = ttlambda.getDynamoYTD(2025)
         expectedResponse = {
             'JohnDoe2025': {
                 "Direct": 1145.5,
@@ -246,5 +268,607 @@ class TestSuite(unittest.TestCase):
         response = ttlambda.getCorrectNames()
         self.assertEqual(response, {})
 
+    def test_total_report_rows(self):
+        rows = [
+            {"Person": "Parker, Pete", "Project": "CLIENT -- DEV", "Hours": "30.25"},
+            {"Person": "Parker, Pete", "Project": "BYTERATIO OH_BR -- OH_BR", "Hours": "4.5"},
+            {"Person": "Parker, Pete", "Project": "BYTERATIO FLEX_TIME", "Hours": "8"},
+            {"Person": "Doe, John", "Project": "CLIENT -- DEV", "Hours": "40"},
+            {"Person": "Doe, John", "Project": "PARENTAL LEAVE", "Hours": "2"},
+            {"Person": "", "Project": "CLIENT -- DEV", "Hours": "99"}
+        ]
+        response = ttlambda.totalReportRows(rows, 2025, ttlambda.IdentityIndex({"Pete Parker": "Peter Parker"}))
+        expectedResponse = {
+            'PeterParker2025': (30.25, 4.5),
+            'JohnDoe2025': (40.0, 2.0)
+        }
+        self.assertEqual(response, expectedResponse)
+
+    def test_lambda_handler_init_log(self):
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET_NAME)
+        with patch('builtins.print') as mockPrint:
+            ttlambda.lambda_handler({"deleteS3": "AUTO"}, None)
+            response = ttlambda.lambda_handler({"deleteS3": "AUTO"}, None)
+        self.assertEqual(response["statusCode"], 200)
+        initLog = json.loads(mockPrint.call_args_list[-1].args[0])
+        self.assertEqual(initLog["route"], "deleteS3")
+        # Only the first invocation in a container is a cold start
+        self.assertFalse(initLog["coldStart"])
+        self.assertEqual(initLog["coldStarts"], 0)
+        self.assertEqual(initLog["moduleInitMs"], 0.0)
+        self.assertIn("lazyInitMs", initLog)
+
+        # The record is in CloudWatch Embedded Metric Format, with every value published as a metric by route
+        metricFormat = initLog["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual(metricFormat["Dimensions"], [["route"]])
+        self.assertIn({"Name": "durationMs", "Unit": "Milliseconds"}, metricFormat["Metrics"])
+        self.assertEqual(set(metric["Name"] for metric in metricFormat["Metrics"]), set(initLog) - {"_aws", "route", "coldStart"})
+        self.assertEqual(ttlambda.eventRoute({"somethingElse": True}), "unknown")
+
+    def test_get_hours(self):
+        self.uploadReport("Reports/2025-07-25.csv", [
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "20", "0"],
+            ["ByteRatio", "Doe, John", "CLIENT -- TEST", "USD", "12.5", "0"],
+            ["ByteRatio", "Doe, John", "BYTERATIO OH_BR -- OH_BR", "USD", "4", "0"],
+            ["ByteRatio", "Doe, John", "BYTERATIO FLEX_TIME", "USD", "3", "0"],
+            ["ByteRatio", "Banner, Bruce", "CLIENT -- DEV", "USD", "38", "0"]
+        ])
+        ttlambda.getHours(REPORT_PREFIX)
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(response["Item"]["Direct30"]["N"], "32.5")
+        self.assertEqual(response["Item"]["Indirect30"]["N"], "4.0")
+        # Existing weeks are left alone
+        self.assertEqual(response["Item"]["Direct29"]["N"], "13.75")
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'BruceBanner2025'}})
+        self.assertEqual(response["Item"]["Direct30"]["N"], "38.0")
+        self.assertEqual(response["Item"]["Indirect30"]["N"], "0.0")
+
+    def test_batch_get_items(self):
+        # More keys than fit in a single BatchGetItem request, including duplicates and missing employees
+        employeeIDs = ['JohnDoe2025', 'DocHudson2025', 'JohnDoe2025'] + ['Missing' + str(i) + '2025' for i in range(150)]
+        response = ttlambda.batchGetItems(employeeIDs, ['Target', 'Direct1'])
+        self.assertEqual(set(response.keys()), {'JohnDoe2025', 'DocHudson2025'})
+        self.assertEqual(response['JohnDoe2025'], {'ID': {'S': 'JohnDoe2025'}, 'Direct1': {'N': '21'}})
+        self.assertEqual(response['DocHudson2025']['Target']['N'], '1776')
+
+    def test_get_hours_previous_year_target(self):
+        self.updateItem({"ID": {"S": "JohnDoe2024"}, "Target": {"N": "1776"}, "Target2": {"N": "1824"}})
+        self.uploadReport("Reports/2026-01-09.csv", [
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "40", "0"]
+        ])
+        ttlambda.getHours(REPORT_PREFIX)
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2026'}})
+        self.assertEqual(response["Item"]["Direct2"]["N"], "40.0")
+        # 2025 has no target so nothing is carried over
+        self.assertNotIn("Target", response["Item"])
+
+        self.uploadReport("Reports/2025-01-03.csv", [
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "16", "0"],
+            ["ByteRatio", "Doe, Jane", "CLIENT -- DEV", "USD", "16", "0"]
+        ])
+        self.dynamodb.delete_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.delete_object(Bucket=BUCKET_NAME, Key="Reports/2026-01-09.csv")
+        ttlambda.getHours(REPORT_PREFIX)
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(response["Item"]["Target"]["N"], "1824")
+        self.assertEqual(response["Item"]["Direct1"]["N"], "16.0")
+
+    def test_get_targets(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        s3.put_object(Bucket=BUCKET_NAME, Key=TARGET_PREFIX, Body=b"")
+        body = "Person,Target,Target2,Description,\nPeter Parker,1776.00,1860.00,,\nJohn Doe,1840.00,1840.00,,\n"
+        s3.put_object(Bucket=BUCKET_NAME, Key=TARGET_PREFIX + "targets.csv", Body=body.encode('utf-8'))
+
+        currYear = str(datetime.now().year)
+        self.updateItem({"ID": {"S": "PeterParker" + currYear}, "Target": {"N": "1776"}, "Target2": {"N": "1860"}, "Description": {"S": "Initial entry"}, "dateChanged2": {"S": "unchanged"}})
+        ttlambda.getTargets()
+
+        # Targets that already match are not rewritten
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'PeterParker' + currYear}})
+        self.assertEqual(response["Item"]["dateChanged2"]["S"], "unchanged")
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe' + currYear}})
+        self.assertEqual(float(response["Item"]["Target"]["N"]), 1840)
+        self.assertNotIn("Target2", response["Item"])
+
+    def test_write_buffer(self):
+        buffer = ttlambda.WriteBuffer()
+        buffer.set("TonyStark2025", "Target", 1776)
+        buffer.set("TonyStark2025", "Description", "Initial entry", "S")
+        buffer.add("TonyStark2025", "DirectYTD", 10)
+        buffer.add("TonyStark2025", "DirectYTD", 2.5)
+        # An ADD after a SET of the same attribute is folded into the set value
+        buffer.set("JohnDoe2025", "Direct30", 8)
+        buffer.add("JohnDoe2025", "Direct30", 2)
+        self.assertEqual(len(buffer), 2)
+
+        with patch.object(ttlambda.dynamodb, 'update_item', wraps=ttlambda.dynamodb.update_item) as mockUpdate:
+            response = buffer.flush()
+        self.assertEqual(response, {"TonyStark2025": "Success!", "JohnDoe2025": "Success!"})
+        # One write per key, however many attributes were buffered
+        self.assertEqual(mockUpdate.call_count, 2)
+        self.assertEqual(len(buffer), 0)
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'TonyStark2025'}})
+        self.assertEqual(response["Item"]["Target"]["N"], "1776")
+        self.assertEqual(response["Item"]["Description"]["S"], "Initial entry")
+        self.assertEqual(float(response["Item"]["DirectYTD"]["N"]), 12.5)
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(float(response["Item"]["Direct30"]["N"]), 10)
+
+    def test_get_targets_one_write_per_employee(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        body = "Person,Target,Target2,Description,\nPeter Parker,1776.00,1860.00,Promotion,\nJohn Doe,1840.00,1840.00,,\nTony Stark,1900.00,1700.00,,\n"
+        s3.put_object(Bucket=BUCKET_NAME, Key=TARGET_PREFIX + "targets.csv", Body=body.encode('utf-8'))
+
+        with patch.object(ttlambda.dynamodb, 'update_item', wraps=ttlambda.dynamodb.update_item) as mockUpdate:
+            ttlambda.getTargets(TARGET_PREFIX + "targets.csv")
+        self.assertEqual(mockUpdate.call_count, 3)
+
+        currYear = str(datetime.now().year)
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'PeterParker' + currYear}})
+        self.assertEqual(float(response["Item"]["Target2"]["N"]), 1860)
+        self.assertEqual(response["Item"]["Description"]["S"], "Promotion")
+
+    def test_capacity_limiter(self):
+        limiter = ttlambda.CapacityLimiter(10)
+        self.assertEqual(limiter.tokens, 10 * ttlambda.BURST_SECONDS)
+
+        # Multiplicative decrease on throttles, never below RATE_STEP of the capacity
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 5)
+        self.assertLessEqual(limiter.tokens, 0)
+        for i in range(10):
+            limiter.throttled()
+        self.assertEqual(limiter.rate, 10 * ttlambda.RATE_STEP)
+
+        # Additive increase on success, capped at the table's capacity
+        limiter.succeeded()
+        self.assertEqual(limiter.rate, 1)
+        for i in range(100):
+            limiter.succeeded()
+        self.assertEqual(limiter.rate, 10)
+
+        # An empty bucket makes the caller wait for the refill
+        limiter.tokens = 0
+        started = time.monotonic()
+        limiter.acquire(1)
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_throttled_client(self):
+        # The limiter is sized from the table's provisioned capacity
+        self.assertEqual(ttlambda.dynamodb.limiter('read').capacity, 5)
+        self.assertEqual(ttlambda.dynamodb.limiter('write').capacity, 5)
+
+        throttle = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Rate exceeded'}}, 'GetItem')
+        getItem = ttlambda.dynamodb.client.get_item
+        with patch.object(ttlambda.dynamodb.client, 'get_item', side_effect=[throttle, throttle, getItem(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})]) as mockGet:
+            response = ttlambda.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(response['Item']['ID']['S'], 'JohnDoe2025')
+        self.assertEqual(mockGet.call_count, 3)
+        # Two throttles halved the read rate twice, then one success added a step back
+        self.assertEqual(ttlambda.dynamodb.limiter('read').rate, 5 * 0.25 + 5 * ttlambda.RATE_STEP)
+
+        # Other errors are raised straight away
+        missing = ClientError({'Error': {'Code': 'ResourceNotFoundException', 'Message': 'Missing'}}, 'GetItem')
+        with patch.object(ttlambda.dynamodb.client, 'get_item', side_effect=missing) as mockGet:
+            with self.assertRaises(ClientError):
+                ttlambda.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(mockGet.call_count, 1)
+
+    def test_get_dynamo_ytd_unanet_names(self):
+        ttlambda.addItem("names", json.dumps({"Johnny Doe": "John Doe"}), "S", "UnanetKey")
+        self.updateItem({"ID": {"S": "JohnDoe2024"}, "Direct1": {"N": "40"}, "Indirect1": {"N": "2"}})
+
+        response = ttlambda.getDynamoYTD(2024)
+        self.assertEqual(response, {'JohnnyDoe2024': {'Direct': 40.0, 'Indirect': 2.0}})
+
+        response = ttlambda.getDynamoYTD(2025)
+        self.assertIn('JohnnyDoe2025', response)
+        self.assertNotIn('JohnDoe2025', response)
+        self.assertEqual(response['JohnnyDoe2025'], {'Direct': 1145.5, 'Indirect': 0.0})
+
+    def test_get_dynamo_weeks(self):
+        ttlambda.addItem("names", json.dumps({"Johnny Doe": "John Doe"}), "S", "UnanetKey")
+        self.updateItem({"ID": {"S": "JohnDoe2024"}, "Direct1": {"N": "40"}, "Indirect1": {"N": "2"}, "Direct2": {"N": "0"}, "Indirect53": {"N": "8"}})
+
+        event = {"getDynamoWeeks": 2024, "username": USERNAME, "password": PASSWORD}
+        response = ttlambda.lambda_handler(event, None)
+        self.assertEqual(response, {'JohnnyDoe2024': {'1': {'Direct': 40.0, 'Indirect': 2.0}, '53': {'Direct': 0.0, 'Indirect': 8.0}}})
+
+        response = ttlambda.getDynamoWeeks(2025)
+        self.assertEqual(response['JohnnyDoe2025']['29'], {'Direct': 13.75, 'Indirect': 0.0})
+
+    def test_get_names(self):
+        ttlambda.addItem("names", json.dumps({"Johnny Doe": "John Doe"}), "S", "UnanetKey")
+        event = {"getNames": "LambdaUseOnly", "username": USERNAME, "password": PASSWORD}
+        response = ttlambda.lambda_handler(event, None)
+        self.assertEqual(response, {"Johnny Doe": "John Doe"})
+
+        event = {"getNames": "LambdaUseOnly", "username": USERNAME, "password": "wrong"}
+        response = ttlambda.lambda_handler(event, None)
+        self.assertEqual(response['statusCode'], 500)
+
+    def test_report_ytd_totals(self):
+        # Report IDs match the IDs getDynamoYTD returns, whatever the case of the report name
+        identity = ttlambda.IdentityIndex({"Johnny Doe": "John Doe"})
+        self.assertEqual(ttlambda.reportEmployeeID("doe, johnny", 2025, identity), "JohnnyDoe2025")
+        self.assertEqual(ttlambda.reportEmployeeID("McDonald, Ronald", 2025, identity), "RonaldMcDonald2025")
+        self.assertEqual(ttlambda.reportEmployeeID("Cher", 2025, identity), "Cher2025")
+
+        rows = [
+            {'Person': "Doe, Johnny", 'Project': "CLIENT -- DEV", 'Hours': "6"},
+            {'Person': "doe, johnny", 'Project': "BYTERATIO OH_BR -- OH_BR", 'Hours': "2"},
+            {'Person': "McDonald, Ronald", 'Project': "BYTERATIO FLEX_TIME", 'Hours': "3"}
+        ]
+        response = ttlambda.reportYTDTotals(rows, 2025, identity)
+        self.assertEqual(response, {
+            'JohnnyDoe2025': {'Direct': 6.0, 'Indirect': 2.0},
+            'RonaldMcDonald2025': {'Direct': 0.0, 'Indirect': 0.0}
+        })
+
+    def test_update_hours_running_ytd(self):
+        # PeterParker2025 predates running totals, so the first write computes them from every week
+        response = ttlambda.updateHours("PeterParker2025", "Direct23", 99)
+        self.assertEqual(response, "Success!")
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'PeterParker2025'}})
+        self.assertEqual(float(response["Item"]["DirectYTD"]["N"]), 940.3)
+        self.assertEqual(float(response["Item"]["IndirectYTD"]["N"]), 117.3)
+
+        # Later writes only add the difference
+        ttlambda.updateHours("PeterParker2025", "Direct23", 49)
+        ttlambda.updateHours("PeterParker2025", "Indirect30", 2.5)
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'PeterParker2025'}})
+        self.assertEqual(float(response["Item"]["DirectYTD"]["N"]), 890.3)
+        self.assertEqual(float(response["Item"]["IndirectYTD"]["N"]), 119.8)
+
+        # New employees start their totals with their first week
+        ttlambda.updateHours("JackBlack2025", "Direct49", 23.5)
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JackBlack2025'}})
+        self.assertEqual(float(response["Item"]["DirectYTD"]["N"]), 23.5)
+
+    def test_set_week_hours_stale_item(self):
+        ttlambda.repairYTD(2025)
+        # The caller thinks week 29 is empty, but 13.75 hours are stored
+        response = ttlambda.setWeekHours("JohnDoe2025", {"Direct29": 10, "Indirect29": 0}, {"ID": {"S": "JohnDoe2025"}, "DirectYTD": {"N": "1145.5"}, "IndirectYTD": {"N": "0"}})
+        self.assertEqual(response, "Success!")
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(float(response["Item"]["DirectYTD"]["N"]), 1141.75)
+
+    def test_repair_ytd(self):
+        response = ttlambda.repairYTD(2025)
+        self.assertEqual(response['checked'], 4)
+        self.assertEqual(len(response['mismatched']), 4)
+
+        self.updateItem({"ID": {"S": "DocHudson2025"}, "DirectYTD": {"N": "5"}})
+        response = ttlambda.repairYTD(2025, repair=False)
+        self.assertEqual(list(response['mismatched'].keys()), ['DocHudson2025'])
+        self.assertEqual(response['mismatched']['DocHudson2025']['Weeks'], {'Direct': 880.75, 'Indirect': 73.5})
+
+        ttlambda.repairYTD(2025)
+        response = ttlambda.repairYTD(2025)
+        self.assertEqual(response['mismatched'], {})
+
+        # getDynamoYTD reads the running totals
+        self.updateItem({"ID": {"S": "DocHudson2025"}, "DirectYTD": {"N": "900"}})
+        response = ttlambda.getDynamoYTD(2025)
+        self.assertEqual(response['DocHudson2025'], {'Direct': 900.0, 'Indirect': 73.5})
+
+    def test_correct_names_cache(self):
+        ttlambda.addItem("names", json.dumps({"Pete Parker": "Peter Parker"}), "S", "UnanetKey")
+        ttlambda.addItem("names", "v1", "S", "NamesVersion")
+        self.assertEqual(ttlambda.getCorrectNames(), {"Pete Parker": "Peter Parker"})
+
+        # Warm invocations reuse the dictionary until it expires
+        ttlambda.addItem("names", json.dumps({"Pete Parker": "Peter B Parker"}), "S", "UnanetKey")
+        self.assertEqual(ttlambda.getCorrectNames(), {"Pete Parker": "Peter Parker"})
+
+        # An expired entry with an unchanged version is kept
+        ttlambda.referenceCache['names']['expires'] = 0
+        self.assertEqual(ttlambda.getCorrectNames(), {"Pete Parker": "Peter Parker"})
+
+        # A new version is picked up once the entry expires
+        ttlambda.addItem("names", "v2", "S", "NamesVersion")
+        ttlambda.referenceCache['names']['expires'] = 0
+        self.assertEqual(ttlambda.getCorrectNames(), {"Pete Parker": "Peter B Parker"})
+
+        ttlambda.addItem("names", json.dumps({}), "S", "UnanetKey")
+        ttlambda.invalidateCache('names')
+        self.assertEqual(ttlambda.getCorrectNames(), {})
+
+    def test_identity_index(self):
+        identity = ttlambda.IdentityIndex({"Ronald McDonald": "Ron McDonald", "Pete Parker": "Peter Parker"})
+        self.assertEqual(identity.employeeID("pete  parker", 2025), "PeterParker2025")
+        self.assertEqual(identity.employeeID("Ronald McDonald", 2025), "RonMcDonald2025")
+        self.assertEqual(identity.employeeID("John Doe", 2025), "JohnDoe2025")
+        self.assertEqual(identity.unanetID("RonMcDonald2025"), "RonaldMcDonald2025")
+        self.assertEqual(identity.unanetID("PeterParker2024"), "PeteParker2024")
+        self.assertEqual(identity.unanetID("JohnDoe2025"), "JohnDoe2025")
+
+    def test_get_targets_three_word_name(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        body = "Person,Target,Target2,Description,\nMary Jane Watson,1776.00,1776.00,,\nMJ Watson,1840.00,1840.00,,\n"
+        s3.put_object(Bucket=BUCKET_NAME, Key=TARGET_PREFIX + "targets.csv", Body=body.encode('utf-8'))
+        self.dynamodb.put_item(TableName=DYNAMO_TABLE, Item={"ID": {"S": "names"}, "UnanetKey": {"S": json.dumps({"MJ Watson": "Mary Jane Watson Parker"})}})
+
+        # Targets keep every word of the name, so existing three-word items are still found
+        currYear = str(datetime.now().year)
+        self.updateItem({"ID": {"S": "MaryJaneWatson" + currYear}, "Target": {"N": "1776"}, "Target2": {"N": "1776"}, "Description": {"S": "Initial entry"}, "dateChanged2": {"S": "unchanged"}})
+        ttlambda.getTargets(TARGET_PREFIX + "targets.csv")
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'MaryJaneWatson' + currYear}})
+        self.assertEqual(response["Item"]["dateChanged2"]["S"], "unchanged")
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'MaryJane' + currYear}})
+        self.assertNotIn("Item", response)
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'MaryJaneWatsonParker' + currYear}})
+        self.assertEqual(float(response["Item"]["Target"]["N"]), 1840)
+
+    def test_identity_index_names_error(self):
+        # The names item can't be read, so the report isn't written under IDs built without it
+        self.dynamodb.put_item(TableName=DYNAMO_TABLE, Item={"ID": {"S": "names"}, "UnanetKey": {"S": "not json"}})
+        with self.assertRaises(Exception):
+            ttlambda.getIdentityIndex()
+
+        self.uploadReport("Reports/2025-07-25.csv", [["ByteRatio", "Doe, Johnny", "CLIENT -- DEV", "USD", "22", "0"]])
+        event = {'Records': [{'s3': {'bucket': {'name': BUCKET_NAME}, 'object': {'key': 'Reports/2025-07-25.csv'}}}]}
+        response = ttlambda.lambda_handler(event, None)
+        self.assertEqual(response['statusCode'], 500)
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnnyDoe2025'}})
+        self.assertNotIn("Item", response)
+
+    def test_read_csv_rows(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        # Excel exports start with a byte order mark and use CRLF, including inside quoted fields
+        body = '\ufeffPerson,Project,Hours\r\n"Doe, John","CLIENT\r\n-- DEV",8\r\n"Parker, Peter",BYTERATIO OH_BR -- OH_BR,2\r\n'
+        s3.put_object(Bucket=BUCKET_NAME, Key="Reports/2025-07-25.csv", Body=body.encode('utf-8'))
+
+        rows = list(ttlambda.readCSVRows("Reports/2025-07-25.csv"))
+        self.assertEqual(rows, [
+            {'Person': "Doe, John", 'Project': "CLIENT\r\n-- DEV", 'Hours': "8"},
+            {'Person': "Parker, Peter", 'Project': "BYTERATIO OH_BR -- OH_BR", 'Hours': "2"}
+        ])
+
+    def test_get_hours_chunked(self):
+        # An employee's rows are split across chunks and still land in one total
+        self.uploadReport("Reports/2025-07-25.csv", [
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "20", "0"],
+            ["ByteRatio", "Banner, Bruce", "CLIENT -- DEV", "USD", "38", "0"],
+            ["ByteRatio", "Doe, John", "BYTERATIO OH_BR -- OH_BR", "USD", "4", "0"],
+            ["ByteRatio", "Doe, John", "CLIENT -- TEST", "USD", "12.5", "0"],
+            ["ByteRatio", "Banner, Bruce", "PARENTAL LEAVE", "USD", "2", "0"]
+        ])
+        with patch.object(ttlambda, 'CSV_CHUNK_ROWS', 2):
+            chunks = list(ttlambda.readCSV("Reports/2025-07-25.csv", ttlambda.REPORT_COLUMNS))
+            self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+            self.assertEqual(list(chunks[0].columns), ['Person', 'Project', 'Hours'])
+            ttlambda.getHours(REPORT_PREFIX)
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(response["Item"]["Direct30"]["N"], "32.5")
+        self.assertEqual(response["Item"]["Indirect30"]["N"], "4.0")
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'BruceBanner2025'}})
+        self.assertEqual(response["Item"]["Direct30"]["N"], "38.0")
+        self.assertEqual(response["Item"]["Indirect30"]["N"], "2.0")
+
+    def test_lambda_handler_event_key(self):
+        self.uploadReport("Reports/2025-07-18.csv", [["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "11", "0"]])
+        self.uploadReport("Reports/2025-07-25.csv", [["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "22", "0"]])
+
+        # Only the file named in the event is read, even though it isn't the first one listed
+        event = {'Records': [{'s3': {'bucket': {'name': BUCKET_NAME}, 'object': {'key': 'Reports/2025-07-25.csv'}}}]}
+        response = ttlambda.lambda_handler(event, None)
+        self.assertEqual(response['statusCode'], 200)
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(response["Item"]["Direct30"]["N"], "22.0")
+        self.assertEqual(response["Item"]["Direct29"]["N"], "13.75")
+
+        # Object keys in S3 events are URL encoded
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.put_object(Bucket=BUCKET_NAME, Key="Names/Name List.csv", Body=b"Unanet Name,Microsoft Name\nJohnny Doe,John Doe\n")
+        s3.put_object(Bucket=BUCKET_NAME, Key="Names/later.csv", Body=b"Unanet Name,Microsoft Name\n")
+        event = {'Records': [{'s3': {'bucket': {'name': BUCKET_NAME}, 'object': {'key': 'Names/Name+List.csv'}}}]}
+        response = ttlambda.lambda_handler(event, None)
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(ttlambda.getCorrectNames(), {"Johnny Doe": "John Doe"})
+
+        # Only the processed file is removed
+        keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix="Names/")['Contents']]
+        self.assertEqual(keys, ["Names/later.csv"])
+
+    def test_ingest_report_file(self):
+        with tempfile.TemporaryDirectory() as reportDir:
+            reportPath = os.path.join(reportDir, "report.csv")
+            with open(reportPath, 'w') as reportFile:
+                reportFile.write('Person Organization,Person,Project,TransactionCurrency,Hours,TimeTC\n')
+                reportFile.write('ByteRatio,"Doe, John",CLIENT -- DEV,USD,30,0\n')
+                reportFile.write('ByteRatio,"Doe, John",BYTERATIO OH_BR -- OH_BR,USD,4,0\n')
+            ttlambda.ingestReportFile(reportPath, date(2025, 7, 25))
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(response["Item"]["Direct30"]["N"], "30.0")
+        self.assertEqual(response["Item"]["Indirect30"]["N"], "4.0")
+
+        weeks = {
+            "2025-08-01": pd.DataFrame({'Person': ["Doe, John"], 'Project': ["CLIENT -- DEV"], 'Hours': [12.5]}),
+            "2024-12-31": pd.DataFrame({'Person': ["Banner, Bruce"], 'Project': ["CLIENT -- DEV"], 'Hours': [16]})
+        }
+        self.assertEqual(ttlambda.ingestWeeklyReports(weeks), [(2024, 53), (2025, 31)])
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(response["Item"]["Direct31"]["N"], "12.5")
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'BruceBanner2024'}})
+        self.assertEqual(response["Item"]["Direct53"]["N"], "16.0")
+
+    def test_lambda_handler_profile(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET_NAME)
+
+        # Without the flag the profilers are never started
+        with patch('cProfile.Profile') as mockProfile:
+            response = ttlambda.lambda_handler({"deleteS3": "AUTO"}, None)
+        self.assertEqual(response['statusCode'], 200)
+        mockProfile.assert_not_called()
+        self.assertNotIn('Contents', s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix="Diagnostics/"))
+
+        self.uploadReport("Auto/2025-07-25.csv", [["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "22", "0"]])
+
+        event = {"tt-auto": "LambdaUseOnly", "key": "Auto/2025-07-25.csv", "username": USERNAME, "password": PASSWORD, "profile": True}
+        response = ttlambda.lambda_handler(event, None)
+        self.assertEqual(response['statusCode'], 200)
+
+        keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix="Diagnostics/tt-auto/")['Contents']]
+        self.assertEqual(sorted(key.split("/")[-1] for key in keys), ["profile.pstats", "summary.txt"])
+        summaryKey = [key for key in keys if key.endswith("summary.txt")][0]
+        summary = s3.get_object(Bucket=BUCKET_NAME, Key=summaryKey)['Body'].read().decode('utf-8')
+        self.assertIn("getHours", summary)
+        self.assertIn("Peak traced memory", summary)
+
+        # The raw profile loads with pstats
+        profileKey = [key for key in keys if key.endswith("profile.pstats")][0]
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "profile.pstats")
+            with open(path, 'wb') as profileFile:
+                profileFile.write(s3.get_object(Bucket=BUCKET_NAME, Key=profileKey)['Body'].read())
+            stats = pstats.Stats(path)
+        self.assertTrue(any(function[2] == "ingestWeeks" for function in stats.stats))
+
+    def test_lambda_handler_auto_key(self):
+        self.uploadReport("Auto/2025-07-18.csv", [["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "11", "0"]])
+        self.uploadReport("Auto/2025-07-25.csv", [["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "22", "0"]])
+
+        event = {"tt-auto": "LambdaUseOnly", "key": "Auto/2025-07-25.csv", "username": USERNAME, "password": PASSWORD}
+        with patch('builtins.print') as mockPrint:
+            response = ttlambda.lambda_handler(event, None)
+        self.assertEqual(response['statusCode'], 200)
+
+        # The invocation's metrics record covers every stage of the ingest
+        record = json.loads(mockPrint.call_args_list[-1].args[0])
+        self.assertEqual(record["route"], "tt-auto")
+        self.assertEqual(record["rows"], 1)
+        self.assertEqual(record["employees"], 1)
+        # The week's write, then the one-off YTD backfill because JohnDoe2025 predates running totals
+        self.assertEqual(record["dynamoWrites"], 2)
+        self.assertGreater(record["writeCapacityUnits"], 0)
+        for stage in ["s3FetchMs", "parseMs", "referenceLoadMs", "dynamoReadMs", "dynamoWriteMs"]:
+            self.assertIn(stage, record)
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(response["Item"]["Direct30"]["N"], "22.0")
+
+        # Each week has its own key. Only the one that was read is removed
+        s3 = boto3.client('s3', region_name='us-east-1')
+        keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix="Auto/")['Contents']]
+        self.assertEqual(keys, ["Auto/", "Auto/2025-07-18.csv"])
+
+    def test_lambda_handler_batched_records(self):
+        self.uploadReport("Reports/2025-07-18.csv", [["ByteRatio", "Doe, Johnny", "CLIENT -- DEV", "USD", "11", "0"]])
+        self.uploadReport("Reports/2025-07-25.csv", [["ByteRatio", "Doe, Johnny", "CLIENT -- DEV", "USD", "22", "0"]])
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.put_object(Bucket=BUCKET_NAME, Key="Names/names.csv", Body=b"Unanet Name,Microsoft Name\nJohnny Doe,John Doe\n")
+
+        def record(key):
+            return {'s3': {'bucket': {'name': BUCKET_NAME}, 'object': {'key': key}}}
+        # The names file arrives last but is applied before the reports are read
+        event = {'Records': [record("Reports/2025-07-18.csv"), record("Reports/missing.csv"), record("Reports/2025-07-25.csv"), record("Names/names.csv")]}
+        response = ttlambda.lambda_handler(event, None)
+
+        self.assertEqual(response['statusCode'], 500)
+        results = {result['key']: result['statusCode'] for result in response['results']}
+        self.assertEqual(results, {"Names/names.csv": 200, "Reports/2025-07-18.csv": 200, "Reports/missing.csv": 500, "Reports/2025-07-25.csv": 200})
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(response["Item"]["Direct29"]["N"], "11.0")
+        self.assertEqual(response["Item"]["Direct30"]["N"], "22.0")
+
+    def test_lambda_handler_diagnostics_record(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        s3.put_object(Bucket=BUCKET_NAME, Key=ttlambda.DIAGNOSTICS_PREFIX + "Records/20250725/summary.json", Body=b"{}")
+        s3.put_object(Bucket=BUCKET_NAME, Key="Other/notes.csv", Body=b"Person,Target\n")
+
+        def record(key):
+            return {'s3': {'bucket': {'name': BUCKET_NAME}, 'object': {'key': key}}}
+        # A profile upload is skipped instead of being read as a targets file
+        with patch.object(ttlambda, 'getTargets') as mockTargets:
+            response = ttlambda.lambda_handler({'Records': [record(ttlambda.DIAGNOSTICS_PREFIX + "Records/20250725/summary.json")]}, None)
+            self.assertEqual(response['statusCode'], 200)
+            self.assertEqual(response['results'][0]['body'], 'Diagnostics are not read')
+
+            # Unknown folders fail rather than falling through to the targets parser
+            response = ttlambda.lambda_handler({'Records': [record("Other/notes.csv")]}, None)
+            self.assertEqual(response['statusCode'], 500)
+            self.assertEqual(response['results'][0]['statusCode'], 400)
+        mockTargets.assert_not_called()
+
+    def test_delete_s3(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        s3.put_object(Bucket=BUCKET_NAME, Key=AUTO_PREFIX, Body=b"")
+        s3.put_object(Bucket=BUCKET_NAME, Key=REPORT_PREFIX + "2025-07-25.csv", Body=b"")
+        # More files than a single listing or DeleteObjects request can hold
+        for i in range(1205):
+            s3.put_object(Bucket=BUCKET_NAME, Key=AUTO_PREFIX + str(i) + ".csv", Body=b"")
+
+        response = ttlambda.deleteS3(AUTO_PREFIX)
+        self.assertEqual(response['statusCode'], 200)
+
+        keys = []
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=BUCKET_NAME):
+            keys += [obj['Key'] for obj in page.get('Contents', [])]
+        # The folder itself and other prefixes are kept
+        self.assertEqual(sorted(keys), [AUTO_PREFIX, REPORT_PREFIX + "2025-07-25.csv"])
+
+    def test_get_hours_batch(self):
+        self.uploadReport("Batch/run1/2025-07-18.csv", [
+            ["ByteRatio", "Doe, John", "CLIENT -- DEV", "USD", "11", "0"],
+            ["ByteRatio", "Banner, Bruce", "CLIENT -- DEV", "USD", "30", "0"]
+        ])
+        self.uploadReport("Batch/run1/2025-07-25.csv", [["ByteRatio", "Doe, John", "BYTERATIO OH_BR -- OH_BR", "USD", "22", "0"]])
+
+        # Archives of weekly reports are read too, including the Dec 31 week
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zipped:
+            zipped.writestr("2024-12-31.csv", "Person,Project,Hours\n\"Banner, Bruce\",CLIENT -- DEV,16\n")
+            zipped.writestr("2025-01-03.csv", "Person,Project,Hours\n\"Banner, Bruce\",CLIENT -- DEV,24\n")
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.put_object(Bucket=BUCKET_NAME, Key="Batch/run1/older.zip", Body=archive.getvalue())
+
+        event = {"tt-batch": "Batch/run1/", "username": USERNAME, "password": PASSWORD}
+        with patch('builtins.print') as mockPrint:
+            response = ttlambda.lambda_handler(event, None)
+        self.assertEqual(response, {'statusCode': 200, 'body': 'Read 4 weeks successfully!'})
+
+        # Employees are counted once for the run, not once per week they appear in
+        record = json.loads(mockPrint.call_args_list[-1].args[0])
+        self.assertEqual(record["rows"], 5)
+        self.assertEqual(record["employees"], 3)
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'JohnDoe2025'}})
+        self.assertEqual(response["Item"]["Direct29"]["N"], "11.0")
+        self.assertEqual(response["Item"]["Direct30"]["N"], "0.0")
+        self.assertEqual(response["Item"]["Indirect30"]["N"], "22.0")
+
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'BruceBanner2025'}})
+        self.assertEqual(response["Item"]["Direct1"]["N"], "24.0")
+        self.assertEqual(response["Item"]["Direct29"]["N"], "30.0")
+        self.assertEqual(float(response["Item"]["DirectYTD"]["N"]), 54)
+        response = self.dynamodb.get_item(TableName=DYNAMO_TABLE, Key={'ID': {'S': 'BruceBanner2024'}})
+        self.assertEqual(response["Item"]["Direct53"]["N"], "16.0")
+
+        # The run folder is cleared once it has been read
+        self.assertNotIn('Contents', s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix="Batch/run1/"))
+
+        event = {"tt-batch": "Reports/", "username": USERNAME, "password": PASSWORD}
+        self.assertEqual(ttlambda.lambda_handler(event, None)['statusCode'], 500)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file